@@ -0,0 +1,518 @@
+'''
+Rerun's main loop, on asyncio. Watching for changes, running the command, and
+reading keypresses are concurrent tasks, so each is handled as soon as it
+happens, rather than waiting for the others. This can also be used from other
+asyncio programs, e.g:
+
+    async for changed_files, first_time in watch(options, watcher):
+        returncode = await run_command('pytest', shell)
+
+or to do everything rerun does, until cancelled:
+
+    await rerun(options)
+'''
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from .changes import get_env
+from .rerun import (
+    act, change_tracker, get_change_variables, get_changes, is_group_alive,
+    show_command, show_status, STOP_GRACE,
+)
+from .output import OutputHistory, Tee
+from .watchers import get_watcher
+
+
+# Keys to type at the terminal, followed by Enter, while the command isn't
+# running.
+KEY_RUN = ''
+KEY_QUIT = 'q'
+# With --keep-output, shows the lines of the last run that weren't in the one
+# before.
+KEY_DIFF = 'd'
+
+
+async def watch(options, watcher):
+    '''
+    Yields (changed_files, first_time) whenever files change, starting with
+    all the files there are. Blocking calls to the watcher are made in a
+    thread, so the event loop is free to do other things meanwhile.
+    '''
+    loop = asyncio.get_running_loop()
+    first_time = True
+    while True:
+        changed_files, was_first_time = await loop.run_in_executor(
+            None, get_changes, options, watcher, first_time)
+        first_time = False
+        if changed_files:
+            yield changed_files, was_first_time
+        else:
+            await loop.run_in_executor(None, watcher.wait)
+
+
+async def stop_process(process, grace=STOP_GRACE, group=True):
+    '''
+    Sends SIGTERM to the process's whole process group, then SIGKILL to
+    whatever is left of it after 'grace' seconds. If the process isn't in a
+    group of its own, it shares ours, so it has had any Ctrl-C we had, and is
+    given 'grace' seconds to exit by itself before being sent SIGTERM.
+    '''
+    if not group:
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+            return
+        except asyncio.TimeoutError:
+            pass
+    if not group or not hasattr(os, 'killpg'):
+        # Windows has no process groups to signal.
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + grace
+    if is_group_alive(process.pid):
+        os.killpg(process.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        pass
+    while is_group_alive(process.pid) and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    if is_group_alive(process.pid):
+        os.killpg(process.pid, signal.SIGKILL)
+    await process.wait()
+
+
+async def run_command(
+    command, shell, output=None, env=None, new_session=False,
+):
+    '''
+    Runs the command, and returns its exit status. If 'output' is given, it
+    is called with each chunk of the command's stdout and stderr as it
+    arrives, otherwise they go to ours. If cancelled, stops the command.
+
+    The command runs in our process group, so that Ctrl-C reaches it, and it
+    can use the terminal, unless 'new_session', as for --restart, when it
+    leads a group of its own, so that everything it started can be stopped
+    along with it.
+    '''
+    pipes = {}
+    if output is not None:
+        pipes = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    process = await asyncio.create_subprocess_shell(
+        command, executable=shell, start_new_session=new_session, env=env,
+        **pipes)
+    try:
+        if output is not None:
+            while True:
+                chunk = await process.stdout.read(64 * 1024)
+                if not chunk:
+                    break
+                output(chunk)
+        return await process.wait()
+    except asyncio.CancelledError:
+        await stop_process(process, group=new_session)
+        raise
+
+
+def get_binary_stdout():
+    # Test runners may replace stdout with something that has no buffer.
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+class KeyReader(object):
+    '''
+    Reads lines typed at the terminal, without blocking the event loop.
+    '''
+    def __init__(self, fd):
+        self.fd = fd
+        self.lines = asyncio.Queue()
+        self.buffer = b''
+        self.reading = False
+
+    @staticmethod
+    def is_available(options):
+        # An interactive shell needs the terminal to itself.
+        return (
+            not options.interactive and
+            sys.platform != 'win32' and
+            sys.stdin is not None and
+            sys.stdin.isatty()
+        )
+
+    def _on_readable(self):
+        data = os.read(self.fd, 1024)
+        if not data:
+            self.pause()
+            return
+        self.buffer += data
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            self.lines.put_nowait(line.decode('utf-8', 'replace').strip())
+
+    def resume(self):
+        if not self.reading:
+            asyncio.get_running_loop().add_reader(self.fd, self._on_readable)
+            self.reading = True
+
+    def pause(self):
+        '''
+        Stops reading, so that the command can read the terminal instead.
+        '''
+        if self.reading:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            self.reading = False
+
+
+class Rerunner(object):
+    '''
+    Runs the command whenever files change. If files change while it runs, it
+    is run again when it finishes, or with --restart, is stopped and run again
+    straight away. With a control.ControlServer, what happens is published to
+    its clients, and their requests are acted on. With a record.RunRecord,
+    each run is saved to it.
+    '''
+    def __init__(
+        self, options, watcher, keys=None, stats=None, history=None,
+        worker=None, control=None, record=None, snapshot=None,
+    ):
+        self.options = options
+        self.watcher = watcher
+        self.keys = keys
+        self.stats = stats
+        self.history = history
+        self.worker = worker
+        self.control = control
+        self.record = record
+        self.snapshot = snapshot
+        self.command = None
+        self.queued = None
+        self.last = None
+        self.paused = False
+        # Whether clients have added ignore patterns, which files already
+        # being watched must be checked against.
+        self.ignoring = False
+
+    def _publish(self, event, **details):
+        if self.control is not None:
+            self.control.publish(event, **details)
+
+    def _start(self, changed_files, first_time):
+        self.last = (changed_files, first_time)
+        if self.keys:
+            self.keys.pause()
+        self.command = asyncio.ensure_future(
+            self._act(changed_files, first_time))
+
+    async def _act(self, changed_files, first_time):
+        self._publish('started', files=changed_files)
+        start = time.time()
+        run = None
+        if self.stats is not None:
+            run = self.stats.start_run(changed_files, first_time)
+        recorded = None
+        if self.record is not None:
+            recorded = self.record.start_run()
+        taken = None
+        try:
+            if self.snapshot is not None:
+                loop = asyncio.get_running_loop()
+                taken = await loop.run_in_executor(
+                    None, self.snapshot.start_run, changed_files, first_time)
+            returncode = await self._run(changed_files, first_time)
+        except asyncio.CancelledError:
+            self._publish('stopped', files=changed_files)
+            raise
+        finally:
+            if run is not None:
+                self.stats.end_run(run, changed_files)
+        if taken is not None:
+            self.snapshot.end_run(taken)
+        if recorded is not None:
+            self.record.end_run(
+                recorded, self.options.command or self.options.config,
+                changed_files, first_time, returncode,
+            )
+        self._publish(
+            'finished', files=changed_files, returncode=returncode,
+            seconds=round(time.time() - start, 3),
+        )
+
+    async def _run(self, changed_files, first_time):
+        options = self.options
+        start = time.time()
+        if options.rules or options.interactive:
+            # These run their commands in the foreground.
+            loop = asyncio.get_running_loop()
+            returncode = await loop.run_in_executor(
+                None, act, changed_files, options, first_time)
+        else:
+            command = show_command(changed_files, options, first_time)
+            if command is None:
+                return None
+            variables = get_change_variables(changed_files, first_time)
+            try:
+                returncode = await self._run_command(
+                    command, changed_files, variables)
+            except OSError as exc:
+                # Such as a command too long for the OS.
+                sys.stderr.write(
+                    'rerun: cannot run the command: %s\n' % (exc,))
+                returncode = 1
+        show_status(returncode, time.time() - start, options)
+        return returncode
+
+    async def _run_command(self, command, changed_files, variables):
+        if self.worker is not None:
+            return await self._run_in_worker(command, changed_files, variables)
+        env = get_env(variables)
+        new_session = self.options.restart
+        if self.history is None:
+            return await run_command(
+                command, self.options.shell, env=env, new_session=new_session)
+        previous = self.history.previous()
+        sys.stdout.flush()
+        tee = Tee(
+            self.history.start(), get_binary_stdout(), previous,
+            self.options.diff,
+        )
+        try:
+            return await run_command(
+                command, self.options.shell, tee, env, new_session)
+        finally:
+            tee.close()
+
+    async def _run_in_worker(self, command, changed_files, variables):
+        from .worker import WorkerError
+        try:
+            return await self.worker.run(command, changed_files, variables)
+        except WorkerError as exc:
+            sys.stderr.write('rerun: %s\n' % (exc,))
+            return 1
+
+    def _show_diff(self):
+        if self.history is None:
+            return
+        stream = get_binary_stdout()
+        if len(self.history.runs) < 2:
+            stream.write(b'rerun: no previous run to compare with.\n')
+        else:
+            stream.write(
+                b"rerun: lines that weren't in the previous run's output:\n")
+            for line in self.history.new_lines():
+                stream.write(line + b'\n')
+        stream.flush()
+
+    async def _stop(self):
+        self.command.cancel()
+        try:
+            await self.command
+        except asyncio.CancelledError:
+            pass
+        self.command = None
+
+    def _queue(self, changed_files, first_time):
+        if self.queued is None:
+            self.queued = (changed_files, first_time)
+        else:
+            # Both runs would be after the current one finishes, so merge them.
+            self.queued = (
+                sorted(set(self.queued[0]) | set(changed_files)),
+                self.queued[1] and first_time,
+            )
+
+    def _unignored(self, changed_files):
+        if not self.ignoring:
+            return changed_files
+        matcher = self.watcher.matcher
+        return [
+            filename for filename in changed_files
+            if not matcher.ignores_path(filename)
+        ]
+
+    def _on_change(self, changed_files, first_time):
+        changed_files = self._unignored(changed_files)
+        if not changed_files:
+            return False
+        self._publish('changed', files=changed_files, first_time=first_time)
+        if self.paused:
+            self._queue(changed_files, first_time)
+        elif self.command is None:
+            self._start(changed_files, first_time)
+        elif self.options.restart:
+            # The stopped run's files haven't been run on yet, so they're run
+            # on again, and if it was the first run, so is this.
+            stopped_files, stopped_first_time = self.last
+            self.queued = (
+                sorted(set(stopped_files) | set(changed_files)),
+                stopped_first_time or first_time,
+            )
+            return True
+        else:
+            self._queue(changed_files, first_time)
+        return False
+
+    def _on_request(self, client, request):
+        '''
+        Acts on a request from a control client, and replies to it.
+        '''
+        name = request['request']
+        if name == 'trigger':
+            if self.last is None:
+                self.control.reply(client, name, 'Nothing to run yet.')
+                return
+            if self.command is None:
+                self._start(*self.last)
+            else:
+                self._queue(*self.last)
+        elif name == 'pause':
+            self.paused = True
+            self._publish('paused')
+        elif name == 'resume':
+            self.paused = False
+            self._publish('resumed')
+        elif name == 'ignore':
+            self.watcher.matcher.add([request['pattern']])
+            self.ignoring = True
+            if self.queued is not None:
+                changed_files = self._unignored(self.queued[0])
+                self.queued = (
+                    (changed_files, self.queued[1]) if changed_files else None)
+            self._publish('ignored', pattern=request['pattern'])
+        self.control.reply(client, name)
+
+    async def run(self):
+        changes = watch(self.options, self.watcher).__aiter__()
+        next_change = asyncio.ensure_future(changes.__anext__())
+        next_key = None
+        if self.keys:
+            self.keys.resume()
+            next_key = asyncio.ensure_future(self.keys.lines.get())
+        next_request = None
+        if self.control:
+            next_request = asyncio.ensure_future(self.control.requests.get())
+        try:
+            while True:
+                waiting = set([next_change])
+                if self.command is not None:
+                    waiting.add(self.command)
+                if next_key is not None:
+                    waiting.add(next_key)
+                if next_request is not None:
+                    waiting.add(next_request)
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                if next_change in done:
+                    restart = self._on_change(*next_change.result())
+                    next_change = asyncio.ensure_future(changes.__anext__())
+                    if restart:
+                        await self._stop()
+
+                if self.command is not None and self.command.done():
+                    self.command.result()
+                    self.command = None
+                    if self.keys:
+                        self.keys.resume()
+
+                if next_key is not None and next_key in done:
+                    key = next_key.result()
+                    next_key = asyncio.ensure_future(self.keys.lines.get())
+                    if key == KEY_QUIT:
+                        return
+                    if key == KEY_RUN and self.command is None and self.last:
+                        self._start(*self.last)
+                    if key == KEY_DIFF and self.command is None:
+                        self._show_diff()
+
+                if next_request is not None and next_request in done:
+                    self._on_request(*next_request.result())
+                    next_request = asyncio.ensure_future(
+                        self.control.requests.get())
+
+                if (
+                    self.command is None and self.queued is not None and
+                    not self.paused
+                ):
+                    self._start(*self.queued)
+                    self.queued = None
+        finally:
+            for task in (next_change, next_key, next_request):
+                if task is not None:
+                    task.cancel()
+            # The generator can't be closed while it's waiting on the watcher.
+            await asyncio.gather(next_change, return_exceptions=True)
+            if self.keys:
+                self.keys.pause()
+            if self.command is not None:
+                await self._stop()
+            await changes.aclose()
+
+
+async def rerun(options, watcher=None):
+    '''
+    Watches for changes and runs the command, until cancelled, or the user
+    types 'q'. Creates a watcher from the options if one isn't given.
+    '''
+    control = None
+    if options.control:
+        from .control import ControlError, ControlServer
+        control = ControlServer(options.control)
+        try:
+            await control.start()
+        except (ControlError, OSError) as exc:
+            sys.exit('rerun: cannot listen on %s: %s' % (options.control, exc))
+    stats = None
+    if options.stats:
+        from .stats import Stats
+        stats = Stats(options.stats_file)
+    if watcher is None:
+        watcher = get_watcher(options, stats)
+    keys = None
+    if KeyReader.is_available(options):
+        keys = KeyReader(sys.stdin.fileno())
+    history = None
+    runs = max(options.keep_output, 2) if options.diff else options.keep_output
+    if runs:
+        history = OutputHistory(runs)
+    record = None
+    if options.record:
+        from .record import RunRecord
+        record = RunRecord()
+    worker = None
+    if options.python_worker:
+        from .worker import PythonWorker
+        worker = PythonWorker(options)
+    snapshot = None
+    if options.snapshot:
+        from .snapshot import load_snapshot, Snapshot
+        snapshot = Snapshot(load_snapshot())
+    try:
+        await Rerunner(
+            options, watcher, keys, stats, history, worker, control, record,
+            snapshot,
+        ).run()
+    finally:
+        if control:
+            await control.close()
+        if worker:
+            await worker.close()
+        if history:
+            history.close()
+        change_tracker.clean()
+        if snapshot:
+            snapshot.save()
+        watcher.close()
+        if stats:
+            stats.close()
+        if record:
+            record.close()
@@ -0,0 +1,306 @@
+'''
+Measures how fast each watcher finds changes, on synthetic trees of various
+sizes and shapes, so that changes to the hot paths can be checked for speed as
+well as correctness. Run with:
+
+    python -m rerun.bench --files 10000 100000 --output results.json
+
+For each tree and watcher backend, it measures:
+
+    cold        seconds to create the watcher and make the first sweep, which
+                reads every file
+    warm        median seconds for a sweep when nothing has changed
+    latency     median seconds from modifying one file to it being reported,
+                which for 'incremental' is mostly waiting for --stat-interval,
+                and for 'hybrid' is that of a directory without a watch
+    peak_bytes  peak memory allocated by Python during the cold sweep
+
+and for each ignore list, how many paths per second the matcher checks.
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import __version__, inotify, watchers
+from .ignore import IgnoreMatcher
+from .options import get_parser, parse_args
+from .watchers import (
+    get_watcher, IncrementalWatcher, SKIP_DIRS, SKIP_EXT,
+)
+
+
+SHAPES = ['wide', 'deep']
+BACKENDS = ['poll', 'incremental', 'inotify', 'hybrid']
+
+FILES_PER_DIR = 100
+# How many directories deep each chain of directories in a 'deep' tree goes.
+DEPTH = 40
+
+
+def get_dirs(count, shape):
+    '''
+    Returns relative paths of 'count' directories. A 'wide' tree has them
+    all two levels down, while a 'deep' tree nests them in long chains.
+    '''
+    dirs = []
+    for index in range(count):
+        if shape == 'deep':
+            if index % DEPTH == 0:
+                parent = 'chain%d' % (index // DEPTH,)
+            else:
+                parent = dirs[-1]
+            dirs.append(os.path.join(parent, 'd%d' % (index,)))
+        else:
+            dirs.append(os.path.join(
+                'group%d' % (index // FILES_PER_DIR,), 'd%d' % (index,)))
+    return dirs
+
+
+def make_tree(top, files, shape='wide'):
+    '''
+    Creates about 'files' small files under top, FILES_PER_DIR to a directory,
+    plus an ignored node_modules directory of the same size, which a good
+    watcher never looks in. Returns the relative names of the watched files.
+    '''
+    created = []
+    dirs = get_dirs(max(1, files // FILES_PER_DIR), shape)
+    for relative in dirs:
+        for subtree in ('.', 'node_modules'):
+            dirname = os.path.join(top, subtree, relative)
+            os.makedirs(dirname)
+            for index in range(FILES_PER_DIR):
+                filename = os.path.join(dirname, 'f%d.py' % (index,))
+                with open(filename, 'w') as fp:
+                    fp.write('x = %d\n' % (index,))
+                if subtree == '.':
+                    created.append(
+                        os.path.join('.', relative, 'f%d.py' % (index,)))
+    return created
+
+
+def get_ignores(count):
+    '''
+    Returns 'count' ignore patterns, mixing plain names, basename globs and
+    path globs, in the proportions they tend to appear in .gitignore files.
+    None of them match the files from make_tree, so every pattern is tried.
+    '''
+    kinds = ['name%d', '*.ext%d', 'dir%d/**/*.log', 'build%d/', 'out%d/*.o']
+    return [kinds[index % len(kinds)] % (index,) for index in range(count)]
+
+
+def get_options(backend, ignores):
+    '''
+    Returns rerun's default options, for the given backend and ignores.
+    '''
+    args = ['--watcher', backend]
+    for pattern in ignores:
+        args.extend(['--ignore', pattern])
+    parser = get_parser('rerun', SKIP_DIRS, SKIP_EXT)
+    return parse_args(parser, args + ['cmd'])
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def make_watcher(options):
+    # Otherwise, polling would remember the previous run's files.
+    watchers.file_stat_cache.clear()
+    return get_watcher(options)
+
+
+def measure_latency(watcher, filename, timeout=10):
+    '''
+    Modifies the file, then returns how long it takes the watcher to report
+    it.
+    '''
+    with open(filename, 'a') as fp:
+        fp.write('#\n')
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if filename in watcher.get_changed_files():
+            return time.perf_counter() - start
+        watcher.wait(0.001)
+    raise RuntimeError('%s was never reported as changed.' % (filename,))
+
+
+def bench_backend(backend, files, ignores, repeat):
+    '''
+    Returns the measurements for one backend, on the tree in cwd.
+    '''
+    options = get_options(backend, ignores)
+
+    tracemalloc.start()
+    try:
+        watcher = make_watcher(options)
+        watcher.get_changed_files()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    watcher.close()
+
+    start = time.perf_counter()
+    watcher = make_watcher(options)
+    try:
+        watcher.get_changed_files()
+        cold = time.perf_counter() - start
+        warm = []
+        for _ in range(repeat):
+            seconds, changed = time_call(watcher.get_changed_files)
+            if changed:
+                raise RuntimeError('Unexpected changes: %s' % (changed[:5],))
+            warm.append(seconds)
+        latency = [
+            measure_latency(watcher, files[(index * 7919) % len(files)])
+            for index in range(repeat)
+        ]
+    finally:
+        watcher.close()
+    return dict(
+        cold=cold,
+        warm=statistics.median(warm),
+        latency=statistics.median(latency),
+        peak_bytes=peak_bytes,
+    )
+
+
+def bench_matcher(paths, ignores, repeat):
+    '''
+    Returns how many paths per second the matcher checks, against the given
+    number of ignore patterns.
+    '''
+    matcher = IgnoreMatcher(SKIP_DIRS + get_ignores(ignores), SKIP_EXT)
+    best = None
+    for _ in range(repeat):
+        seconds, _ = time_call(
+            lambda: [matcher.ignores_file(path) for path in paths])
+        best = seconds if best is None else min(best, seconds)
+    return dict(paths_per_second=len(paths) / best if best else None)
+
+
+def get_available_backends(backends):
+    return [
+        backend for backend in backends
+        if backend not in ('hybrid', 'inotify') or inotify.is_available()
+    ]
+
+
+def run_benchmarks(
+    sizes, shapes, backends, ignore_counts, repeat=5, report=None,
+):
+    '''
+    Runs every combination of the given parameters in a temporary directory,
+    returning a list of results, each a dict of parameters and measurements.
+    'report' is called with each result as it is made.
+    '''
+    results = []
+    orig = os.getcwd()
+    for files in sizes:
+        for shape in shapes:
+            tempdir = tempfile.mkdtemp(prefix='rerun-bench-')
+            try:
+                created = make_tree(tempdir, files, shape)
+                # Let the new directories' mtimes settle, as they would in a
+                # real tree, or IncrementalWatcher would keep re-listing them.
+                time.sleep(IncrementalWatcher.RACY_SECONDS)
+                os.chdir(tempdir)
+                for ignores in ignore_counts:
+                    params = dict(
+                        files=len(created), shape=shape, ignores=ignores)
+                    for backend in get_available_backends(backends):
+                        result = dict(params, benchmark='watcher',
+                            backend=backend)
+                        result.update(bench_backend(
+                            backend, created, get_ignores(ignores), repeat))
+                        results.append(result)
+                        if report:
+                            report(result)
+                    result = dict(params, benchmark='matcher')
+                    result.update(bench_matcher(created, ignores, repeat))
+                    results.append(result)
+                    if report:
+                        report(result)
+            finally:
+                os.chdir(orig)
+                shutil.rmtree(tempdir)
+    return results
+
+
+def format_result(result):
+    line = '%-8s %8d files %-5s %4d ignores' % (
+        result['benchmark'], result['files'], result['shape'],
+        result['ignores'],
+    )
+    if result['benchmark'] == 'matcher':
+        return '%s %-12s %10.0f paths/s' % (
+            line, '', result['paths_per_second'] or 0)
+    return (
+        '%s %-12s cold %8.4fs  warm %8.4fs  latency %8.4fs  peak %6.1fMB' % (
+            line, result['backend'], result['cold'], result['warm'],
+            result['latency'], result['peak_bytes'] / 1e6,
+        )
+    )
+
+
+def get_bench_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m rerun.bench', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--files',
+        nargs='+', type=int, default=[10000], metavar='N',
+        help='Numbers of files in each tree. Defaults to %(default)s.')
+    parser.add_argument('--shape',
+        nargs='+', choices=SHAPES, default=SHAPES,
+        help='Shapes of tree. Defaults to %(default)s.')
+    parser.add_argument('--backend',
+        nargs='+', choices=BACKENDS, default=BACKENDS,
+        help='Watchers to measure. Defaults to all available ones.')
+    parser.add_argument('--ignores',
+        nargs='+', type=int, default=[0, 500], metavar='N',
+        help='Numbers of ignore patterns. Defaults to %(default)s.')
+    parser.add_argument('--repeat',
+        type=int, default=5, metavar='N',
+        help='How many times to repeat each timing. Defaults to %(default)s.')
+    parser.add_argument('--output', '-o',
+        metavar='FILE',
+        help='Write the results to this file, as JSON.')
+    return parser
+
+
+def main(args=None):
+    options = get_bench_parser().parse_args(args)
+
+    def report(result):
+        sys.stderr.write(format_result(result) + '\n')
+
+    results = run_benchmarks(
+        options.files, options.shape, options.backend, options.ignores,
+        options.repeat, report,
+    )
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(
+                dict(
+                    rerun=__version__,
+                    python=platform.python_version(),
+                    platform=platform.platform(),
+                    time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    results=results,
+                ),
+                fp, indent=2, sort_keys=True,
+            )
+            fp.write('\n')
+
+
+if __name__ == '__main__':
+    main()
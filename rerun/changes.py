@@ -0,0 +1,138 @@
+'''
+Tells the command which files changed, so that it can work on just those,
+rather than looking through everything again. Each run, the environment
+lists the changed files, and which of them were added, modified or deleted
+since the command last ran, one per line:
+
+    RERUN_CHANGED_FILES
+    RERUN_ADDED_FILES
+    RERUN_MODIFIED_FILES
+    RERUN_DELETED_FILES
+
+A list too long for the environment is written to a temporary file instead,
+with each filename followed by a NUL, for 'xargs -0', and the variable with
+'_LIST' on the end of its name, e.g. RERUN_CHANGED_FILES_LIST, is set to the
+file's name. The files are removed when the next run starts, or rerun
+exits.
+'''
+import os
+
+
+KINDS = ('CHANGED', 'ADDED', 'MODIFIED', 'DELETED')
+
+# The longest list to put in the environment. Linux allows 128KB for each
+# variable, and 2MB for everything, including the command's arguments.
+ENV_LIMIT = 32 * 1024
+
+
+def get_variable_names():
+    names = []
+    for kind in KINDS:
+        names.append('RERUN_%s_FILES' % (kind,))
+        names.append('RERUN_%s_FILES_LIST' % (kind,))
+    return names
+
+
+def get_env(variables):
+    '''
+    Returns a copy of our environment, with the given variables, and without
+    any others of ours, such as those set by a rerun which is running us.
+    '''
+    env = dict(os.environ)
+    for name in get_variable_names():
+        env.pop(name, None)
+    env.update(variables)
+    return env
+
+
+class Changes(object):
+    '''
+    The files which changed before a run, by how they changed.
+    '''
+    def __init__(self, added=(), modified=(), deleted=()):
+        self.added = list(added)
+        self.modified = list(modified)
+        self.deleted = list(deleted)
+
+    def changed(self):
+        return sorted(self.added + self.modified + self.deleted)
+
+    def select(self, filenames):
+        '''
+        Returns the changes to just the given files.
+        '''
+        selected = set(filenames)
+        return Changes(
+            [name for name in self.added if name in selected],
+            [name for name in self.modified if name in selected],
+            [name for name in self.deleted if name in selected],
+        )
+
+
+class ChangeTracker(object):
+    '''
+    Tells which changed files were added, modified or deleted since the
+    command last ran, by remembering which files existed then. Like the
+    output of runs, only a hash of each filename is kept.
+    '''
+    def __init__(self):
+        self.known = set()
+        self.lists = []
+
+    def classify(self, changed_files, first_time):
+        '''
+        Returns the Changes for a run. The first time, when the changed files
+        are all the files there are, they all count as added.
+        '''
+        if first_time:
+            self.known = set()
+        changes = Changes()
+        for filename in changed_files:
+            key = hash(filename)
+            if not os.path.lexists(filename):
+                changes.deleted.append(filename)
+                self.known.discard(key)
+            elif key in self.known:
+                changes.modified.append(filename)
+            else:
+                changes.added.append(filename)
+                self.known.add(key)
+        return changes
+
+    def _write_list(self, filenames):
+        # Imported here, as it's slow to import, and rarely needed.
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix='rerun-', suffix='.list')
+        with os.fdopen(fd, 'wb') as fp:
+            for filename in filenames:
+                fp.write(os.fsencode(filename) + b'\0')
+        self.lists.append(path)
+        return path
+
+    def get_variables(self, changes):
+        '''
+        Returns the environment variables which describe the changes.
+        '''
+        variables = {}
+        for kind, filenames in zip(KINDS, [
+            changes.changed(), changes.added, changes.modified,
+            changes.deleted,
+        ]):
+            filenames = sorted(os.path.normpath(name) for name in filenames)
+            text = '\n'.join(filenames)
+            if len(text) <= ENV_LIMIT:
+                variables['RERUN_%s_FILES' % (kind,)] = text
+            else:
+                variables['RERUN_%s_FILES_LIST' % (kind,)] = \
+                    self._write_list(filenames)
+        return variables
+
+    def clean(self):
+        '''
+        Removes the lists written for the last run.
+        '''
+        while self.lists:
+            try:
+                os.unlink(self.lists.pop())
+            except OSError:
+                pass
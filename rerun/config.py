@@ -0,0 +1,179 @@
+'''
+Reads a config file which maps paths to commands, e.g. rerun.toml:
+
+    [[watch]]
+    root = "frontend"
+    patterns = ["*.js", "*.css"]
+    command = "npm run build"
+
+    [[watch]]
+    name = "unit"
+    root = "api"
+    patterns = ["*.py"]
+    command = "pytest api"
+    lock = "db"
+
+    [[watch]]
+    name = "integration"
+    command = "pytest integration"
+    needs = ["unit"]
+
+When files change, only the commands whose root and patterns match them are
+run. Commands run in parallel, except that commands with the same 'lock' are
+run one at a time, and commands wait for the commands they 'need' to pass.
+'''
+import os
+
+from .ignore import IgnoreMatcher
+
+
+CONFIG_FILE = 'rerun.toml'
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Rule(object):
+    '''
+    A command, and the files which trigger it: those under 'root' matching
+    any of 'patterns', which are gitignore-style globs relative to root.
+    'needs' are the names of other rules which must pass before this one runs.
+    A rule's name defaults to its command. The root is made relative to the
+    current directory, where the changed files' names are relative to.
+    '''
+    def __init__(
+        self, command, root='.', patterns=('**',), lock=None, name=None,
+        needs=(),
+    ):
+        self.command = command
+        self.name = name if name is not None else command
+        self.root = os.path.relpath(root)
+        # What the names of the files under root start with.
+        self.prefix = '' if self.root == os.curdir else self.root + os.sep
+        self.patterns = list(patterns)
+        self.lock = lock
+        self.needs = list(needs)
+        self.matcher = IgnoreMatcher(self.patterns, [])
+
+    def __repr__(self):
+        return '<Rule %r>' % (self.command,)
+
+    def select(self, changed_files):
+        '''
+        Returns the changed files which trigger this rule.
+        '''
+        selected = []
+        for filename in changed_files:
+            relname = os.path.normpath(filename)
+            if not relname.startswith(self.prefix):
+                continue
+            relname = relname[len(self.prefix):]
+            if self.matcher.ignores_file(relname):
+                selected.append(filename)
+        return selected
+
+
+KEYS = set(['command', 'lock', 'name', 'needs', 'patterns', 'root'])
+
+
+def _as_list(value):
+    return [value] if isinstance(value, str) else list(value)
+
+
+def check_needs(rules):
+    '''
+    Raises ConfigError if rules need unknown rules, or need each other in a
+    cycle, so that none of them could ever run.
+    '''
+    needs = {}
+    for rule in rules:
+        needs.setdefault(rule.name, []).extend(rule.needs)
+    for rule in rules:
+        for name in rule.needs:
+            if name not in needs:
+                raise ConfigError('%r needs unknown %r.' % (rule.name, name))
+    done = set()
+
+    def visit(name, path):
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ConfigError('Rules need each other: %s' % (
+                ' -> '.join(cycle),))
+        if name not in done:
+            for child in needs[name]:
+                visit(child, path + [name])
+            done.add(name)
+
+    for rule in rules:
+        visit(rule.name, [])
+
+
+def parse_config(data):
+    '''
+    Returns a list of Rules from the given parsed config.
+    '''
+    watches = data.get('watch')
+    if not isinstance(watches, list) or not watches:
+        raise ConfigError('Config has no [[watch]] tables.')
+    rules = []
+    for index, watch in enumerate(watches):
+        command = watch.get('command')
+        if not isinstance(command, str) or not command:
+            raise ConfigError('[[watch]] number %d has no command.' % (
+                index + 1,))
+        unknown = set(watch) - KEYS
+        if unknown:
+            raise ConfigError('[[watch]] number %d has unknown keys: %s' % (
+                index + 1, ', '.join(sorted(unknown))))
+        rule = Rule(
+            command,
+            root=watch.get('root', '.'),
+            patterns=_as_list(watch.get('patterns', ['**'])),
+            lock=watch.get('lock'),
+            name=watch.get('name'),
+            needs=_as_list(watch.get('needs', [])),
+        )
+        if rule.root == os.pardir or rule.root.startswith(os.pardir + os.sep):
+            raise ConfigError(
+                '[[watch]] number %d has a root outside the current '
+                'directory: %r' % (index + 1, watch['root']))
+        if 'name' in watch and rule.name in [other.name for other in rules]:
+            raise ConfigError(
+                '[[watch]] number %d has a duplicate name: %r' % (
+                    index + 1, rule.name))
+        rules.append(rule)
+    check_needs(rules)
+    return rules
+
+
+def get_tomllib():
+    '''
+    Returns the TOML parser, or None if there isn't one. Imported only when a
+    config file is read, so that runs without one don't pay for it.
+    '''
+    try:
+        # Python >= 3.11
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            return None
+    return tomllib
+
+
+def load_config(filename):
+    tomllib = get_tomllib()
+    if tomllib is None:
+        raise ConfigError(
+            'Reading %s needs Python 3.11, or "pip install tomli".' % (
+                filename,))
+    try:
+        with open(filename, 'rb') as fp:
+            data = tomllib.load(fp)
+    except (IOError, OSError) as exc:
+        raise ConfigError('Cannot read %s: %s' % (filename, exc))
+    except tomllib.TOMLDecodeError as exc:
+        raise ConfigError('Cannot parse %s: %s' % (filename, exc))
+    return parse_config(data)
@@ -0,0 +1,194 @@
+'''
+With --control, rerun listens on a Unix socket, or on a port on localhost, so
+that programs such as editors and dashboards can follow what it does, and
+drive it, sharing rerun's view of the tree rather than each looking through
+it themselves. Each message, either way, is a line of JSON.
+
+Every client is sent these events:
+
+    {"event": "changed", "files": [...], "first_time": false}
+    {"event": "started", "files": [...]}
+    {"event": "finished", "files": [...], "returncode": 0, "seconds": 1.25}
+                            returncode is null if nothing was run, e.g. if
+                            no tests were affected by the changed files.
+    {"event": "stopped", "files": [...]}
+                            With --restart, the command was stopped.
+    {"event": "paused"}, {"event": "resumed"}
+    {"event": "ignored", "pattern": "build/"}
+
+and can send these requests:
+
+    {"request": "trigger"}  Runs the command now, for the last changes.
+    {"request": "pause"}    Stops running the command when files change.
+                            Changes are still watched for, and collected.
+    {"request": "resume"}   Runs the command for the changes collected while
+                            paused, if any, and carries on as before.
+    {"request": "ignore", "pattern": "build/"}
+                            Ignores files matching the pattern, as if it had
+                            been given with --ignore.
+
+each of which is answered with {"reply": "trigger", "ok": true}, or with an
+"error" message in place of "ok".
+'''
+import asyncio
+import json
+import os
+import socket
+import stat
+
+
+REQUESTS = ('trigger', 'pause', 'resume', 'ignore')
+
+# Clients which fall this far behind with reading events are disconnected,
+# rather than have their events pile up in memory.
+MAX_BACKLOG = 1024 * 1024
+
+
+class ControlError(Exception):
+    pass
+
+
+def is_port(address):
+    return address.isdigit()
+
+
+def remove_stale_socket(path):
+    '''
+    Removes a Unix socket left behind by a rerun which didn't exit cleanly.
+    Raises ControlError if the path is something else, or is in use.
+    '''
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ControlError('something other than a socket is there.')
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        sock.close()
+    raise ControlError('another process is listening on it.')
+
+
+class ControlServer(object):
+    '''
+    Sends events to every connected client, and puts the requests they send
+    on the 'requests' queue, as (client, request) pairs, for rerun to act on,
+    and answer with reply(). If given, 'greeting' is a coroutine function
+    returning an event to send to each client when it connects, before any
+    others. The greeting can be big, such as the daemon's list of every file,
+    so until the client has read it, it doesn't count towards MAX_BACKLOG.
+    '''
+    def __init__(self, address, greeting=None):
+        self.address = address
+        self.greeting = greeting
+        self.server = None
+        # Of our Unix socket, so that we don't remove another's in its place.
+        self.inode = None
+        self.clients = set()
+        # client -> [bytes of greeting, bytes written in all]
+        self.written = {}
+        self.requests = asyncio.Queue()
+
+    async def start(self):
+        if is_port(self.address):
+            self.server = await asyncio.start_server(
+                self._serve, '127.0.0.1', int(self.address))
+        else:
+            remove_stale_socket(self.address)
+            self.server = await asyncio.start_unix_server(
+                self._serve, self.address)
+            # Only we get to drive our commands.
+            os.chmod(self.address, 0o600)
+            self.inode = os.stat(self.address).st_ino
+
+    async def _serve(self, reader, writer):
+        try:
+            self.written[writer] = [0, 0]
+            if self.greeting is not None:
+                self._send(writer, await self.greeting())
+                self.written[writer][0] = self.written[writer][1]
+            self.clients.add(writer)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self._on_line(writer, line)
+        except (ConnectionError, ValueError):
+            # Disconnected, or sent a line longer than the reader's limit.
+            pass
+        finally:
+            self._drop(writer)
+
+    def _on_line(self, client, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            name = request['request']
+        except (KeyError, TypeError, ValueError):
+            self.reply(client, None, 'Not a JSON object with a "request".')
+            return
+        if name not in REQUESTS:
+            self.reply(client, name, 'Unknown request.')
+        elif name == 'ignore' and not isinstance(request.get('pattern'), str):
+            self.reply(client, name, 'No "pattern" to ignore.')
+        else:
+            self.requests.put_nowait((client, request))
+
+    def _backlog(self, client):
+        '''
+        Returns how many bytes the client has yet to read, not counting any of
+        the greeting.
+        '''
+        unsent = client.transport.get_write_buffer_size()
+        greeting, written = self.written.get(client, (0, 0))
+        return unsent - max(0, greeting - (written - unsent))
+
+    def _send(self, client, message):
+        if client.is_closing():
+            return
+        if self._backlog(client) > MAX_BACKLOG:
+            self._drop(client)
+            return
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        client.write(data)
+        if client in self.written:
+            self.written[client][1] += len(data)
+
+    def _drop(self, client):
+        self.clients.discard(client)
+        self.written.pop(client, None)
+        client.close()
+
+    def publish(self, event, **details):
+        message = dict(event=event)
+        message.update(details)
+        for client in list(self.clients):
+            self._send(client, message)
+
+    def reply(self, client, request, error=None):
+        message = dict(reply=request)
+        if error is None:
+            message['ok'] = True
+        else:
+            message['error'] = error
+        self._send(client, message)
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for client in list(self.clients):
+            self._drop(client)
+        await self.server.wait_closed()
+        self.server = None
+        if self.inode is not None:
+            try:
+                if os.stat(self.address).st_ino == self.inode:
+                    os.unlink(self.address)
+            except OSError:
+                pass
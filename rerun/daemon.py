@@ -0,0 +1,289 @@
+'''
+With --shared, every rerun in the same directory gets its changed files from
+one watcher daemon, rather than each looking through the tree itself. The
+first such rerun starts the daemon, and later ones connect to it, over a Unix
+socket named after the directory. The daemon exits once no rerun has been
+connected for IDLE_SECONDS.
+
+The daemon watches with the options of the rerun which started it, such as
+--watcher and the polling intervals, and ignores only what every rerun
+ignores: the directories and extensions always ignored, and the patterns in
+./.rerunignore. Each rerun drops the changed files its own --ignore and
+--gitignore rules ignore, and runs its own command.
+
+The daemon speaks the --control protocol (see control.py), sending each
+rerun, when it connects, every file there is:
+
+    {"event": "files", "files": [...]}
+
+then each batch of changes, as --control does:
+
+    {"event": "changed", "files": [...]}
+
+Run it as:
+
+    python -m rerun.daemon SOCKET [rerun options]
+'''
+import asyncio
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from .control import ControlError, ControlServer
+from .options import get_parser
+from .watchers import get_watcher, SKIP_DIRS, SKIP_EXT
+
+
+# How long the daemon keeps running without any rerun connected to it, so
+# that a rerun which is restarted finds it still there.
+IDLE_SECONDS = 5
+
+# How long a rerun waits for the daemon it started to start listening.
+START_SECONDS = 10
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_socket_dir():
+    '''
+    Returns a directory for daemon sockets which only we can use, creating it
+    if need be.
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        path = os.path.join(runtime_dir, 'rerun')
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'rerun-%d' % os.getuid())
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    # Anyone can create directories in /tmp, so make sure it's ours.
+    info = os.lstat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise DaemonError(
+            '%s is not a directory that only this user can use.' % (path,))
+    return path
+
+
+def get_socket_path(root):
+    '''
+    Returns the path of the socket for the daemon watching the given
+    directory.
+    '''
+    import hashlib
+    digest = hashlib.sha1(os.path.realpath(root).encode('utf-8')).hexdigest()
+    return os.path.join(get_socket_dir(), '%s.sock' % (digest[:16],))
+
+
+def get_daemon_args(options):
+    '''
+    Returns the rerun options which the daemon watches with.
+    '''
+    return [
+        '--watcher=%s' % (options.watcher,),
+        '--max-watches=%d' % (options.max_watches,),
+        '--min-interval=%r' % (options.min_interval,),
+        '--max-interval=%r' % (options.max_interval,),
+        '--stat-interval=%r' % (options.stat_interval,),
+        '--walk-threads=%d' % (options.walk_threads,),
+    ]
+
+
+def start_daemon(path, options):
+    '''
+    Starts a daemon in the background, detached from our terminal, so that it
+    outlives us if other reruns are using it. Its output goes to a log file
+    next to its socket.
+    '''
+    with open(path + '.log', 'ab') as log:
+        return subprocess.Popen(
+            [sys.executable, '-m', 'rerun.daemon', path] +
+            get_daemon_args(options),
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            start_new_session=True,
+        )
+
+
+def try_connect(path):
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def connect(path, options, start_seconds=START_SECONDS):
+    '''
+    Connects to the daemon listening on the given socket, starting one if
+    there isn't one. Returns the connected socket.
+    '''
+    sock = try_connect(path)
+    if sock is not None:
+        return sock
+    process = start_daemon(path, options)
+    deadline = time.time() + start_seconds
+    while True:
+        sock = try_connect(path)
+        if sock is not None:
+            return sock
+        # If it exited, it might have lost a race to start with another
+        # rerun's daemon, which we connect to instead, if it's listening.
+        if process.poll() is not None or time.time() > deadline:
+            sock = try_connect(path)
+            if sock is not None:
+                return sock
+            raise DaemonError(
+                'The shared watcher failed to start. See %s.log' % (path,))
+        time.sleep(0.05)
+
+
+class SharedWatcher(object):
+    '''
+    A watcher which gets changed files from the daemon for the current
+    directory, dropping those that 'matcher' ignores. The first call reports
+    every file, like the first call to other watchers does. If the daemon
+    goes away, another is started, and every file is reported as changed.
+    '''
+    # With no timeout, how long to wait for changes before returning anyway.
+    WAIT = 1.0
+
+    def __init__(self, matcher, options):
+        self.matcher = matcher
+        self.options = options
+        self.path = get_socket_path(os.getcwd())
+        self.sock = None
+        self.buffer = b''
+        self._connect()
+
+    def _connect(self):
+        self.sock = connect(self.path, self.options)
+        # Wait for the daemon's list of files, which takes as long as its
+        # first look through the tree.
+        while b'\n' not in self.buffer:
+            data = self.sock.recv(64 * 1024)
+            if not data:
+                raise DaemonError('The shared watcher exited unexpectedly.')
+            self.buffer += data
+        self.sock.setblocking(False)
+
+    def _read(self):
+        '''
+        Reads whatever the daemon has sent, without blocking. Returns False
+        if it has gone away.
+        '''
+        while True:
+            try:
+                data = self.sock.recv(64 * 1024)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not data:
+                return False
+            self.buffer += data
+
+    def get_changed_files(self):
+        if not self._read():
+            sys.stderr.write('rerun: the shared watcher exited, restarting.\n')
+            self.sock.close()
+            self.buffer = b''
+            self._connect()
+        lines = self.buffer.split(b'\n')
+        self.buffer = lines.pop()
+        changed = set()
+        for line in lines:
+            changed.update(json.loads(line.decode('utf-8')).get('files', ()))
+        return sorted(
+            filename for filename in changed
+            if not self.matcher.ignores_path(filename)
+        )
+
+    def cache_size(self):
+        # The daemon does the caching.
+        return 0
+
+    def wait(self, timeout=None):
+        if b'\n' in self.buffer:
+            return
+        select.select(
+            [self.sock], [], [], self.WAIT if timeout is None else timeout)
+
+    def close(self):
+        self.sock.close()
+
+
+class Daemon(object):
+    '''
+    Sends every connected rerun the files that the watcher reports changed,
+    until none have been connected for 'idle_seconds'.
+    '''
+    def __init__(self, watcher, path, idle_seconds=IDLE_SECONDS):
+        self.watcher = watcher
+        self.idle_seconds = idle_seconds
+        self.server = ControlServer(path, self.greeting)
+        self.files = set()
+        self.ready = None
+
+    async def greeting(self):
+        await self.ready.wait()
+        return dict(event='files', files=sorted(self.files))
+
+    def _update(self, changed_files):
+        for filename in changed_files:
+            if os.path.lexists(filename):
+                self.files.add(filename)
+            else:
+                self.files.discard(filename)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        # Listen first, so that other reruns starting now find us, rather
+        # than start daemons of their own.
+        await self.server.start()
+        try:
+            self.files.update(await loop.run_in_executor(
+                None, self.watcher.get_changed_files))
+            self.ready.set()
+            idle_since = time.time()
+            while True:
+                changed_files = await loop.run_in_executor(
+                    None, self.watcher.get_changed_files)
+                if changed_files:
+                    self._update(changed_files)
+                    self.server.publish('changed', files=changed_files)
+                else:
+                    await loop.run_in_executor(None, self.watcher.wait, 1)
+                if self.server.clients:
+                    idle_since = time.time()
+                elif time.time() - idle_since > self.idle_seconds:
+                    return
+        finally:
+            await self.server.close()
+
+
+def main(args):
+    path = args[0]
+    options = get_parser('rerun', SKIP_DIRS, SKIP_EXT).parse_args(args[1:])
+    watcher = get_watcher(options)
+    try:
+        asyncio.run(Daemon(watcher, path).run())
+    except ControlError as exc:
+        # Another rerun's daemon got there first.
+        sys.stderr.write('%s\n' % (exc,))
+    finally:
+        watcher.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+'''
+Works out which test modules depend on the changed files, from an import
+graph of the Python modules under the current directory.
+'''
+import ast
+import os
+
+from .ignore import get_matcher
+from .watchers import SKIP_EXT, walk_tree
+
+
+def is_test_file(filename):
+    basename = os.path.basename(filename)
+    return basename.endswith('.py') and (
+        basename.startswith('test_') or basename.endswith('_test.py')
+    )
+
+
+def get_module_name(filename):
+    '''
+    Returns the dotted name the given file would be imported as, relative to
+    the first directory above it which isn't a package.
+    '''
+    dirname, basename = os.path.split(os.path.normpath(filename))
+    parts = [] if basename == '__init__.py' else [basename[:-3]]
+    while dirname and os.path.isfile(os.path.join(dirname, '__init__.py')):
+        dirname, package = os.path.split(dirname)
+        parts.insert(0, package)
+    return '.'.join(parts)
+
+
+def _with_parents(name):
+    '''
+    Importing 'a.b.c' also imports packages 'a' and 'a.b'.
+    '''
+    parts = name.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def get_imported_names(filename, source):
+    '''
+    Returns the set of module names the given Python source might import.
+    From 'from a import b', we can't tell whether 'b' is a module, so both
+    'a' and 'a.b' are included.
+    '''
+    tree = ast.parse(source, filename)
+    module = get_module_name(filename)
+    if os.path.basename(filename) == '__init__.py':
+        package = module
+    else:
+        package = module.rpartition('.')[0]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names.update(_with_parents(alias.name))
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                parts = package.split('.') if package else []
+                parts = parts[:len(parts) - node.level + 1]
+                base = '.'.join(part for part in parts + [base] if part)
+            if not base:
+                continue
+            names.update(_with_parents(base))
+            for alias in node.names:
+                if alias.name != '*':
+                    names.add(base + '.' + alias.name)
+    return names
+
+
+class ImportGraph(object):
+    '''
+    Which Python files import which modules. Updated one file at a time, so
+    that after the initial build only changed files get parsed again.
+    '''
+    def __init__(self):
+        # filename -> module name
+        self.modules = {}
+        # filename -> set of module names it imports
+        self.imports = {}
+        # module name -> set of filenames which import it
+        self.importers = {}
+        # top-level names of the modules in the tree, made when needed
+        self.local = None
+
+    def remove(self, filename):
+        self.local = None
+        self.modules.pop(filename, None)
+        for name in self.imports.pop(filename, ()):
+            importers = self.importers[name]
+            importers.discard(filename)
+            if not importers:
+                del self.importers[name]
+
+    def add(self, filename):
+        self.remove(filename)
+        try:
+            with open(filename, 'rb') as fp:
+                names = get_imported_names(filename, fp.read())
+        except (IOError, OSError):
+            return
+        except (SyntaxError, ValueError):
+            # Keep the file, so a broken test still counts as a test.
+            names = set()
+        self.modules[filename] = get_module_name(filename)
+        self.imports[filename] = names
+        for name in names:
+            self.importers.setdefault(name, set()).add(filename)
+
+    def update(self, filenames):
+        for filename in filenames:
+            if filename.endswith('.py'):
+                if os.path.exists(filename):
+                    self.add(filename)
+                else:
+                    self.remove(filename)
+
+    def is_local(self, name):
+        '''
+        Returns whether the named module is in the tree, or in a package that
+        is.
+        '''
+        if self.local is None:
+            self.local = set(
+                module.split('.')[0] for module in self.modules.values())
+        return name.split('.')[0] in self.local
+
+    def get_external_imports(self):
+        '''
+        Returns the names imported by files in the tree which aren't modules
+        in the tree, i.e. the libraries the tree uses.
+        '''
+        return set(name for name in self.importers if not self.is_local(name))
+
+    def get_test_files(self, under=''):
+        return set(
+            filename for filename in self.modules
+            if is_test_file(filename) and
+            os.path.normpath(filename).startswith(under)
+        )
+
+    def get_affected_tests(self, changed_files):
+        '''
+        Returns the sorted test files which import any of the changed files,
+        directly or indirectly, or are themselves changed. A changed file
+        which isn't Python might be read by any test, so selects them all.
+        A changed conftest.py selects all the tests beneath it.
+        '''
+        if any(not filename.endswith('.py') for filename in changed_files):
+            return sorted(self.get_test_files())
+        affected = set(changed_files)
+        pending = list(changed_files)
+        while pending:
+            filename = pending.pop()
+            dependents = set()
+            if os.path.basename(filename) == 'conftest.py':
+                dirname = os.path.dirname(os.path.normpath(filename))
+                dependents.update(
+                    self.get_test_files(dirname + os.sep if dirname else ''))
+            name = self.modules.get(filename) or get_module_name(filename)
+            dependents.update(self.importers.get(name, ()))
+            for dependent in dependents - affected:
+                affected.add(dependent)
+                pending.append(dependent)
+        return sorted(
+            filename for filename in affected
+            if is_test_file(filename) and filename in self.modules
+        )
+
+
+graph = None
+
+def get_graph(options):
+    '''
+    Returns the import graph of the whole tree, building it on first use.
+    '''
+    global graph
+    if graph is None:
+        graph = ImportGraph()
+        matcher = get_matcher(options.ignore, SKIP_EXT, options.gitignore)
+        graph.update(sorted(walk_tree('.', matcher)))
+    return graph
+
+
+def get_affected_tests(changed_files, options):
+    '''
+    Returns the test files affected by the changed files, building the import
+    graph of the whole tree on first use, and updating it thereafter.
+    '''
+    if graph is None:
+        get_graph(options)
+    else:
+        graph.update(changed_files)
+    return graph.get_affected_tests(changed_files)
@@ -0,0 +1,90 @@
+'''
+A compact map from file paths to fixed-width records of integers, used to
+remember the state of every watched file between sweeps.
+'''
+from array import array
+import os
+import sys
+
+
+class _Dir(object):
+
+    __slots__ = ('slots', 'records', 'free')
+
+    def __init__(self):
+        # basename -> slot number in records
+        self.slots = {}
+        # records of all files in this dir, back to back
+        self.records = array('q')
+        # slots whose files have been discarded, to be reused
+        self.free = []
+
+
+class FileStateTable(object):
+    '''
+    Behaves like a dict of {path: tuple of ints}, but each directory's path
+    is stored once, basenames are interned so that names common to many dirs
+    (e.g. '__init__.py') are stored once, and the records are packed into one
+    array per directory instead of being tuples of int objects. For big trees
+    this uses a fraction of the memory, and gives the garbage collector far
+    fewer objects to track.
+    '''
+    def __init__(self, width=1):
+        self.width = width
+        self.dirs = {}
+        self.size = 0
+
+    def get(self, path, default=None):
+        dirname, basename = os.path.split(path)
+        entry = self.dirs.get(dirname)
+        if entry is None:
+            return default
+        slot = entry.slots.get(basename)
+        if slot is None:
+            return default
+        start = slot * self.width
+        return tuple(entry.records[start:start + self.width])
+
+    def set(self, path, record):
+        dirname, basename = os.path.split(path)
+        entry = self.dirs.get(dirname)
+        if entry is None:
+            entry = self.dirs[sys.intern(dirname)] = _Dir()
+        slot = entry.slots.get(basename)
+        if slot is None:
+            if entry.free:
+                slot = entry.free.pop()
+            else:
+                slot = len(entry.records) // self.width
+                entry.records.extend([0] * self.width)
+            entry.slots[sys.intern(basename)] = slot
+            self.size += 1
+        start = slot * self.width
+        entry.records[start:start + self.width] = array('q', record)
+
+    def discard(self, path):
+        dirname, basename = os.path.split(path)
+        entry = self.dirs.get(dirname)
+        if entry is None or basename not in entry.slots:
+            return
+        entry.free.append(entry.slots.pop(basename))
+        self.size -= 1
+        if not entry.slots:
+            del self.dirs[dirname]
+
+    def clear(self):
+        self.dirs.clear()
+        self.size = 0
+
+    def __contains__(self, path):
+        dirname, basename = os.path.split(path)
+        entry = self.dirs.get(dirname)
+        return entry is not None and basename in entry.slots
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for dirname, entry in self.dirs.items():
+            for basename in entry.slots:
+                yield os.path.join(dirname, basename)
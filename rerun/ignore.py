@@ -0,0 +1,186 @@
+'''
+Decides which files and directories to ignore. The rules are compiled once
+at startup, so that checking each file is a set lookup or a regex match,
+however many rules there are.
+'''
+import os
+import re
+
+
+RERUNIGNORE = '.rerunignore'
+GITIGNORE = '.gitignore'
+
+GLOB_CHARS = re.compile(r'[*?[]')
+
+
+def glob_to_regex(pattern):
+    '''
+    Translates a gitignore-style glob into a regex. '*' and '?' don't match
+    '/', while '**' matches any number of directories.
+    '''
+    regex = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                regex.append(re.escape(char))
+            else:
+                chars = pattern[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex.append('[%s]' % (chars.replace('\\', '\\\\'),))
+                i = end
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return ''.join(regex)
+
+
+def _combine(regexes):
+    if not regexes:
+        return None
+    return re.compile('(?:%s)\\Z' % ('|'.join(regexes),))
+
+
+def read_ignore_file(filename):
+    '''
+    Returns the patterns in the given gitignore-style file, or an empty list
+    if it doesn't exist. Negated patterns ('!pattern') aren't supported, and
+    are skipped.
+    '''
+    try:
+        with open(filename) as fp:
+            lines = fp.read().splitlines()
+    except (IOError, OSError):
+        return []
+    patterns = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#') or line.startswith('!'):
+            continue
+        if line.startswith('\\'):
+            line = line[1:]
+        patterns.append(line)
+    return patterns
+
+
+class IgnoreMatcher(object):
+    '''
+    Matches relative paths against ignore rules, which are either:
+
+    * plain names, compared to basenames, e.g. 'build',
+    * globs, compared to basenames, e.g. '*.log',
+    * globs containing a '/', compared to the whole path relative to the
+      current directory, e.g. 'docs/_build' or '/out/**/*.o',
+    * any of the above with a trailing '/', matching only directories,
+    * file extensions, e.g. '.pyc'.
+    '''
+    def __init__(self, patterns, extensions):
+        self.patterns = []
+        self.extensions = set(extensions)
+        self.add(patterns)
+
+    def add(self, patterns):
+        '''
+        Adds more rules, which apply from then on. The rules are compiled
+        afresh, then swapped in, so this can be called while another thread
+        is matching.
+        '''
+        self.patterns = self.patterns + list(patterns)
+        names, dir_names = set(), set()
+        name_globs, dir_name_globs = [], []
+        path_globs, dir_path_globs = [], []
+        for pattern in self.patterns:
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if not pattern:
+                continue
+            if '/' in pattern:
+                regex = glob_to_regex(pattern.lstrip('/'))
+                (dir_path_globs if dir_only else path_globs).append(regex)
+            elif GLOB_CHARS.search(pattern):
+                regex = glob_to_regex(pattern)
+                (dir_name_globs if dir_only else name_globs).append(regex)
+            else:
+                (dir_names if dir_only else names).add(pattern)
+        dir_names.update(names)
+        self.names = names
+        self.dir_names = dir_names
+        self.name_regex = _combine(name_globs)
+        self.dir_name_regex = _combine(name_globs + dir_name_globs)
+        self.path_regex = _combine(path_globs)
+        self.dir_path_regex = _combine(path_globs + dir_path_globs)
+
+    @staticmethod
+    def _split(relname):
+        if os.sep != '/':
+            relname = relname.replace(os.sep, '/')
+        if relname.startswith('./'):
+            relname = relname[2:]
+        return relname, relname[relname.rfind('/') + 1:]
+
+    def ignores_file(self, relname):
+        path, name = self._split(relname)
+        dot = name.rfind('.')
+        return (
+            name in self.names or
+            (dot != -1 and name[dot:] in self.extensions) or
+            bool(self.name_regex and self.name_regex.match(name)) or
+            bool(self.path_regex and self.path_regex.match(path))
+        )
+
+    def ignores_dir(self, relname):
+        path, name = self._split(relname)
+        return (
+            name in self.dir_names or
+            bool(self.dir_name_regex and self.dir_name_regex.match(name)) or
+            bool(self.dir_path_regex and self.dir_path_regex.match(path))
+        )
+
+    def ignores_path(self, relname):
+        '''
+        Whether the file is ignored, or is in an ignored directory.
+        '''
+        if self.ignores_file(relname):
+            return True
+        parent = os.path.dirname(relname)
+        while parent not in ('', '.', os.sep):
+            if self.ignores_dir(parent):
+                return True
+            parent = os.path.dirname(parent)
+        return False
+
+    def prune_dirs(self, root, dirs):
+        '''
+        Removes ignored dirs from the given list in place, for use with
+        os.walk.
+        '''
+        dirs[:] = [
+            name for name in dirs
+            if not self.ignores_dir(os.path.join(root, name))
+        ]
+
+
+def get_matcher(ignores, extensions, use_gitignore=False):
+    '''
+    Returns an IgnoreMatcher for the given --ignore values and extensions,
+    plus any patterns in ./.rerunignore, and in ./.gitignore if requested.
+    '''
+    patterns = list(ignores) + read_ignore_file(RERUNIGNORE)
+    if use_gitignore:
+        patterns.extend(read_ignore_file(GITIGNORE))
+    return IgnoreMatcher(patterns, extensions)
@@ -0,0 +1,147 @@
+'''
+Minimal ctypes binding to the Linux inotify API, so that we can wait for
+filesystem events instead of polling, without depending on anything outside
+the stdlib.
+'''
+import errno
+import os
+import select
+import struct
+import sys
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+    IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT_HEADER = struct.Struct('iIII')
+
+READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def get_libc():
+    '''
+    Returns libc with inotify functions declared, or None if there isn't one.
+    '''
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            import ctypes
+            try:
+                libc = ctypes.CDLL(None, use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [
+                    ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+                ]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            except (OSError, AttributeError):
+                pass
+            else:
+                _libc = libc
+    return _libc or None
+
+
+def is_available():
+    return get_libc() is not None
+
+
+def _raise_errno(filename=None):
+    import ctypes
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code), filename)
+
+
+def parse_events(data):
+    '''
+    Yields (wd, mask, cookie, name) for each event packed into data.
+    '''
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        yield wd, mask, cookie, os.fsdecode(name)
+
+
+class Inotify(object):
+    '''
+    A non-blocking inotify instance.
+    '''
+    def __init__(self):
+        libc = get_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        return wd
+
+    def rm_watch(self, wd):
+        # The watch is removed implicitly if its directory is deleted, so
+        # failure here is expected and harmless.
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        '''
+        Blocks until events are ready to read, or timeout seconds elapse.
+        Returns True if events are ready.
+        '''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(ready)
+
+    def read_events(self):
+        '''
+        Returns a list of all events queued so far, without blocking.
+        '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            events.extend(parse_events(data))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
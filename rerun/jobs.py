@@ -0,0 +1,168 @@
+'''
+Runs the commands triggered by a change as a graph of jobs: independent jobs
+run at the same time, up to a limit, while jobs which need others wait for
+them to pass, and are skipped if any of them fail.
+'''
+import subprocess
+import sys
+import threading
+import time
+
+
+PASSED = 'passed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Job(object):
+    '''
+    A command to run, named so that other jobs can need it. Jobs with the same
+    lock (which is not None) never run at the same time. The command runs
+    with the given environment, or ours if that is None.
+    '''
+    def __init__(self, name, command, needs=(), lock=None, env=None):
+        self.name = name
+        self.command = command
+        self.needs = list(needs)
+        self.lock = lock
+        self.env = env
+        self.status = None
+        self.failed_needs = []
+        self.returncode = None
+        self.output = b''
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return '<Job %r>' % (self.name,)
+
+    def describe(self):
+        if self.status == SKIPPED:
+            return '%s: skipped, needs %s' % (
+                self.name, ', '.join(self.failed_needs))
+        if self.status == FAILED:
+            return '%s: failed with exit status %d in %.1fs' % (
+                self.name, self.returncode, self.seconds)
+        return '%s: passed in %.1fs' % (self.name, self.seconds)
+
+
+def write_output(data):
+    stream = getattr(sys.stdout, 'buffer', None)
+    if stream is None:
+        sys.stdout.write(data.decode('utf-8', 'replace'))
+    else:
+        sys.stdout.flush()
+        stream.write(data)
+    sys.stdout.flush()
+
+
+class Scheduler(object):
+    '''
+    Runs the given jobs, at most 'max_jobs' at a time. Needs naming jobs which
+    aren't in the given list count as already passed. With 'buffered', each
+    job's output is captured, and printed in one piece, under a heading, when
+    the job finishes, so that the output of parallel jobs isn't interleaved.
+    '''
+    def __init__(self, jobs, shell, max_jobs=1, buffered=True):
+        self.jobs = list(jobs)
+        self.shell = shell
+        self.max_jobs = max_jobs
+        self.buffered = buffered
+        self.condition = threading.Condition()
+        self.running = []
+        self.print_lock = threading.Lock()
+
+    def _needed(self, job):
+        return [other for other in self.jobs if other.name in job.needs]
+
+    def _skip_failed_dependents(self):
+        '''
+        Marks as skipped any pending job which needs a job that has failed or
+        been skipped, repeatedly, so that skipping cascades downstream.
+        '''
+        skipped = True
+        while skipped:
+            skipped = False
+            for job in self.jobs:
+                if job.status is not None or job in self.running:
+                    continue
+                job.failed_needs = sorted(set(
+                    other.name for other in self._needed(job)
+                    if other.status in (FAILED, SKIPPED)
+                ))
+                if job.failed_needs:
+                    job.status = SKIPPED
+                    self._report(job)
+                    skipped = True
+
+    def _is_ready(self, job):
+        return (
+            job.status is None and
+            job not in self.running and
+            all(other.status == PASSED for other in self._needed(job)) and
+            (
+                job.lock is None or
+                all(other.lock != job.lock for other in self.running)
+            )
+        )
+
+    def _report(self, job):
+        if not self.buffered:
+            if job.status != PASSED:
+                print(job.describe())
+            return
+        with self.print_lock:
+            print('== %s ==' % (job.describe(),))
+            write_output(job.output)
+
+    def _run(self, job):
+        start = time.time()
+        try:
+            if self.buffered:
+                process = subprocess.Popen(
+                    job.command, shell=True, executable=self.shell,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    env=job.env,
+                )
+                job.output, _ = process.communicate()
+                job.returncode = process.returncode
+            else:
+                job.returncode = subprocess.call(
+                    job.command, shell=True, executable=self.shell,
+                    env=job.env,
+                )
+        except OSError as exc:
+            job.output = ('%s\n' % (exc,)).encode('utf-8')
+            job.returncode = 127
+        job.seconds = time.time() - start
+        job.status = PASSED if job.returncode == 0 else FAILED
+        self._report(job)
+        with self.condition:
+            self.running.remove(job)
+            self.condition.notify()
+
+    def run(self):
+        '''
+        Runs all the jobs, returning when every one has finished or been
+        skipped. Returns True if they all passed.
+        '''
+        with self.condition:
+            while True:
+                self._skip_failed_dependents()
+                for job in self.jobs:
+                    if len(self.running) >= self.max_jobs:
+                        break
+                    if self._is_ready(job):
+                        self.running.append(job)
+                        threading.Thread(target=self._run, args=(job,)).start()
+                if not self.running:
+                    break
+                self.condition.wait()
+        return all(job.status == PASSED for job in self.jobs)
+
+
+def run_jobs(jobs, shell, max_jobs=1):
+    '''
+    Runs the given jobs, buffering their output unless there is only one.
+    Returns True if they all passed.
+    '''
+    return Scheduler(jobs, shell, max_jobs, buffered=len(jobs) > 1).run()
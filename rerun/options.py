@@ -1,14 +1,14 @@
 import argparse
 import os
-import platform
-try:
-    import pwd
-except ImportError:
-    # Can't import on Windows
-    pwd = None
 import sys
 
 from . import __doc__, __version__
+from . import inotify
+from .config import CONFIG_FILE, ConfigError, load_config
+
+
+# sys.platform is known without importing the platform module.
+WINDOWS = sys.platform.startswith('win')
 
 
 HELP_COMMAND = '''
@@ -16,13 +16,45 @@ Command to execute. The first command line arg that rerun doesn't recognise
 (including anything that doesn't start with '-') marks the start of the command.
 All args from there onwards are considered to be part of the given command,
 even if they look like args that rerun would otherwise recognise, e.g. -v.
+Any '{changed_tests}' in the command is replaced by the Python test files
+(test_*.py or *_test.py) which import the changed files, directly or
+indirectly, e.g. "pytest {changed_tests}". If none do, the command isn't run.
+Any '{files}' is replaced by the changed files which still exist, e.g.
+"flake8 {files}". If there are none, or too many, the command isn't run. The
+command's environment lists the changed files in RERUN_CHANGED_FILES, and those
+added, modified and deleted since it last ran in RERUN_ADDED_FILES,
+RERUN_MODIFIED_FILES and RERUN_DELETED_FILES, one per line.
 '''
 HELP_IGNORE = '''
 File or directory to ignore. Any directories of the given name (and
 their subdirs) are excluded from the search for changed files. Any modification
 to files of the given name are ignored. The given value is compared to
 basenames, so for example, "--ignore=def" will skip the contents of directory
-"./abc/def/" and will ignore file "./ghi/def". Can be specified multiple times.
+"./abc/def/" and will ignore file "./ghi/def". Glob patterns such as "*.log"
+are allowed. Patterns containing a "/" are compared to the whole path relative
+to the current directory, as in a .gitignore file. Can be specified multiple
+times. Patterns are also read from ./.rerunignore, if it exists.
+'''
+HELP_GITIGNORE = '''
+Also ignore files and directories matched by patterns in ./.gitignore.
+'''
+HELP_CONFIG = '''
+Read commands from the given TOML file, which maps paths to commands, instead
+of taking a single command on the command line. Each change runs only the
+commands whose paths match it. If no command is given and there is no
+--config, ./rerun.toml is used if it exists. See the README for the format.
+'''
+HELP_CONTENT_HASH = '''
+Only count a file as changed if its contents have changed, so that files which
+are merely touched, or saved without modification, don't rerun the command.
+This reads every watched file once at startup, and every changed file after
+that.
+'''
+HELP_DEBOUNCE = '''
+Wait until no files have changed for this many milliseconds before running
+the command, so that a burst of changes, such as from a 'git checkout' or a
+code formatter, causes a single run. Defaults to %(default)s, which runs the
+command as soon as any change is seen.
 '''
 HELP_INTERACTIVE = '''
 Run the command in an interactive shell. This allows the use of shell aliases
@@ -30,9 +62,142 @@ and functions, but is slower, less reliable and noisier on stdout/stderr,
 because it sources ~/.bashrc and the like before running the command.
 Not available on Windows.
 '''
+HELP_WATCHER = '''
+How to detect changed files. 'inotify' asks the Linux kernel to report
+changes, which is fast and uses almost no CPU while idle. 'poll' walks the
+whole tree looking at file modification times, which works everywhere,
+including on network filesystems and VM shared folders. 'incremental' also
+polls, but only re-reads directories whose modification time has changed,
+and re-checks the files in unchanged directories less often (see
+--stat-interval), which is much cheaper on big trees. 'hybrid' uses inotify
+on only the most recently changed directories (see --max-watches), and polls
+the rest like 'incremental', but less often, for trees too big to watch
+whole. The default, 'auto', uses inotify where it is available, and polls
+otherwise. If the kernel runs out of inotify watches, 'inotify' and 'auto'
+switch to 'hybrid'.
+'''
+HELP_MAX_WATCHES = '''
+With --watcher=hybrid, how many directories to watch with inotify: those in
+which files changed most recently. Defaults to %(default)s.
+'''
+HELP_MIN_INTERVAL = '''
+When polling, the shortest time between looks for changes, used just after a
+change is seen. Defaults to %(default)s.
+'''
+HELP_MAX_INTERVAL = '''
+When polling, the longest time between looks for changes. The time doubles
+after each look that finds nothing, up to this, so that an idle rerun uses
+little CPU or battery. Looking is also spaced out on trees that take a while
+to look through. Defaults to %(default)s.
+'''
+HELP_RECORD = '''
+Save each run of the command to .cache/rerun/runs.sqlite: when it ran, which
+files changed, how long it took, its exit status, CPU time and peak memory.
+On exit, print whether runs got slower or faster since the day before, and
+which changed files make them much slower than usual. See the same report
+at any time with "python -m rerun.record".
+'''
+HELP_SNAPSHOT = '''
+Save the state of all watched files to .cache/rerun/ when rerun exits, as of
+the last run of the command which finished. Next time it starts, only run the
+command if files changed since then, and display those files if --verbose is
+given.
+'''
+HELP_STATS = '''
+Record what each look for changes costs: directories and files visited, stat
+calls, ignored entries, time spent walking, matching ignore patterns and
+comparing, and how many files are cached. After each run of the command,
+print a summary, including how long after the change the command started, and
+on exit, print histograms of it all. Use it to tune --ignore and the
+intervals.
+'''
+HELP_STATS_FILE = '''
+Also write each look for changes, and each run of the command, to the given
+file as a line of JSON. Implies --stats.
+'''
+HELP_STAT_INTERVAL = '''
+With --watcher=incremental or hybrid, how many seconds between checks of the
+modification times of files whose directory hasn't changed. Files that are
+created, deleted or replaced (as many editors do when saving) are always seen
+immediately. Set to 0 to only check files when their directory changes.
+Defaults to %(default)s.
+'''
+HELP_WALK_THREADS = '''
+With --watcher=poll, how many threads to use to list directories. Values above
+1 can make polling much faster on network filesystems such as NFS or sshfs.
+Defaults to %(default)s.
+'''
+HELP_JOBS = '''
+With --config, how many commands to run at the same time. When more than one
+command runs, each command's output is shown in one piece when it finishes.
+Defaults to the number of CPUs, %(default)s.
+'''
+HELP_RESTART = '''
+Keep watching for changes while the command runs. If files change before it
+finishes, stop it (with SIGTERM, then SIGKILL if it hasn't exited after 5
+seconds) along with any processes it started, and run it again. Useful for
+long builds, and for commands that never exit, such as development servers.
+Cannot be used with --interactive.
+'''
+HELP_SCROLLBACK = '''
+Keep the output of previous runs in the terminal's scrollback, instead of
+clearing it before each run.
+'''
+HELP_ALT_SCREEN = '''
+Use the terminal's alternate screen, as full-screen programs do, so that what
+was in the terminal before rerun started is shown again when it exits.
+'''
+HELP_NO_STATUS = '''
+Don't show a line with the command's exit status, how long it ran, and when it
+finished, after each run.
+'''
+HELP_KEEP_OUTPUT = '''
+Keep the output of the last N runs of the command, so that it can be compared
+with the run before: while the command isn't running, type 'd' then Enter to
+see the lines of the last run's output that weren't in the previous run's.
+Only the first megabyte of each run is kept in memory, the rest goes to a
+temporary file. The output passes through rerun on its way to the terminal, so
+the command no longer sees a terminal, and may not use colors. Not used with
+--config or --interactive. Defaults to 0, i.e. output isn't kept.
+'''
+HELP_DIFF = '''
+Show only the lines of the command's output that weren't in the previous run's
+output, such as newly failing tests. Each line is shown once it is complete.
+Implies --keep-output=2, unless more are kept.
+'''
+HELP_PYTHON_WORKER = '''
+Run a Python command in a fork of a resident Python process, which has already
+imported the libraries that the command and the Python files under the
+current directory use, such as pytest, numpy or django, so that each run skips
+starting Python and importing them. Modules under the current directory are
+imported afresh by every run. The command must run Python directly, e.g.
+"python -m pytest", "python script.py" or "pytest". Not available on Windows,
+or with --config or --interactive, and --keep-output doesn't apply.
+'''
+HELP_CONTROL = '''
+Listen on the given Unix socket, or on the given port number on localhost, for
+programs such as editors and dashboards, which are sent a line of JSON
+whenever files change and whenever the command starts and finishes, with its
+exit status and how long it ran. They can also send requests, to run the
+command now, to pause and resume running it when files change, and to ignore
+more files. See the README for the protocol. Only a port number can be given
+on Windows.
+'''
+HELP_SHARED = '''
+Share one watcher between all the reruns in the current directory which are
+given --shared, such as those in several terminals and editors, rather than
+each looking through the tree for changes. The first starts a daemon which
+watches the tree, using that rerun's --watcher and interval options, and
+ignoring what is always ignored, and what ./.rerunignore says to ignore.
+Each rerun ignores whatever else its own options say to, and runs its own
+command. The daemon exits a few seconds after the last rerun using it does.
+Not available on Windows.
+'''
 HELP_VERBOSE = '''
 Display the names of changed files before the command output.
 '''
+WATCHERS = ['auto', 'hybrid', 'incremental', 'inotify', 'poll']
+
 EPILOG = '''
 Always ignores directories: {skip_dirs}
 Always ignores files with extensions: {skip_exts}
@@ -43,6 +208,33 @@ Version {version}
 '''
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1: %r' % (value,))
+    return number
+
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError('must not be negative: %r' % (value,))
+    return number
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('must be more than 0: %r' % (value,))
+    return number
+
+
+def control_address(value):
+    if value.isdigit() and not 0 < int(value) < 65536:
+        raise argparse.ArgumentTypeError('not a port number: %r' % (value,))
+    return value
+
+
 def get_parser(name, skip_dirs, skip_exts):
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -56,13 +248,67 @@ def get_parser(name, skip_dirs, skip_exts):
     )
     parser.add_argument('--ignore', '-i',
         action='append', default=skip_dirs, help=HELP_IGNORE)
-    parser.add_argument('--interactive', '-I',
+    parser.add_argument('--alt-screen',
+        default=False, action='store_true', help=HELP_ALT_SCREEN)
+    parser.add_argument('--config', '-c',
+        default=None, metavar='FILE', help=HELP_CONFIG)
+    parser.add_argument('--control',
+        default=None, type=control_address, metavar='ADDRESS',
+        help=HELP_CONTROL)
+    parser.add_argument('--content-hash',
+        default=False, action='store_true', help=HELP_CONTENT_HASH)
+    parser.add_argument('--diff',
+        default=False, action='store_true', help=HELP_DIFF)
+    parser.add_argument('--debounce',
+        default=0, type=non_negative_int, metavar='MS', help=HELP_DEBOUNCE)
+    parser.add_argument('--gitignore',
+        default=False, action='store_true', help=HELP_GITIGNORE)
+    parser.add_argument('--jobs', '-j',
+        default=os.cpu_count() or 1, type=positive_int, metavar='N',
+        help=HELP_JOBS)
+    parser.add_argument('--keep-output',
+        default=0, type=non_negative_int, metavar='N', help=HELP_KEEP_OUTPUT)
+    run_mode = parser.add_mutually_exclusive_group()
+    run_mode.add_argument('--interactive', '-I',
         default=False, action='store_true', help=HELP_INTERACTIVE)
+    run_mode.add_argument('--restart', '-r',
+        default=False, action='store_true', help=HELP_RESTART)
+    parser.add_argument('--watcher',
+        default='auto', choices=WATCHERS, help=HELP_WATCHER)
+    parser.add_argument('--max-watches',
+        default=1000, type=positive_int, metavar='N', help=HELP_MAX_WATCHES)
+    parser.add_argument('--min-interval',
+        default=0.2, type=positive_float, metavar='SECONDS',
+        help=HELP_MIN_INTERVAL)
+    parser.add_argument('--max-interval',
+        default=1.0, type=positive_float, metavar='SECONDS',
+        help=HELP_MAX_INTERVAL)
+    parser.add_argument('--no-status',
+        dest='status', default=True, action='store_false',
+        help=HELP_NO_STATUS)
+    parser.add_argument('--python-worker',
+        default=False, action='store_true', help=HELP_PYTHON_WORKER)
+    parser.add_argument('--record',
+        default=False, action='store_true', help=HELP_RECORD)
+    parser.add_argument('--scrollback',
+        default=False, action='store_true', help=HELP_SCROLLBACK)
+    parser.add_argument('--shared',
+        default=False, action='store_true', help=HELP_SHARED)
+    parser.add_argument('--snapshot',
+        default=False, action='store_true', help=HELP_SNAPSHOT)
+    parser.add_argument('--stats',
+        default=False, action='store_true', help=HELP_STATS)
+    parser.add_argument('--stats-file',
+        default=None, metavar='FILE', help=HELP_STATS_FILE)
+    parser.add_argument('--stat-interval',
+        default=2.0, type=float, metavar='SECONDS', help=HELP_STAT_INTERVAL)
+    parser.add_argument('--walk-threads',
+        default=1, type=positive_int, metavar='N', help=HELP_WALK_THREADS)
     parser.add_argument('--verbose', '-v',
         default=False, action='store_true', help=HELP_VERBOSE)
     parser.add_argument('--version',
         action='version', version='%(prog)s v' + __version__)
-    parser.add_argument('command', help=HELP_COMMAND)
+    parser.add_argument('command', nargs='?', default='', help=HELP_COMMAND)
     return parser
 
 
@@ -82,17 +328,58 @@ def get_current_shell():
     interpreted the same way it would if the user typed it at a prompt.
     On Windows return None, so subprocess just uses its default 'cmd' shell.
     '''
-    if pwd is None or platform.system() == 'Windows':
+    if WINDOWS:
         return None
-    else:
-        # parent shell of this process,
-        # or fallback to user's default shell from /etc/passwd
-        return os.environ.get('SHELL', pwd.getpwuid(os.getuid()).pw_shell)
+    # parent shell of this process,
+    # or fallback to user's default shell from /etc/passwd
+    if 'SHELL' in os.environ:
+        return os.environ['SHELL']
+    import pwd
+    return pwd.getpwuid(os.getuid()).pw_shell
+
+
+def validate_python_worker(options):
+    if options.rules is not None or options.interactive:
+        _exit('--python-worker cannot be used with --config or --interactive.')
+    if not hasattr(os, 'fork'):
+        _exit('--python-worker is not available on this platform.')
+    from .worker import parse_command, WorkerError
+    try:
+        parse_command(options.command)
+    except WorkerError as exc:
+        _exit(str(exc))
 
 
 def validate(options):
-    if len(options.command) == 0:
+    if (
+        len(options.command) == 0 and
+        options.config is None and
+        os.path.isfile(CONFIG_FILE)
+    ):
+        options.config = CONFIG_FILE
+    options.rules = None
+    if options.config is not None:
+        if len(options.command) != 0:
+            _exit('Give either a command or --config, not both.')
+        if options.interactive or options.restart:
+            _exit('--config cannot be used with --interactive or --restart.')
+        try:
+            options.rules = load_config(options.config)
+        except ConfigError as exc:
+            _exit(str(exc))
+    elif len(options.command) == 0:
         _exit('No command specified.')
+    if options.watcher in ('hybrid', 'inotify') and not inotify.is_available():
+        _exit('inotify is not available on this platform.')
+    if options.stats_file is not None:
+        options.stats = True
+    if options.control is not None and WINDOWS and \
+            not options.control.isdigit():
+        _exit('--control needs a port number on Windows.')
+    if options.shared and WINDOWS:
+        _exit('--shared is not available on this platform.')
+    if options.python_worker:
+        validate_python_worker(options)
     options.shell = get_current_shell()
     return options
 
@@ -0,0 +1,184 @@
+'''
+With --keep-output, the command's output passes through rerun on its way to
+the terminal, and the output of the last few runs is kept, so it can be
+compared with the run before. Each run's output is kept in memory up to a
+limit, and in a temporary file after that, so that huge test logs don't fill
+memory. What is kept in memory for every line is just a hash of each
+distinct line, to tell which lines weren't in the previous run.
+'''
+from collections import deque
+
+
+# How much of each run's output is kept in memory, before it goes to a
+# temporary file.
+SPILL_BYTES = 1024 * 1024
+
+# Longer lines are split, so that output without newlines isn't held back.
+MAX_LINE = 64 * 1024
+
+# How many distinct lines of a run are remembered. Lines a run had beyond
+# that can't be told apart from new ones, so they count as new.
+MAX_HASHES = 100 * 1000
+
+# How much of a run's output lines() reads at a time.
+READ_BYTES = 64 * 1024
+
+
+def split_lines(data):
+    '''
+    Returns the whole lines in 'data', and what is left after the last
+    newline. Lines longer than MAX_LINE are split into pieces that long, and
+    so is what's left, until it is no longer than MAX_LINE, so that however
+    the output arrives, it is split the same way.
+    '''
+    lines = data.split(b'\n')
+    partial = lines.pop()
+    pieces = []
+    for line in lines:
+        while len(line) > MAX_LINE:
+            pieces.append(line[:MAX_LINE])
+            line = line[MAX_LINE:]
+        pieces.append(line)
+    while len(partial) > MAX_LINE:
+        pieces.append(partial[:MAX_LINE])
+        partial = partial[MAX_LINE:]
+    return pieces, partial
+
+
+class RunOutput(object):
+    '''
+    The output of one run of the command.
+    '''
+    def __init__(self, spill_bytes=SPILL_BYTES):
+        # Imported here, as it's slow to import, and only used with
+        # --keep-output.
+        import tempfile
+        self.file = tempfile.SpooledTemporaryFile(max_size=spill_bytes)
+        self.hashes = set()
+        self.partial = b''
+
+    def _remember(self, lines):
+        for line in lines:
+            if len(self.hashes) >= MAX_HASHES:
+                break
+            self.hashes.add(hash(line))
+
+    def write(self, chunk):
+        '''
+        Adds a chunk of output, and returns the lines it completed.
+        '''
+        self.file.write(chunk)
+        lines, self.partial = split_lines(self.partial + chunk)
+        self._remember(lines)
+        return lines
+
+    def finish(self):
+        '''
+        Returns the last line, if the output didn't end with a newline.
+        '''
+        line, self.partial = self.partial, b''
+        if line:
+            self._remember([line])
+            return line
+        return None
+
+    def has_line(self, line):
+        return hash(line) in self.hashes
+
+    def forget(self):
+        '''
+        Frees the hashes of the lines, once nothing will be compared with this
+        run any more.
+        '''
+        self.hashes = set()
+
+    def lines(self):
+        '''
+        Yields the lines of the output, split as write() split them.
+        '''
+        self.file.seek(0)
+        partial = b''
+        while True:
+            chunk = self.file.read(READ_BYTES)
+            if not chunk:
+                break
+            lines, partial = split_lines(partial + chunk)
+            for line in lines:
+                yield line
+        if partial:
+            yield partial
+
+    def close(self):
+        self.file.close()
+
+
+class OutputHistory(object):
+    '''
+    The output of the last 'runs' runs, oldest first.
+    '''
+    def __init__(self, runs):
+        self.runs = deque()
+        self.keep = runs
+
+    def start(self):
+        run = RunOutput()
+        self.runs.append(run)
+        while len(self.runs) > self.keep:
+            self.runs.popleft().close()
+        # Only the run before this one is compared with it.
+        if len(self.runs) > 2:
+            self.runs[-3].forget()
+        return run
+
+    def previous(self):
+        '''
+        Returns the output of the last run, before start() is called for the
+        next one.
+        '''
+        return self.runs[-1] if self.runs else None
+
+    def new_lines(self):
+        '''
+        Yields the lines of the last run which weren't in the one before it.
+        '''
+        if len(self.runs) < 2:
+            return
+        before, last = self.runs[-2], self.runs[-1]
+        for line in last.lines():
+            if not before.has_line(line):
+                yield line
+
+    def close(self):
+        while self.runs:
+            self.runs.popleft().close()
+
+
+class Tee(object):
+    '''
+    Called with each chunk of the command's output, records it in 'run' and
+    writes it to 'stream' straight away. With 'diff', only whole lines which
+    weren't in the 'previous' run's output are written.
+    '''
+    def __init__(self, run, stream, previous=None, diff=False):
+        self.run = run
+        self.stream = stream
+        self.previous = previous if diff else None
+
+    def __call__(self, chunk):
+        lines = self.run.write(chunk)
+        if self.previous is None:
+            self.stream.write(chunk)
+        else:
+            self._write_new(lines)
+        self.stream.flush()
+
+    def _write_new(self, lines):
+        for line in lines:
+            if not self.previous.has_line(line):
+                self.stream.write(line + b'\n')
+
+    def close(self):
+        line = self.run.finish()
+        if line is not None and self.previous is not None:
+            self._write_new([line])
+            self.stream.flush()
@@ -0,0 +1,257 @@
+'''
+With --record, each run of the command is saved to an SQLite database, so
+that how long it takes can be followed over days rather than runs: when it
+ran, which files changed to make it run, how long it took, its exit status,
+and the CPU time and peak memory its processes used. When rerun exits, it
+prints whether the command has got slower or faster since the day before, and
+which changed files make it run much slower than usual. To see that at any
+time, run:
+
+    python -m rerun.record
+
+Runs older than KEEP_DAYS are deleted.
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+
+RECORD_FILE = os.path.join('.cache', 'rerun', 'runs.sqlite')
+
+DAY = 24 * 60 * 60
+# How long runs are kept, and how far back reports look.
+KEEP_DAYS = 30
+REPORT_DAYS = 7
+# The fewest runs a median is worth taking of.
+MIN_RUNS = 3
+# How much the median has to change by from one day to the next to report it.
+TREND_THRESHOLD = 0.1
+# How much slower than usual the runs a file causes have to be, to report it.
+SLOW_FACTOR = 1.5
+MAX_SLOW_FILES = 5
+# Runs with more changed files than this, such as after switching branches,
+# say nothing about any one of them, so their files aren't saved.
+MAX_FILES = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    command TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    returncode INTEGER NOT NULL,
+    cpu_seconds REAL,
+    max_rss INTEGER,
+    changed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_command_time ON runs (command, time);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE TABLE IF NOT EXISTS run_files (
+    run INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    filename TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS run_files_run ON run_files (run);
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def get_usage():
+    '''
+    Returns (CPU seconds, peak RSS in KB) of all the child processes which
+    have finished, or None where that isn't available.
+    '''
+    try:
+        import resource
+    except ImportError:
+        # Windows.
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    max_rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        # In bytes, rather than KB.
+        max_rss //= 1024
+    return usage.ru_utime + usage.ru_stime, max_rss
+
+
+def format_change(now, before):
+    change = now / before - 1 if before else 0.0
+    return '%d%% %s than the day before (median %.2fs, was %.2fs)' % (
+        round(abs(change) * 100), 'slower' if change > 0 else 'faster',
+        now, before,
+    )
+
+
+class RunRecord(object):
+    '''
+    Saves runs of the command to the database in the given file, and reports
+    on them.
+    '''
+    def __init__(self, filename=RECORD_FILE, output=None):
+        self.output = output or sys.stderr
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(filename)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        with self.db:
+            self.db.executescript(SCHEMA)
+            self.db.execute(
+                'DELETE FROM runs WHERE time < ?',
+                (time.time() - KEEP_DAYS * DAY,)
+            )
+        # The commands run this time, to report on when rerun exits.
+        self.commands = []
+
+    def start_run(self):
+        return time.time(), get_usage()
+
+    def end_run(self, run, command, changed_files, first_time, returncode):
+        '''
+        Saves a run. Those on which nothing was run, or which were stopped, so
+        that returncode is None, aren't saved. The trigger files aren't saved
+        for the first run, for which every file counts as changed.
+
+        Only the peak RSS of all child processes so far is known, so a run's
+        max_rss is saved only if it is more than the peak before the run, and
+        so is the run's own.
+        '''
+        if returncode is None:
+            return
+        start, before = run
+        seconds = time.time() - start
+        after = get_usage()
+        cpu_seconds = max_rss = None
+        if before is not None and after is not None:
+            cpu_seconds = after[0] - before[0]
+            if after[1] > before[1]:
+                max_rss = after[1]
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (time, command, seconds, returncode, '
+                'cpu_seconds, max_rss, changed) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    start, command, seconds, returncode, cpu_seconds, max_rss,
+                    len(changed_files),
+                )
+            )
+            if not first_time and len(changed_files) <= MAX_FILES:
+                self.db.executemany(
+                    'INSERT INTO run_files (run, filename) VALUES (?, ?)',
+                    [
+                        (cursor.lastrowid, os.path.normpath(filename))
+                        for filename in changed_files
+                    ]
+                )
+        if command not in self.commands:
+            self.commands.append(command)
+
+    def get_commands(self):
+        return [
+            command for command, in self.db.execute(
+                'SELECT DISTINCT command FROM runs ORDER BY command')
+        ]
+
+    def _get_slow_files(self, command, usual, since):
+        seconds = {}
+        for filename, run_seconds in self.db.execute(
+            'SELECT filename, seconds FROM run_files '
+            'JOIN runs ON runs.id = run_files.run '
+            'WHERE command = ? AND time >= ?',
+            (command, since)
+        ):
+            seconds.setdefault(filename, []).append(run_seconds)
+        slow = []
+        for filename, values in seconds.items():
+            if len(values) >= MIN_RUNS and \
+                    median(values) >= usual * SLOW_FACTOR:
+                slow.append((median(values), len(values), filename))
+        slow.sort(key=lambda item: (-item[0], item[2]))
+        return slow[:MAX_SLOW_FILES]
+
+    def report(self, command, now=None):
+        '''
+        Returns lines about the runs of the command over the last week: how
+        long they took, whether the last day's were slower or faster than the
+        day before's, and the changed files whose runs were much slower than
+        usual.
+        '''
+        if now is None:
+            now = time.time()
+        since = now - REPORT_DAYS * DAY
+        rows = self.db.execute(
+            'SELECT time, seconds, cpu_seconds, max_rss FROM runs '
+            'WHERE command = ? AND time >= ?',
+            (command, since)
+        ).fetchall()
+        if not rows:
+            return []
+        usual = median([row[1] for row in rows])
+        parts = [
+            '%d run%s this week' % (len(rows), '' if len(rows) == 1 else 's'),
+            'median %.2fs' % (usual,),
+        ]
+        cpu = [row[2] for row in rows if row[2] is not None]
+        if cpu:
+            parts.append('%.2fs CPU' % (median(cpu),))
+        rss = [row[3] for row in rows if row[3] is not None]
+        if rss:
+            parts.append('peak %.0fMB' % (max(rss) / 1024.0,))
+        lines = ['rerun record: %s: %s' % (command, ', '.join(parts))]
+
+        today = [row[1] for row in rows if row[0] >= now - DAY]
+        yesterday = [
+            row[1] for row in rows if now - 2 * DAY <= row[0] < now - DAY]
+        if len(today) >= MIN_RUNS and len(yesterday) >= MIN_RUNS:
+            now_median, before = median(today), median(yesterday)
+            if abs(now_median / before - 1) >= TREND_THRESHOLD:
+                lines.append('  ' + format_change(now_median, before))
+
+        for seconds, count, filename in self._get_slow_files(
+            command, usual, since
+        ):
+            lines.append(
+                '  changing %s makes it slow: median %.2fs over %d runs' % (
+                    filename, seconds, count))
+        return lines
+
+    def close(self):
+        lines = []
+        for command in self.commands:
+            lines.extend(self.report(command))
+        if lines:
+            self.output.write('\n'.join(lines) + '\n')
+            self.output.flush()
+        self.db.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m rerun.record',
+        description='Reports on the runs which rerun --record has saved.',
+    )
+    parser.add_argument('file',
+        nargs='?', default=RECORD_FILE,
+        help='The database to read. Defaults to %(default)s.')
+    options = parser.parse_args(args)
+    if not os.path.isfile(options.file):
+        sys.exit('rerun: no runs recorded in %s.' % (options.file,))
+    record = RunRecord(options.file, sys.stdout)
+    try:
+        for command in record.get_commands():
+            for line in record.report(command):
+                sys.stdout.write(line + '\n')
+    finally:
+        record.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,142 +1,261 @@
-import itertools
 import os
-import platform
+import shlex
 import signal
-import stat
 import sys
 import subprocess
 import time
 
-from .options import get_parser, parse_args, validate
+# Only the modules every run needs are imported here. The rest, such as
+# asyncio, and the modules for {changed_tests}, --config and --snapshot, are
+# imported where they are used, so that rerun starts quickly, and a run that
+# doesn't use them never pays for them.
+from . import terminal
+from .changes import ChangeTracker, get_env
+from .options import get_parser, parse_args, validate, WINDOWS
+from .watchers import SKIP_DIRS, SKIP_EXT
 
 
-SKIP_DIRS = [
-    '.bzr', '.cache', '.git', '.hg', '.pytest_cache', '.svn',
-    '__pycache__', 'build', 'dist', 'node_modules',
-]
-SKIP_EXT = ['.pyc', '.pyo']
+def clear_screen(scrollback=False):
+    if WINDOWS:
+        # The Windows console only understands escape sequences if asked to.
+        os.system('cls')
+    else:
+        terminal.clear(sys.stdout, scrollback)
+
+
+def show_status(returncode, seconds, options):
+    '''
+    Shows how the command exited, and how long it ran, unless --no-status.
+    '''
+    if returncode is not None and options.status:
+        terminal.show_status(sys.stdout, returncode, seconds)
+
 
-try:
-    # Python2
-    filterfalse = itertools.ifilterfalse
-except AttributeError:
-    # Python3
-    filterfalse = itertools.filterfalse
+def run_command_in_shell(command, shell, env=None):
+    return subprocess.call(command, shell=True, executable=shell, env=env)
+
+
+def run_command_in_interactive_shell(command, shell, env=None):
+    try:
+        return subprocess.call([shell, '-i', '-c', command], env=env)
+    finally:
+        # The terminal was attached to the interactive shell we just
+        # started, and left in limbo when that shell terminated. Retrieve
+        # it for this process group, so that we can still print and recieve
+        # keypresses.
+        os.tcsetpgrp(0, os.getpgrp())
 
 
-def is_ignorable(filename, ignores):
+def run_command(command, shell, interactive, env=None):
     '''
-    Returns True if filename is in 'ignores' or ends with a SKIP_EXT
+    Runs the command, and returns its exit status.
     '''
-    return (
-        any(os.path.basename(filename) == i for i in ignores) or
-        any(filename.endswith(skip) for skip in SKIP_EXT)
-    )
+    if interactive:
+        return run_command_in_interactive_shell(command, shell, env)
+    return run_command_in_shell(command, shell, env)
 
 
-def get_file_mtime(filename):
-    return os.lstat(filename)[stat.ST_MTIME]
+# How long a command gets to exit after SIGTERM, before we SIGKILL it.
+STOP_GRACE = 5
 
 
-def skip_dirs(dirs, skips):
-    for skip in skips:
-        if skip in dirs:
-            dirs.remove(skip)
+def is_group_alive(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except OSError:
+        return False
+    return True
 
 
-file_stat_cache = {}
+# Which files were added, modified and deleted, for the command's environment.
+change_tracker = ChangeTracker()
 
-def has_file_changed(filename):
+def get_change_variables(changed_files, first_time):
     '''
-    Has the given file changed since last invocation?
+    Returns the environment variables which tell the command about the
+    changed files.
     '''
-    try:
-        mtime = get_file_mtime(filename)
-    except FileNotFoundError:
-        if filename in file_stat_cache:
-            del file_stat_cache[filename]
-        return True
-
-    if (
-        filename not in file_stat_cache or
-        file_stat_cache[filename] != mtime
-    ):
-        file_stat_cache[filename] = mtime
-        return True
-    return False
-
-
-def get_changed_files(ignores):
-    '''
-    Walks subdirs of cwd, looking for files which have changed since last
-    invocation.
-    '''
-    changed_files = []
-    for root, dirs, files in os.walk('.'):
-        skip_dirs(dirs, ignores)
-        for filename in files:
-            relname = os.path.join(root, filename)
-            if (
-                has_file_changed(relname) and
-                not is_ignorable(relname, ignores)
-            ):
-                changed_files.append(relname)
-    return changed_files
-
-
-def clear_screen():
-    if platform.system().lower().startswith('win'):
-        os.system('cls')
-    else:
-        os.system('clear')
+    change_tracker.clean()
+    return change_tracker.get_variables(
+        change_tracker.classify(changed_files, first_time))
 
 
-def run_command_in_shell(command, shell):
-    subprocess.call(command, shell=True, executable=shell)
+CHANGED_TESTS = '{changed_tests}'
+CHANGED_FILES = '{files}'
 
+# The longest list of files to put in place of a placeholder. The shell gets
+# the command as a single argument, which Linux limits to 128KB.
+PLACEHOLDER_LIMIT = 32 * 1024
 
-def run_command_in_interactive_shell(command, shell):
-    try:
-        subprocess.call([shell, '-i', '-c', command])
-    finally:
-        # The terminal was attached to the interactive shell we just
-        # started, and left in limbo when that shell terminated. Retrieve
-        # it for this process group, so that we can still print and recieve
-        # keypresses.
-        os.tcsetpgrp(0, os.getpgrp())
 
+class TooManyFiles(Exception):
+    pass
 
-def run_command(command, shell, interactive):
-    if interactive:
-        run_command_in_interactive_shell(command, shell)
-    else:
-        run_command_in_shell(command, shell)
 
+def quote_files(filenames, placeholder):
+    quoted = ' '.join(
+        shlex.quote(os.path.normpath(filename)) for filename in filenames
+    )
+    if len(quoted) > PLACEHOLDER_LIMIT:
+        message = 'Too many files to put in place of %s.' % (placeholder,)
+        if placeholder == CHANGED_FILES:
+            message += (
+                ' Read them from $RERUN_CHANGED_FILES instead, or from'
+                ' $RERUN_CHANGED_FILES_LIST if that is unset.'
+            )
+        raise TooManyFiles(message)
+    return quoted
 
-def act(changed_files, options, first_time):
+
+def expand_command(command, changed_files, options):
     '''
-    Runs the user's specified command.
+    Replaces placeholders in the command. Returns None if there's nothing to
+    run: if the command needs changed tests but no tests were affected, or
+    needs changed files but they were all deleted. Raises TooManyFiles if the
+    files would make the command too long to run.
+    '''
+    if CHANGED_TESTS in command:
+        from .deps import get_affected_tests
+        tests = get_affected_tests(changed_files, options)
+        if not tests:
+            return None
+        command = command.replace(
+            CHANGED_TESTS, quote_files(tests, CHANGED_TESTS))
+    if CHANGED_FILES in command:
+        existing = [name for name in changed_files if os.path.lexists(name)]
+        if not existing:
+            return None
+        command = command.replace(
+            CHANGED_FILES, quote_files(existing, CHANGED_FILES))
+    return command
+
+
+def act_on_rules(changed_files, options, first_time):
+    '''
+    Runs the commands from the config file whose paths match changed files.
+    Returns 0 if they all passed, 1 if not, or if any had too many changed
+    files to run, or None if none matched.
+    '''
+    from .jobs import Job, run_jobs
+    change_tracker.clean()
+    changes = change_tracker.classify(changed_files, first_time)
+    jobs = []
+    errors = []
+    for rule in options.rules:
+        selected = rule.select(changed_files)
+        if selected:
+            try:
+                command = expand_command(rule.command, selected, options)
+            except TooManyFiles as exc:
+                errors.append('%s: %s' % (rule.name, exc))
+                continue
+            if command is not None:
+                env = get_env(change_tracker.get_variables(
+                    changes.select(selected)))
+                jobs.append(
+                    Job(rule.name, command, rule.needs, rule.lock, env))
+    if not jobs and not errors:
+        return None
+    clear_screen(options.scrollback)
+    for job in jobs:
+        print(job.command)
+    if options.verbose and not first_time:
+        print(', '.join(sorted(changed_files)))
+    for error in errors:
+        print(error)
+    if not jobs:
+        return 1
+    passed = run_jobs(jobs, options.shell, options.jobs)
+    return 0 if passed and not errors else 1
+
+
+def show_command(changed_files, options, first_time):
     '''
-    clear_screen()
+    Clears the screen and shows the command that is about to run. Returns the
+    command with its placeholders expanded, or None if there's nothing to run.
+    '''
+    too_many = None
+    try:
+        command = expand_command(options.command, changed_files, options)
+    except TooManyFiles as exc:
+        command = None
+        too_many = exc
+    clear_screen(options.scrollback)
     print(options.command)
     if options.verbose and not first_time:
         print(', '.join(sorted(changed_files)))
-    # Launch the user's given command in an interactive shell, so that aliases
-    # & functions are interpreted just as when the user types at a terminal.
-    run_command(options.command, options.shell, options.interactive)
+    if too_many is not None:
+        print(too_many)
+    elif command is None:
+        if CHANGED_TESTS in options.command:
+            print('No tests are affected by the changed files.')
+        else:
+            print('The changed files were all deleted.')
+    return command
 
 
-def step(options, first_time=False):
-    changed_files = get_changed_files(options.ignore)
-    if changed_files:
-        act(changed_files, options, first_time)
-    time.sleep(0.2)
+def act(changed_files, options, first_time):
+    '''
+    Runs the user's specified command, in the foreground. Returns its exit
+    status, or None if nothing was run. rerun.aio runs it itself, except with
+    --config or --interactive.
+    '''
+    if options.rules:
+        return act_on_rules(changed_files, options, first_time)
+    command = show_command(changed_files, options, first_time)
+    if command is None:
+        return None
+    env = get_env(get_change_variables(changed_files, first_time))
+    # Launch the user's given command in an interactive shell, so that
+    # aliases & functions are interpreted just as when the user types at
+    # a terminal.
+    return run_command(command, options.shell, options.interactive, env)
+
+
+def wait_for_quiet(watcher, changed_files, seconds):
+    '''
+    Keeps collecting changed files until none have been seen for the given
+    number of seconds, then returns them all. This turns a burst of changes,
+    such as a 'git checkout', into a single run of the command.
+    '''
+    changed = set(changed_files)
+    quiet_since = time.time()
+    while True:
+        remaining = quiet_since + seconds - time.time()
+        if remaining <= 0:
+            return sorted(changed)
+        watcher.wait(remaining)
+        more = watcher.get_changed_files()
+        if more:
+            changed.update(more)
+            quiet_since = time.time()
+
+
+def get_changes(options, watcher, first_time=False):
+    '''
+    Returns the files which have changed, and whether this is the first time,
+    i.e. whether they're all the files there are, rather than ones which have
+    changed, which is no longer true if we compared them to a snapshot.
+    '''
+    changed_files = watcher.get_changed_files()
+    if first_time and options.snapshot:
+        from .snapshot import changes_since_snapshot
+        since_snapshot = changes_since_snapshot(watcher.matcher)
+        if since_snapshot is not None:
+            # Only run if files changed while we weren't running.
+            changed_files, first_time = since_snapshot, False
+    if changed_files and options.debounce and not first_time:
+        changed_files = wait_for_quiet(
+            watcher, changed_files, options.debounce / 1000.0)
+    return changed_files, first_time
 
 
 def mainloop(options):
-    step(options, first_time=True)
-    while True:
-        step(options)
+    # The asyncio loop is built from the pieces in this module.
+    import asyncio
+    from .aio import rerun
+    with terminal.alternate_screen(sys.stdout, options.alt_screen):
+        asyncio.run(rerun(options))
 
 
 def main():
@@ -0,0 +1,140 @@
+'''
+Saves the state of the watched files when rerun exits, so that the next time
+it starts, it can tell which files changed while it wasn't running. The state
+saved is that of the files as of the last run which finished, so that changes
+which were never run on, because they were still waiting to run, or their
+run was stopped, are run on next time.
+'''
+import gzip
+import os
+import tempfile
+
+from .watchers import walk_tree
+
+
+SNAPSHOT_FILE = os.path.join('.cache', 'rerun', 'snapshot.gz')
+HEADER = 'rerun-snapshot 1'
+
+
+def take_snapshot(matcher):
+    '''
+    Returns {filename: (mtime_ns, size)} for every unignored file under cwd.
+    '''
+    return dict(
+        (relname, (filestat.st_mtime_ns, filestat.st_size))
+        for relname, filestat in walk_tree('.', matcher).items()
+    )
+
+
+def get_states(filenames):
+    '''
+    Returns {filename: (mtime_ns, size)} for the given files, or None for
+    those which don't exist.
+    '''
+    states = {}
+    for relname in filenames:
+        try:
+            filestat = os.lstat(relname)
+        except OSError:
+            states[relname] = None
+        else:
+            states[relname] = (filestat.st_mtime_ns, filestat.st_size)
+    return states
+
+
+def save_snapshot(snapshot, filename=SNAPSHOT_FILE):
+    '''
+    Writes the snapshot as gzipped lines of 'mtime_ns size filename'. The file
+    is replaced atomically, so an interrupted save never leaves it corrupt.
+    '''
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tempname = tempfile.mkstemp(dir=dirname, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as fp:
+                fp.write((HEADER + '\n').encode('ascii'))
+                for relname, (mtime_ns, size) in sorted(snapshot.items()):
+                    if '\n' in relname:
+                        continue
+                    line = '%d %d %s\n' % (mtime_ns, size, relname)
+                    fp.write(line.encode('utf-8', 'surrogateescape'))
+        os.replace(tempname, filename)
+    except BaseException:
+        os.remove(tempname)
+        raise
+
+
+def load_snapshot(filename=SNAPSHOT_FILE):
+    '''
+    Returns the saved snapshot, or None if there isn't a readable one.
+    '''
+    try:
+        with gzip.open(filename, 'rb') as fp:
+            lines = fp.read().decode('utf-8', 'surrogateescape').splitlines()
+    except (IOError, OSError, EOFError, ValueError):
+        return None
+    if not lines or lines[0] != HEADER:
+        return None
+    snapshot = {}
+    try:
+        for line in lines[1:]:
+            mtime_ns, size, relname = line.split(' ', 2)
+            snapshot[relname] = (int(mtime_ns), int(size))
+    except ValueError:
+        return None
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    '''
+    Returns the sorted files which were added, modified or deleted.
+    '''
+    changed = set(
+        relname for relname, state in new.items()
+        if old.get(relname) != state
+    )
+    changed.update(set(old) - set(new))
+    return sorted(changed)
+
+
+def changes_since_snapshot(matcher, filename=SNAPSHOT_FILE):
+    '''
+    Returns the files changed since the snapshot was saved, or None if there
+    is no snapshot.
+    '''
+    old = load_snapshot(filename)
+    if old is None:
+        return None
+    return diff_snapshots(old, take_snapshot(matcher))
+
+
+class Snapshot(object):
+    '''
+    Keeps the state of the files as of the last run which finished, starting
+    from the saved snapshot, if there is one. Each run, only the changed files
+    are looked at. Without a saved snapshot, nothing is saved until the first
+    run, of every file, has finished.
+    '''
+    def __init__(self, state=None):
+        self.state = state
+
+    def start_run(self, changed_files, first_time):
+        return first_time, get_states(changed_files)
+
+    def end_run(self, run):
+        first_time, states = run
+        if first_time:
+            self.state = {}
+        if self.state is None:
+            return
+        for relname, state in states.items():
+            if state is None:
+                self.state.pop(relname, None)
+            else:
+                self.state[relname] = state
+
+    def save(self, filename=SNAPSHOT_FILE):
+        if self.state is not None:
+            save_snapshot(self.state, filename)
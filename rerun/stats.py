@@ -0,0 +1,266 @@
+'''
+With --stats, records where rerun spends its time: what each sweep for changed
+files looked at and how long it took, and for each run of the command, how
+long after the file was modified the command started, and how long it ran.
+A summary is printed after each run, and histograms when rerun exits.
+'''
+import math
+import os
+import sys
+import threading
+import time
+
+
+class Sweep(object):
+    '''
+    Counts for one call to a watcher's get_changed_files. Watchers add to
+    these while they run, maybe from several threads at once.
+    '''
+    FIELDS = [
+        'dirs', 'files', 'stat_calls', 'ignored',
+        'walk_seconds', 'match_seconds', 'compare_seconds',
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for field, value in counts.items():
+                setattr(self, field, getattr(self, field) + value)
+
+
+# The sweep in progress, if --stats is on. Watchers check for None before
+# counting anything, so that without --stats they do no extra work.
+current = None
+
+
+class TimingMatcher(object):
+    '''
+    Wraps an IgnoreMatcher, adding the time spent matching, and how many
+    entries were ignored, to the current sweep. Its other methods are passed
+    through untimed.
+    '''
+    def __init__(self, matcher):
+        self.matcher = matcher
+
+    def __getattr__(self, name):
+        # Anything not timed, such as adding patterns from --control, goes
+        # straight to the wrapped matcher.
+        return getattr(self.matcher, name)
+
+    def _time(self, method, relname):
+        start = time.perf_counter()
+        ignored = method(relname)
+        sweep = current
+        if sweep is not None:
+            sweep.add(
+                match_seconds=time.perf_counter() - start,
+                ignored=int(ignored),
+            )
+        return ignored
+
+    def ignores_file(self, relname):
+        return self._time(self.matcher.ignores_file, relname)
+
+    def ignores_dir(self, relname):
+        return self._time(self.matcher.ignores_dir, relname)
+
+    def prune_dirs(self, root, dirs):
+        dirs[:] = [
+            name for name in dirs
+            if not self.ignores_dir(os.path.join(root, name))
+        ]
+
+
+class Histogram(object):
+    '''
+    Counts durations in buckets which double in size: up to 1ms, 1-2ms,
+    2-4ms, and so on.
+    '''
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        millis = seconds * 1000
+        bucket = 0 if millis < 1 else int(math.log(millis, 2)) + 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def format(self, width=40):
+        if not self.count:
+            return ['  (none)']
+        most = max(self.buckets.values())
+        lines = []
+        for bucket in range(min(self.buckets), max(self.buckets) + 1):
+            count = self.buckets.get(bucket, 0)
+            low = 0 if bucket == 0 else 2 ** (bucket - 1)
+            label = '%d-%dms' % (low, 2 ** bucket)
+            bar = '#' * int(math.ceil(width * count / float(most)))
+            lines.append('  %14s %-*s %d' % (label, width, bar, count))
+        return lines
+
+
+class Stats(object):
+    '''
+    Collects Sweeps and runs of the command. If given a file, each one is also
+    written to it as a line of JSON, as it happens.
+    '''
+    def __init__(self, filename=None, output=None):
+        self.output = output or sys.stderr
+        self.file = open(filename, 'a') if filename else None
+        self.sweep_times = Histogram()
+        self.latencies = Histogram()
+        self.durations = Histogram()
+        self.totals = dict((field, 0) for field in Sweep.FIELDS)
+        self.cache_size = 0
+        self.unreported = 0
+
+    def _write(self, record):
+        if self.file:
+            import json
+            self.file.write(json.dumps(record, sort_keys=True) + '\n')
+            self.file.flush()
+
+    def record_sweep(self, sweep, seconds, changed, cache_size):
+        self.sweep_times.add(seconds)
+        for field in Sweep.FIELDS:
+            self.totals[field] += getattr(sweep, field)
+        self.cache_size = cache_size
+        self.unreported += 1
+        record = dict(
+            (field, getattr(sweep, field)) for field in Sweep.FIELDS)
+        record.update(
+            type='sweep', time=time.time(), seconds=seconds,
+            changed=changed, cache_size=cache_size,
+        )
+        self._write(record)
+
+    def start_run(self, changed_files, first_time):
+        '''
+        Returns (start time, seconds since the newest changed file was
+        modified), the latter None on the first run, when all files count as
+        changed.
+        '''
+        now = time.time()
+        latency = None
+        if not first_time:
+            mtimes = []
+            for filename in changed_files:
+                try:
+                    mtimes.append(os.lstat(filename).st_mtime)
+                except OSError:
+                    # Deleted.
+                    continue
+            if mtimes:
+                latency = max(0.0, now - max(mtimes))
+        return now, latency
+
+    def end_run(self, run, changed_files):
+        start, latency = run
+        duration = time.time() - start
+        if latency is not None:
+            self.latencies.add(latency)
+        self.durations.add(duration)
+        self._write(dict(
+            type='run', time=start, latency=latency, duration=duration,
+            changed=len(changed_files),
+        ))
+        self.output.write(self.summary(latency, duration) + '\n')
+        self.output.flush()
+
+    def summary(self, latency, duration):
+        '''
+        One line about the sweeps since the last summary, and the last run.
+        '''
+        parts = [
+            '%d sweeps' % (self.unreported,),
+            'mean %.1fms' % (self.sweep_times.mean * 1000,),
+            '%d files cached' % (self.cache_size,),
+        ]
+        if latency is not None:
+            parts.append('started %.0fms after change' % (latency * 1000,))
+        parts.append('ran %.2fs' % (duration,))
+        self.unreported = 0
+        return 'rerun stats: ' + ', '.join(parts)
+
+    def report(self):
+        '''
+        Returns lines of totals and histograms for everything recorded.
+        '''
+        count = self.sweep_times.count
+        lines = ['rerun stats: %d sweeps, %.2fs in total' % (
+            count, self.sweep_times.total)]
+        if count:
+            walk = self.totals['walk_seconds'] - self.totals['match_seconds']
+            lines.append(
+                '  per sweep: %.0f dirs, %.0f files, %.0f stat calls, '
+                '%.0f ignored' % tuple(
+                    self.totals[field] / float(count)
+                    for field in ['dirs', 'files', 'stat_calls', 'ignored']
+                )
+            )
+            lines.append(
+                '  per sweep: walking %.2fms, matching ignores %.2fms, '
+                'comparing %.2fms' % (
+                    max(0.0, walk) * 1000 / count,
+                    self.totals['match_seconds'] * 1000 / count,
+                    self.totals['compare_seconds'] * 1000 / count,
+                )
+            )
+            lines.append('  cache size: %d' % (self.cache_size,))
+        for title, histogram in [
+            ('sweep time', self.sweep_times),
+            ('time from change to command', self.latencies),
+            ('command duration', self.durations),
+        ]:
+            lines.append('%s (mean %.1fms):' % (title, histogram.mean * 1000))
+            lines.extend(histogram.format())
+        return lines
+
+    def close(self):
+        self.output.write('\n'.join(self.report()) + '\n')
+        self.output.flush()
+        if self.file:
+            self.file.close()
+
+
+class StatsWatcher(object):
+    '''
+    Wraps a watcher, recording a Sweep for each call to get_changed_files.
+    '''
+    def __init__(self, watcher, stats):
+        self.watcher = watcher
+        self.matcher = watcher.matcher
+        self.stats = stats
+
+    def get_changed_files(self):
+        global current
+        sweep = current = Sweep()
+        start = time.perf_counter()
+        try:
+            changed = self.watcher.get_changed_files()
+        finally:
+            current = None
+        seconds = time.perf_counter() - start
+        self.stats.record_sweep(
+            sweep, seconds, len(changed), self.watcher.cache_size())
+        return changed
+
+    def cache_size(self):
+        return self.watcher.cache_size()
+
+    def wait(self, timeout=None):
+        self.watcher.wait(timeout)
+
+    def close(self):
+        self.watcher.close()
@@ -0,0 +1,98 @@
+'''
+Controls the terminal by writing ANSI escape sequences to it, rather than by
+starting a 'clear' process before every run. When the output isn't a
+terminal, e.g. it is piped to a file or collected by CI, no escape sequences
+are written, so the output of each run just follows the last.
+'''
+from contextlib import contextmanager
+import os
+import time
+
+
+CSI = '\x1b['
+HOME = CSI + 'H'
+CLEAR_SCREEN = CSI + '2J'
+CLEAR_SCROLLBACK = CSI + '3J'
+ALT_SCREEN_ON = CSI + '?1049h'
+ALT_SCREEN_OFF = CSI + '?1049l'
+GREEN = CSI + '1;32m'
+RED = CSI + '1;31m'
+RESET = CSI + '0m'
+
+# Used if the terminal won't tell us its height.
+DEFAULT_LINES = 24
+
+
+def is_terminal(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        # Not a file, or closed.
+        return False
+
+
+def get_lines(stream):
+    try:
+        return os.get_terminal_size(stream.fileno()).lines
+    except (AttributeError, ValueError, OSError):
+        return DEFAULT_LINES
+
+
+def clear(stream, scrollback=False):
+    '''
+    Clears the terminal, and its scrollback. With 'scrollback', the screen
+    is instead scrolled up until it's empty, so that the output of previous
+    runs can still be scrolled back to.
+    '''
+    if not is_terminal(stream):
+        return
+    if scrollback:
+        codes = '\n' * get_lines(stream) + HOME + CLEAR_SCREEN
+    else:
+        codes = HOME + CLEAR_SCREEN + CLEAR_SCROLLBACK
+    stream.write(codes)
+    stream.flush()
+
+
+@contextmanager
+def alternate_screen(stream, enabled=True):
+    '''
+    Switches the terminal to its alternate screen for the duration, as
+    full-screen programs do, so that the terminal's previous contents are
+    shown again afterwards.
+    '''
+    if not enabled or not is_terminal(stream):
+        yield
+        return
+    stream.write(ALT_SCREEN_ON)
+    stream.flush()
+    try:
+        yield
+    finally:
+        stream.write(ALT_SCREEN_OFF)
+        stream.flush()
+
+
+def format_status(returncode, seconds, color=False, now=None):
+    '''
+    Returns a line saying how the command exited, how long it ran, and when
+    it finished.
+    '''
+    if returncode < 0:
+        result = 'killed by signal %d' % (-returncode,)
+    else:
+        result = 'exit status %d' % (returncode,)
+    line = 'rerun: %s, ran %.2fs, at %s' % (
+        result, seconds, time.strftime('%H:%M:%S', time.localtime(now)))
+    if color:
+        line = (GREEN if returncode == 0 else RED) + line + RESET
+    return line
+
+
+def show_status(stream, returncode, seconds):
+    '''
+    Writes the status line, colored if the stream is a terminal.
+    '''
+    stream.write(
+        format_status(returncode, seconds, is_terminal(stream)) + '\n')
+    stream.flush()
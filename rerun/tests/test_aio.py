@@ -0,0 +1,588 @@
+import asyncio
+import io
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import call, Mock, patch
+
+from rerun import aio
+from rerun.aio import (
+    KeyReader, rerun, Rerunner, run_command, stop_process, watch,
+)
+from rerun.ignore import IgnoreMatcher
+from rerun.output import OutputHistory
+from rerun.record import RunRecord
+from rerun.snapshot import Snapshot
+from rerun.stats import TimingMatcher
+from rerun.rerun import is_group_alive
+from rerun.tests.test_rerun import get_options
+from rerun.tests.test_watchers import temp_cwd
+
+
+class FakeWatcher(object):
+    '''
+    Reports the given batches of changed files, one per call, then none.
+    '''
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.matcher = Mock()
+        self.closed = False
+
+    def get_changed_files(self):
+        return self.batches.pop(0) if self.batches else []
+
+    def wait(self, timeout=None):
+        time.sleep(0.01)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeControl(object):
+    '''
+    Records what a Rerunner publishes and replies, and feeds it requests.
+    '''
+    def __init__(self):
+        self.requests = asyncio.Queue()
+        self.events = []
+        self.replies = []
+
+    def publish(self, event, **details):
+        self.events.append((event, details))
+
+    def reply(self, client, request, error=None):
+        self.replies.append((request, error))
+
+
+def run(coroutine, timeout=5):
+    async def with_timeout():
+        return await asyncio.wait_for(coroutine, timeout)
+    return asyncio.run(with_timeout())
+
+
+class Test_Watch(unittest.TestCase):
+
+    def test_watch(self):
+        watcher = FakeWatcher(['a', 'b'], [], ['c'])
+
+        async def first_two():
+            changes = []
+            async for changed in watch(get_options(), watcher):
+                changes.append(changed)
+                if len(changes) == 2:
+                    return changes
+
+        self.assertEqual(
+            run(first_two()),
+            [(['a', 'b'], True), (['c'], False)]
+        )
+
+
+@unittest.skipIf(not hasattr(os, 'killpg'), 'No process groups.')
+class Test_RunCommand(unittest.TestCase):
+
+    def test_run_command_returns_exit_status(self):
+        self.assertEqual(run(run_command('exit 3', '/bin/sh')), 3)
+
+
+    def test_run_command_streams_output(self):
+        chunks = []
+        returncode = run(run_command(
+            'echo one; echo two >&2', '/bin/sh', output=chunks.append))
+        self.assertEqual(returncode, 0)
+        self.assertEqual(b''.join(chunks), b'one\ntwo\n')
+
+
+    def test_run_command_stops_the_command_when_cancelled(self):
+        pids = []
+
+        def record_pid(chunk):
+            pids.append(int(chunk))
+
+        async def cancel_soon():
+            task = asyncio.ensure_future(run_command(
+                'echo $$; sleep 30 & sleep 30; wait', '/bin/sh',
+                output=record_pid, new_session=True,
+            ))
+            while not pids:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.time()
+        run(cancel_soon())
+
+        self.assertLess(time.time() - start, 5)
+        # Orphaned grandchildren linger as zombies until init reaps them.
+        deadline = time.time() + 5
+        while is_group_alive(pids[0]) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(is_group_alive(pids[0]))
+
+
+    def test_run_command_in_our_process_group_unless_asked(self):
+        script = '%s -c "import os; print(os.getpgrp())"' % (
+            shlex.quote(sys.executable),)
+        for new_session in [False, True]:
+            chunks = []
+            run(run_command(
+                script, '/bin/sh', chunks.append, new_session=new_session))
+            self.assertEqual(
+                int(b''.join(chunks)) == os.getpgrp(), not new_session)
+
+
+    def test_stop_process_gives_commands_in_our_group_time_to_exit(self):
+        async def stop_soon():
+            process = await asyncio.create_subprocess_shell(
+                'echo started; sleep 0.2', executable='/bin/sh',
+                stdout=subprocess.PIPE,
+            )
+            await process.stdout.readline()
+            await stop_process(process, 5, group=False)
+            return process.returncode
+
+        self.assertEqual(run(stop_soon()), 0)
+
+
+    def test_stop_process_kills_commands_that_ignore_sigterm(self):
+        async def stop_soon():
+            process = await asyncio.create_subprocess_shell(
+                "trap '' TERM; echo started; sleep 30", executable='/bin/sh',
+                start_new_session=True, stdout=subprocess.PIPE,
+            )
+            await process.stdout.readline()
+            await stop_process(process, 0.2)
+            return process.returncode
+
+        start = time.time()
+        self.assertEqual(run(stop_soon()), -signal.SIGKILL)
+        self.assertLess(time.time() - start, 5)
+
+
+    def test_stop_process_on_finished_command(self):
+        async def stop_finished():
+            process = await asyncio.create_subprocess_shell(
+                'true', executable='/bin/sh', start_new_session=True)
+            await process.wait()
+            await stop_process(process, 0)
+            return process.returncode
+
+        self.assertEqual(run(stop_finished()), 0)
+
+
+@patch('rerun.aio.show_command', lambda changed, options, first: 'cmd')
+class Test_Rerunner(unittest.TestCase):
+
+    def run_rerunner(self, options, watcher, runs, command_seconds):
+        '''
+        Runs a Rerunner with a fake command, until it has started the given
+        number of runs, returning the changed files each run was for, and how
+        each run ended.
+        '''
+        started = []
+        ended = []
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            started.append(rerunner.last)
+            try:
+                await asyncio.sleep(command_seconds)
+                ended.append('finished')
+            except asyncio.CancelledError:
+                ended.append('stopped')
+                raise
+
+        async def until_enough_runs():
+            task = asyncio.ensure_future(rerunner.run())
+            while len(started) < runs:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        rerunner = Rerunner(options, watcher)
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(until_enough_runs())
+        return started, ended
+
+
+    def test_changes_while_running_are_run_next(self):
+        watcher = FakeWatcher(['a'], ['b'], ['c'])
+        started, ended = self.run_rerunner(get_options(), watcher, 2, 0.2)
+        self.assertEqual(started, [(['a'], True), (['b', 'c'], False)])
+        self.assertEqual(ended[0], 'finished')
+
+
+    def test_changes_while_running_restart_the_command(self):
+        watcher = FakeWatcher(['a'], [], [], ['b'])
+        started, ended = self.run_rerunner(
+            get_options(restart=True), watcher, 2, 30)
+        self.assertEqual(started, [(['a'], True), (['a', 'b'], True)])
+        self.assertEqual(ended, ['stopped', 'stopped'])
+
+
+    def test_only_restart_runs_commands_in_a_new_session(self):
+        for restart in [False, True]:
+            mock_run_command = Mock(return_value=asyncio.sleep(0, 0))
+            rerunner = Rerunner(get_options(restart=restart), FakeWatcher())
+            with patch('rerun.aio.run_command', mock_run_command):
+                run(rerunner._run_command('cmd', ['a'], {}))
+            self.assertEqual(
+                mock_run_command.call_args[1]['new_session'], restart)
+
+
+    @patch('rerun.snapshot.get_states')
+    def test_snapshot_records_only_runs_which_finished(self, mock_states):
+        mock_states.side_effect = lambda filenames: dict(
+            (filename, (2, 0)) for filename in filenames)
+        snapshot = Snapshot()
+        rerunner = Rerunner(
+            get_options(), FakeWatcher(['a'], ['b']), snapshot=snapshot)
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            if rerunner.last[0] == ['a']:
+                return 0
+            await asyncio.sleep(30)
+
+        async def until_b_runs():
+            task = asyncio.ensure_future(rerunner.run())
+            while rerunner.last is None or 'b' not in rerunner.last[0]:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(until_b_runs())
+        # The run for 'b' was stopped, so 'b' is left to run on next time.
+        self.assertEqual(snapshot.state, {'a': (2, 0)})
+
+
+    def test_restart_includes_the_stopped_runs_files(self):
+        rerunner = Rerunner(get_options(restart=True), FakeWatcher())
+        rerunner.command = Mock()
+        rerunner.last = (['b', 'c'], False)
+        self.assertTrue(rerunner._on_change(['a', 'b'], False))
+        self.assertEqual(rerunner.queued, (['a', 'b', 'c'], False))
+
+
+    @patch('rerun.aio.show_status')
+    def test_shows_status_after_each_run(self, mock_show_status):
+        options = get_options()
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            return 3
+
+        async def until_shown():
+            task = asyncio.ensure_future(
+                Rerunner(options, FakeWatcher(['a'])).run())
+            while not mock_show_status.called:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(until_shown())
+
+        returncode, seconds, shown_options = mock_show_status.call_args[0]
+        self.assertEqual((returncode, shown_options), (3, options))
+        self.assertGreaterEqual(seconds, 0)
+
+
+    @patch('rerun.aio.act')
+    def test_rules_run_in_a_thread(self, mock_act):
+        options = get_options(rules=[Mock()])
+        watcher = FakeWatcher(['a'])
+
+        async def until_acted():
+            task = asyncio.ensure_future(Rerunner(options, watcher).run())
+            while not mock_act.called:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        run(until_acted())
+
+        self.assertEqual(mock_act.call_args, call(['a'], options, True))
+
+
+    def test_control_requests(self):
+        watcher = FakeWatcher(['a'])
+        watcher.matcher = IgnoreMatcher([], [])
+        control = FakeControl()
+        started = []
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            started.append(rerunner.last)
+            return 0
+
+        async def until(condition):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+        async def drive():
+            task = asyncio.ensure_future(rerunner.run())
+            await until(lambda: len(started) == 1)
+            control.requests.put_nowait(('client', dict(request='pause')))
+            await until(lambda: len(control.replies) == 1)
+            watcher.batches.extend([['b.log', 'c'], ['d', 'e.log']])
+            await until(lambda: not watcher.batches)
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(started), 1)
+            control.requests.put_nowait(
+                ('client', dict(request='ignore', pattern='*.log')))
+            await until(lambda: len(control.replies) == 2)
+            watcher.batches.append(['f.log'])
+            await until(lambda: not watcher.batches)
+            control.requests.put_nowait(('client', dict(request='resume')))
+            await until(lambda: len(started) == 2)
+            control.requests.put_nowait(('client', dict(request='trigger')))
+            await until(lambda: len(started) == 3)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        rerunner = Rerunner(get_options(), watcher, control=control)
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(drive())
+
+        self.assertEqual(
+            started,
+            [(['a'], True), (['c', 'd'], False), (['c', 'd'], False)]
+        )
+        self.assertTrue(watcher.matcher.ignores_file('g.log'))
+        self.assertEqual(
+            control.replies,
+            [('pause', None), ('ignore', None), ('resume', None),
+             ('trigger', None)]
+        )
+        events = [event for event, _ in control.events]
+        self.assertEqual(
+            events[:7],
+            ['changed', 'started', 'finished', 'paused', 'changed', 'changed',
+             'ignored']
+        )
+        finished = control.events[2][1]
+        self.assertEqual(
+            (finished['files'], finished['returncode']), (['a'], 0))
+        self.assertGreaterEqual(finished['seconds'], 0)
+        self.assertEqual(
+            control.events[4][1], dict(files=['b.log', 'c'], first_time=False))
+
+
+    @patch('rerun.aio.sys.stderr')
+    def test_reports_commands_it_cannot_run(self, mock_stderr):
+        control = FakeControl()
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            raise OSError(7, 'Argument list too long')
+
+        async def until_finished():
+            task = asyncio.ensure_future(rerunner.run())
+            while not any(event == 'finished' for event, _ in control.events):
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        rerunner = Rerunner(get_options(), FakeWatcher(['a']), control=control)
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(until_finished())
+
+        finished = [
+            details for event, details in control.events
+            if event == 'finished'
+        ]
+        self.assertEqual(finished[0]['returncode'], 1)
+        self.assertIn(
+            'Argument list too long', mock_stderr.write.call_args[0][0])
+
+
+    def test_control_ignore_with_stats(self):
+        # With --stats, the watcher's matcher is a stats.TimingMatcher.
+        watcher = FakeWatcher(['a'])
+        watcher.matcher = TimingMatcher(IgnoreMatcher([], []))
+        control = FakeControl()
+        started = []
+
+        async def fake_run_command(
+                command, shell, env=None, new_session=False):
+            started.append(rerunner.last)
+            return 0
+
+        async def drive():
+            task = asyncio.ensure_future(rerunner.run())
+            while len(started) < 1:
+                await asyncio.sleep(0.01)
+            control.requests.put_nowait(
+                ('client', dict(request='ignore', pattern='*.log')))
+            while not control.replies:
+                await asyncio.sleep(0.01)
+            watcher.batches.append(['b.log', 'c'])
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        options = get_options(stats=True, control='rerun.sock')
+        rerunner = Rerunner(options, watcher, control=control)
+        with patch('rerun.aio.run_command', fake_run_command):
+            run(drive())
+
+        self.assertEqual(started, [(['a'], True), (['c'], False)])
+        self.assertEqual(control.replies, [('ignore', None)])
+
+
+class Test_Rerun(unittest.TestCase):
+
+    @patch('rerun.aio.KeyReader.is_available', Mock(return_value=False))
+    @patch('rerun.snapshot.load_snapshot', Mock(return_value={'./a': (1, 2)}))
+    @patch('rerun.snapshot.changes_since_snapshot', Mock(return_value=[]))
+    @patch('rerun.snapshot.save_snapshot')
+    def test_rerun_saves_snapshot_and_closes_watcher_when_cancelled(
+        self, mock_save
+    ):
+        watcher = FakeWatcher()
+
+        async def cancel_soon():
+            task = asyncio.ensure_future(
+                rerun(get_options(snapshot=True), watcher))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        run(cancel_soon())
+
+        self.assertEqual(mock_save.call_args[0][0], {'./a': (1, 2)})
+        self.assertTrue(watcher.closed)
+
+
+    @unittest.skipIf(not hasattr(os, 'killpg'), 'No process groups.')
+    @patch('rerun.aio.show_command')
+    def test_keeps_output_and_shows_diff(self, mock_show_command):
+        mock_show_command.side_effect = [
+            'echo one; echo two', 'echo one; echo three']
+        stream = io.BytesIO()
+        history = OutputHistory(2)
+        rerunner = Rerunner(
+            get_options(shell='/bin/sh'), FakeWatcher(['a'], ['b']),
+            history=history,
+        )
+
+        async def until_run_twice():
+            task = asyncio.ensure_future(rerunner.run())
+            while len(history.runs) < 2 or rerunner.command is not None:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        with patch('rerun.aio.get_binary_stdout', Mock(return_value=stream)):
+            run(until_run_twice())
+            self.assertEqual(stream.getvalue(), b'one\ntwo\none\nthree\n')
+            rerunner._show_diff()
+
+        self.assertTrue(stream.getvalue().endswith(
+            b"previous run's output:\nthree\n"))
+        history.close()
+
+
+    @unittest.skipIf(not hasattr(os, 'killpg'), 'No process groups.')
+    @patch('rerun.aio.show_command')
+    def test_records_runs(self, mock_show_command):
+        mock_show_command.side_effect = ['exit 3', 'exit 0']
+        with temp_cwd():
+            record = RunRecord('runs.sqlite', Mock())
+            rerunner = Rerunner(
+                get_options(shell='/bin/sh'), FakeWatcher(['a', 'b'], ['b']),
+                record=record,
+            )
+
+            async def until_run_twice():
+                task = asyncio.ensure_future(rerunner.run())
+                while mock_show_command.call_count < 2 or \
+                        rerunner.command is not None:
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+            run(until_run_twice())
+            runs = record.db.execute(
+                'SELECT id, command, returncode, changed FROM runs').fetchall()
+            files = record.db.execute(
+                'SELECT run, filename FROM run_files').fetchall()
+            record.db.close()
+
+        self.assertEqual(
+            [run[1:] for run in runs],
+            [('mycommand', 3, 2), ('mycommand', 0, 1)]
+        )
+        self.assertEqual(files, [(runs[1][0], 'b')])
+
+
+    @unittest.skipIf(not hasattr(os, 'pipe'), 'No pipes.')
+    @patch('rerun.aio.show_command', Mock(return_value=None))
+    def test_keys(self):
+        read_fd, write_fd = os.pipe()
+        watcher = FakeWatcher(['a'])
+        options = get_options()
+        rerunner = Rerunner(options, watcher, KeyReader(read_fd))
+        try:
+            async def type_keys():
+                task = asyncio.ensure_future(rerunner.run())
+                while rerunner.last is None:
+                    await asyncio.sleep(0.01)
+                os.write(write_fd, b'\n')
+                while aio.show_command.call_count < 2:
+                    await asyncio.sleep(0.01)
+                os.write(write_fd, b'q\n')
+                await task
+
+            run(type_keys())
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+        self.assertEqual(
+            aio.show_command.call_args_list,
+            [call(['a'], options, True), call(['a'], options, True)]
+        )
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import patch
+
+from rerun import bench
+from rerun.bench import (
+    BACKENDS, DEPTH, FILES_PER_DIR, get_available_backends, get_dirs,
+    get_ignores, main, make_tree, run_benchmarks,
+)
+from rerun.ignore import IgnoreMatcher
+from rerun.watchers import IncrementalWatcher
+
+
+class Test_Bench(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    def test_get_dirs(self):
+        wide = get_dirs(DEPTH + 1, 'wide')
+        deep = get_dirs(DEPTH + 1, 'deep')
+        self.assertEqual(len(wide), DEPTH + 1)
+        self.assertEqual(len(deep), DEPTH + 1)
+        self.assertEqual(max(path.count(os.sep) for path in wide), 1)
+        self.assertEqual(deep[DEPTH - 1].count(os.sep), DEPTH)
+        self.assertEqual(deep[DEPTH], os.path.join('chain1', 'd%d' % DEPTH))
+
+
+    def test_make_tree(self):
+        created = make_tree(self.tempdir, 2 * FILES_PER_DIR, 'deep')
+        self.assertEqual(len(created), 2 * FILES_PER_DIR)
+        for relname in created:
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.tempdir, relname)))
+        self.assertTrue(
+            os.path.isdir(os.path.join(self.tempdir, 'node_modules')))
+
+
+    def test_get_ignores_match_nothing_in_the_tree(self):
+        ignores = get_ignores(50)
+        self.assertEqual(len(set(ignores)), 50)
+        matcher = IgnoreMatcher(ignores, [])
+        created = make_tree(self.tempdir, FILES_PER_DIR, 'wide')
+        self.assertFalse(any(matcher.ignores_file(path) for path in created))
+
+
+    def test_get_available_backends(self):
+        with patch('rerun.bench.inotify.is_available', return_value=True):
+            self.assertEqual(get_available_backends(BACKENDS), BACKENDS)
+        with patch('rerun.bench.inotify.is_available', return_value=False):
+            self.assertEqual(
+                get_available_backends(BACKENDS), ['poll', 'incremental'])
+
+
+    @patch.object(IncrementalWatcher, 'RACY_SECONDS', 0)
+    def test_run_benchmarks(self):
+        reported = []
+        results = run_benchmarks(
+            [FILES_PER_DIR], ['wide'], ['poll'], [0, 10], 1, reported.append)
+
+        self.assertEqual(results, reported)
+        self.assertEqual(
+            [(result['benchmark'], result['ignores']) for result in results],
+            [('watcher', 0), ('matcher', 0), ('watcher', 10), ('matcher', 10)]
+        )
+        watcher = results[0]
+        self.assertEqual(watcher['files'], FILES_PER_DIR)
+        self.assertEqual(watcher['backend'], 'poll')
+        for key in ['cold', 'warm', 'latency', 'peak_bytes']:
+            self.assertGreater(watcher[key], 0)
+        self.assertGreater(results[1]['paths_per_second'], 0)
+
+
+    @patch('rerun.bench.sys.stderr')
+    @patch('rerun.bench.run_benchmarks')
+    def test_main_writes_json(self, mock_run, mock_stderr):
+        mock_run.return_value = [{'benchmark': 'matcher'}]
+        output = os.path.join(self.tempdir, 'results.json')
+
+        main(['--files', '10', '20', '--backend', 'poll', '-o', output])
+
+        self.assertEqual(
+            mock_run.call_args[0][:5],
+            ([10, 20], bench.SHAPES, ['poll'], [0, 500], 5)
+        )
+        with open(output) as fp:
+            data = json.load(fp)
+        self.assertEqual(data['results'], [{'benchmark': 'matcher'}])
+        self.assertIn('python', data)
@@ -0,0 +1,87 @@
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import patch
+
+from rerun.changes import Changes, ChangeTracker, get_env
+from rerun.tests.test_watchers import temp_cwd, touch
+
+
+class Test_ChangeTracker(unittest.TestCase):
+
+    def test_classify(self):
+        tracker = ChangeTracker()
+        with temp_cwd():
+            touch('a')
+            touch('b')
+            changes = tracker.classify(['a', 'b'], True)
+            self.assertEqual(
+                (changes.added, changes.modified, changes.deleted),
+                (['a', 'b'], [], [])
+            )
+            touch('c')
+            os.remove('b')
+            changes = tracker.classify(['a', 'b', 'c'], False)
+            self.assertEqual(
+                (changes.added, changes.modified, changes.deleted),
+                (['c'], ['a'], ['b'])
+            )
+            self.assertEqual(changes.changed(), ['a', 'b', 'c'])
+            touch('b')
+            changes = tracker.classify(['b'], False)
+            self.assertEqual(changes.added, ['b'])
+
+
+    def test_get_variables(self):
+        tracker = ChangeTracker()
+        changes = Changes(
+            [os.path.join('.', 'new')], ['mod'], [os.path.join('.', 'x', 'y')])
+        self.assertEqual(tracker.get_variables(changes), dict(
+            RERUN_CHANGED_FILES='\n'.join(
+                ['mod', 'new', os.path.join('x', 'y')]),
+            RERUN_ADDED_FILES='new',
+            RERUN_MODIFIED_FILES='mod',
+            RERUN_DELETED_FILES=os.path.join('x', 'y'),
+        ))
+        self.assertEqual(tracker.lists, [])
+
+
+    @patch('rerun.changes.ENV_LIMIT', 10)
+    def test_get_variables_writes_long_lists_to_files(self):
+        tracker = ChangeTracker()
+        names = ['file%d' % (i,) for i in range(5)]
+        variables = tracker.get_variables(Changes(modified=names))
+
+        self.assertEqual(variables['RERUN_ADDED_FILES'], '')
+        self.assertNotIn('RERUN_CHANGED_FILES', variables)
+        path = variables['RERUN_CHANGED_FILES_LIST']
+        self.assertEqual(path, tracker.lists[0])
+        with open(path, 'rb') as fp:
+            self.assertEqual(
+                fp.read(), b'file0\0file1\0file2\0file3\0file4\0')
+        self.assertEqual(len(tracker.lists), 2)
+
+        tracker.clean()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(tracker.lists, [])
+
+
+class Test_Changes(unittest.TestCase):
+
+    def test_select(self):
+        changes = Changes(['a', 'b'], ['c'], ['d']).select(['a', 'd'])
+        self.assertEqual(
+            (changes.added, changes.modified, changes.deleted),
+            (['a'], [], ['d'])
+        )
+
+
+    @patch.dict(os.environ, RERUN_DELETED_FILES_LIST='/stale', OTHER='x')
+    def test_get_env_replaces_our_variables(self):
+        env = get_env(dict(RERUN_CHANGED_FILES='a'))
+        self.assertEqual(env['RERUN_CHANGED_FILES'], 'a')
+        self.assertEqual(env['OTHER'], 'x')
+        self.assertNotIn('RERUN_DELETED_FILES_LIST', env)
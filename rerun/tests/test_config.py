@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import config
+from rerun.config import ConfigError, load_config, parse_config, Rule
+
+
+def join(*parts):
+    return os.path.join('.', *parts)
+
+
+class Test_Rule(unittest.TestCase):
+
+    def test_select_everything_under_root(self):
+        rule = Rule('cmd', root='api')
+        self.assertEqual(
+            rule.select([
+                join('api', 'a.py'), join('api', 'sub', 'b.txt'),
+                join('apiary', 'c.py'), join('d.py'),
+            ]),
+            [join('api', 'a.py'), join('api', 'sub', 'b.txt')]
+        )
+
+
+    def test_select_by_pattern(self):
+        rule = Rule('cmd', root='frontend', patterns=['*.js', 'css/*.css'])
+        self.assertEqual(
+            rule.select([
+                join('frontend', 'a.js'), join('frontend', 'x', 'b.js'),
+                join('frontend', 'css', 'c.css'),
+                join('frontend', 'x', 'css', 'd.css'),
+                join('frontend', 'e.py'), join('f.js'),
+            ]),
+            [
+                join('frontend', 'a.js'), join('frontend', 'x', 'b.js'),
+                join('frontend', 'css', 'c.css'),
+            ]
+        )
+
+
+    def test_select_with_default_root(self):
+        rule = Rule('cmd', patterns=['*.py'])
+        self.assertEqual(
+            rule.select([join('a.py'), join('x', 'b.py'), join('c.txt')]),
+            [join('a.py'), join('x', 'b.py')]
+        )
+
+
+    def test_select_with_an_absolute_root(self):
+        rule = Rule('cmd', root=os.path.abspath('api'))
+        self.assertEqual(rule.root, 'api')
+        self.assertEqual(
+            rule.select([join('api', 'a.py'), join('b.py')]),
+            [join('api', 'a.py')]
+        )
+
+
+class Test_ParseConfig(unittest.TestCase):
+
+    def test_parse_config(self):
+        rules = parse_config({'watch': [
+            {'command': 'one', 'root': 'a', 'patterns': '*.py'},
+            {'command': 'two', 'lock': 'db'},
+        ]})
+        self.assertEqual([rule.command for rule in rules], ['one', 'two'])
+        self.assertEqual(rules[0].root, 'a')
+        self.assertEqual(rules[0].patterns, ['*.py'])
+        self.assertEqual(rules[0].lock, None)
+        self.assertEqual(rules[1].root, '.')
+        self.assertEqual(rules[1].patterns, ['**'])
+        self.assertEqual(rules[1].lock, 'db')
+        self.assertEqual(rules[1].name, 'two')
+        self.assertEqual(rules[1].needs, [])
+
+
+    def test_parse_config_with_needs(self):
+        rules = parse_config({'watch': [
+            {'command': 'flake8', 'name': 'lint'},
+            {'command': 'pytest', 'name': 'unit'},
+            {'command': 'pytest integration', 'needs': ['lint', 'unit']},
+            {'command': 'make docs', 'needs': 'lint'},
+        ]})
+        self.assertEqual(
+            [(rule.name, rule.needs) for rule in rules],
+            [
+                ('lint', []),
+                ('unit', []),
+                ('pytest integration', ['lint', 'unit']),
+                ('make docs', ['lint']),
+            ]
+        )
+
+
+    def test_parse_config_errors(self):
+        for data, message in [
+            ({}, 'Config has no [[watch]] tables.'),
+            ({'watch': [{'root': 'a'}]}, '[[watch]] number 1 has no command.'),
+            (
+                {'watch': [{'command': 'a', 'roots': 'b'}]},
+                '[[watch]] number 1 has unknown keys: roots'
+            ),
+            (
+                {'watch': [
+                    {'command': 'a', 'name': 'x'},
+                    {'command': 'b', 'name': 'x'},
+                ]},
+                "[[watch]] number 2 has a duplicate name: 'x'"
+            ),
+            (
+                {'watch': [{'command': 'a', 'root': '../b'}]},
+                "[[watch]] number 1 has a root outside the current "
+                "directory: '../b'"
+            ),
+            (
+                {'watch': [{'command': 'a', 'needs': ['b']}]},
+                "'a' needs unknown 'b'."
+            ),
+            (
+                {'watch': [
+                    {'command': 'a', 'needs': ['c']},
+                    {'command': 'b', 'needs': ['a']},
+                    {'command': 'c', 'needs': ['b']},
+                ]},
+                'Rules need each other: a -> c -> b -> a'
+            ),
+        ]:
+            with self.assertRaises(ConfigError) as context:
+                parse_config(data)
+            self.assertEqual(str(context.exception), message)
+
+
+class Test_LoadConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'rerun.toml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    @unittest.skipIf(config.get_tomllib() is None, 'No TOML parser.')
+    def test_load_config(self):
+        with open(self.filename, 'w') as fp:
+            fp.write('[[watch]]\ncommand = "make"\npatterns = ["*.c"]\n')
+        rules = load_config(self.filename)
+        self.assertEqual(rules[0].command, 'make')
+        self.assertEqual(rules[0].patterns, ['*.c'])
+
+
+    @unittest.skipIf(config.get_tomllib() is None, 'No TOML parser.')
+    def test_load_config_with_bad_toml(self):
+        with open(self.filename, 'w') as fp:
+            fp.write('[[watch]\n')
+        with self.assertRaises(ConfigError):
+            load_config(self.filename)
+
+
+    def test_load_config_missing(self):
+        with self.assertRaises(ConfigError):
+            load_config(os.path.join(self.tempdir, 'missing.toml'))
+
+
+    @patch('rerun.config.get_tomllib', Mock(return_value=None))
+    def test_load_config_without_toml_parser(self):
+        with self.assertRaises(ConfigError) as context:
+            load_config(self.filename)
+        self.assertIn('pip install tomli', str(context.exception))
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import patch
+
+from rerun.control import ControlError, ControlServer, remove_stale_socket
+from rerun.tests.test_aio import run
+
+
+async def send(writer, message):
+    writer.write(json.dumps(message).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+async def receive(reader):
+    return json.loads((await reader.readline()).decode('utf-8'))
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'No Unix sockets.')
+class Test_ControlServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'rerun.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    def test_publishes_events_and_queues_requests(self):
+        server = ControlServer(self.path)
+
+        async def talk():
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                while not server.clients:
+                    await asyncio.sleep(0.01)
+                server.publish('changed', files=['a'], first_time=False)
+                event = await receive(reader)
+
+                await send(writer, dict(request='pause'))
+                client, request = await server.requests.get()
+                server.reply(client, request['request'])
+                reply = await receive(reader)
+                writer.close()
+                return event, request, reply
+            finally:
+                await server.close()
+
+        event, request, reply = run(talk())
+        self.assertEqual(
+            event, dict(event='changed', files=['a'], first_time=False))
+        self.assertEqual(request, dict(request='pause'))
+        self.assertEqual(reply, dict(reply='pause', ok=True))
+        self.assertFalse(os.path.exists(self.path))
+
+
+    @patch('rerun.control.MAX_BACKLOG', 1000)
+    def test_a_big_greeting_doesnt_count_towards_the_backlog(self):
+        files = ['file%07d' % (i,) for i in range(400000)]
+
+        async def greeting():
+            return dict(event='files', files=files)
+
+        server = ControlServer(self.path, greeting)
+
+        async def talk():
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=2 ** 24)
+                while not server.clients:
+                    await asyncio.sleep(0.01)
+                server.publish('changed', files=['a'])
+                events = [await receive(reader), await receive(reader)]
+                writer.close()
+                return events
+            finally:
+                await server.close()
+
+        events = run(talk())
+        self.assertEqual(len(events[0]['files']), len(files))
+        self.assertEqual(events[1], dict(event='changed', files=['a']))
+
+
+    def test_answers_bad_requests_itself(self):
+        server = ControlServer(self.path)
+
+        async def talk():
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                replies = []
+                for line in [b'not json\n', b'["trigger"]\n']:
+                    writer.write(line)
+                    replies.append(await receive(reader))
+                for message in [
+                    dict(request='reboot'), dict(request='ignore'),
+                ]:
+                    await send(writer, message)
+                    replies.append(await receive(reader))
+                writer.close()
+                return replies
+            finally:
+                await server.close()
+
+        replies = run(talk())
+        self.assertEqual(
+            [(reply['reply'], 'error' in reply) for reply in replies],
+            [(None, True), (None, True), ('reboot', True), ('ignore', True)]
+        )
+        self.assertTrue(server.requests.empty())
+
+
+    def test_listens_on_a_port(self):
+        server = ControlServer('0')
+
+        async def talk():
+            await server.start()
+            try:
+                port = server.server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', port)
+                await send(writer, dict(request='trigger'))
+                _, request = await server.requests.get()
+                writer.close()
+                return request
+            finally:
+                await server.close()
+
+        self.assertEqual(run(talk()), dict(request='trigger'))
+
+
+    def test_remove_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.bind(self.path)
+        sock.close()
+        remove_stale_socket(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+
+    def test_remove_stale_socket_refuses_if_in_use(self):
+        sock = socket.socket(socket.AF_UNIX)
+        try:
+            sock.bind(self.path)
+            sock.listen(1)
+            with self.assertRaises(ControlError):
+                remove_stale_socket(self.path)
+        finally:
+            sock.close()
+        self.assertTrue(os.path.exists(self.path))
+
+
+    def test_remove_stale_socket_leaves_other_files_alone(self):
+        with open(self.path, 'w'):
+            pass
+        with self.assertRaises(ControlError):
+            remove_stale_socket(self.path)
+        self.assertTrue(os.path.exists(self.path))
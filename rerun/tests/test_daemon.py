@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import daemon
+from rerun.daemon import (
+    Daemon, DaemonError, get_daemon_args, get_socket_dir, get_socket_path,
+    SharedWatcher,
+)
+from rerun.ignore import IgnoreMatcher
+from rerun.options import get_parser
+from rerun.stats import TimingMatcher
+from rerun.tests.test_aio import FakeWatcher, run
+from rerun.tests.test_watchers import temp_cwd, touch
+from rerun.watchers import SKIP_DIRS, SKIP_EXT
+
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class Test_SocketPath(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        patcher = patch.dict(os.environ, XDG_RUNTIME_DIR=self.tempdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    def test_get_socket_path_is_per_directory(self):
+        path = get_socket_path('.')
+        self.assertEqual(os.path.dirname(path), os.path.join(
+            self.tempdir, 'rerun'))
+        self.assertEqual(get_socket_path(os.getcwd()), path)
+        self.assertNotEqual(get_socket_path(self.tempdir), path)
+        self.assertEqual(
+            os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+
+    def test_get_socket_dir_refuses_a_dir_others_can_use(self):
+        os.mkdir(os.path.join(self.tempdir, 'rerun'), 0o777)
+        os.chmod(os.path.join(self.tempdir, 'rerun'), 0o777)
+        with self.assertRaises(DaemonError):
+            get_socket_dir()
+
+
+    def test_get_daemon_args(self):
+        parser = get_parser('rerun', SKIP_DIRS, SKIP_EXT)
+        options = parser.parse_args([
+            '--watcher=incremental', '--min-interval=0.1', '--ignore=x',
+            'command',
+        ])
+        daemon_options = parser.parse_args(get_daemon_args(options))
+        for name in [
+            'watcher', 'max_watches', 'min_interval', 'max_interval',
+            'stat_interval', 'walk_threads',
+        ]:
+            self.assertEqual(
+                getattr(daemon_options, name), getattr(options, name))
+        self.assertEqual(daemon_options.ignore, list(SKIP_DIRS))
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'No Unix sockets.')
+class Test_Daemon(unittest.TestCase):
+
+    def test_sends_files_then_changes_until_idle(self):
+        with temp_cwd() as tempdir:
+            touch('a')
+            touch('c')
+            path = os.path.join(tempdir, 'daemon.sock')
+            watcher = FakeWatcher(['./a', './b'])
+            the_daemon = Daemon(watcher, path, idle_seconds=0.5)
+
+            async def listen():
+                task = asyncio.ensure_future(the_daemon.run())
+                while not os.path.exists(path):
+                    await asyncio.sleep(0.01)
+                reader, writer = await asyncio.open_unix_connection(path)
+                events = [json.loads(await reader.readline())]
+                watcher.batches.append(['./b', './c'])
+                events.append(json.loads(await reader.readline()))
+                writer.close()
+                await task
+                return events
+
+            events = run(listen())
+
+        self.assertEqual(events, [
+            dict(event='files', files=['./a', './b']),
+            dict(event='changed', files=['./b', './c']),
+        ])
+        self.assertEqual(the_daemon.files, set(['./a', './c']))
+        self.assertFalse(os.path.exists(path))
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'No Unix sockets.')
+class Test_SharedWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        patcher = patch.dict(os.environ, XDG_RUNTIME_DIR=self.tempdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # So that the daemon can import rerun, from the directory it watches.
+        pythonpath = os.pathsep.join(
+            [PACKAGE_ROOT] + [p for p in sys.path if p])
+        patcher = patch.dict(os.environ, PYTHONPATH=pythonpath)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_options(self):
+        return get_parser('rerun', SKIP_DIRS, SKIP_EXT).parse_args(
+            ['--watcher=poll', '--min-interval=0.05', '--max-interval=0.05'])
+
+    def get_changes(self, watcher, count=1):
+        changed = []
+        for _ in range(20):
+            watcher.wait(0.5)
+            changed.extend(watcher.get_changed_files())
+            if len(changed) >= count:
+                break
+        return changed
+
+
+    def test_reruns_share_one_daemon(self):
+        with temp_cwd():
+            os.mkdir('logs')
+            touch('a')
+            touch(os.path.join('logs', 'b'))
+            one = SharedWatcher(IgnoreMatcher([], []), self.get_options())
+            self.addCleanup(one.close)
+            # As with --stats.
+            two = SharedWatcher(
+                TimingMatcher(IgnoreMatcher(['logs'], [])), self.get_options())
+            self.addCleanup(two.close)
+
+            self.assertEqual(
+                one.get_changed_files(),
+                [os.path.join('.', 'a'), os.path.join('.', 'logs', 'b')]
+            )
+            self.assertEqual(two.get_changed_files(), [os.path.join('.', 'a')])
+            self.assertEqual(len(os.listdir(os.path.join(
+                self.tempdir, 'rerun'))), 2)
+
+            touch(os.path.join('logs', 'b'))
+            touch('c')
+            self.assertEqual(
+                sorted(self.get_changes(one, 2)),
+                [os.path.join('.', 'c'), os.path.join('.', 'logs', 'b')]
+            )
+            self.assertEqual(self.get_changes(two), [os.path.join('.', 'c')])
+
+
+    @patch('rerun.daemon.sys.stderr', Mock())
+    def test_reconnects_if_the_daemon_goes_away(self):
+        with temp_cwd():
+            touch('a')
+            watcher = SharedWatcher(IgnoreMatcher([], []), self.get_options())
+            self.addCleanup(watcher.close)
+            watcher.get_changed_files()
+            watcher.sock.shutdown(socket.SHUT_RDWR)
+            self.assertEqual(
+                watcher.get_changed_files(), [os.path.join('.', 'a')])
+
+
+    @patch('rerun.daemon.start_daemon')
+    def test_connect_fails_if_the_daemon_does_not_start(self, mock_start):
+        mock_start.return_value.poll.return_value = 1
+        with self.assertRaises(DaemonError):
+            daemon.connect(
+                os.path.join(self.tempdir, 'none.sock'), self.get_options())
@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import deps
+from rerun.deps import (
+    get_affected_tests, get_imported_names, get_module_name, ImportGraph,
+    is_test_file,
+)
+
+
+def join(*parts):
+    return os.path.join('.', *parts)
+
+
+class Test_Deps(unittest.TestCase):
+
+    def setUp(self):
+        self.orig = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.orig)
+        shutil.rmtree(self.tempdir)
+
+    def write(self, filename, text=''):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as fp:
+            fp.write(text)
+
+    def make_tree(self):
+        self.write(join('pkg', '__init__.py'))
+        self.write(join('pkg', 'a.py'), 'import os\n')
+        self.write(join('pkg', 'b.py'), 'from . import a\n')
+        self.write(join('pkg', 'c.py'))
+        self.write(join('tests', 'conftest.py'))
+        self.write(join('tests', 'test_a.py'), 'import pkg.a\n')
+        self.write(join('tests', 'test_b.py'), 'from pkg.b import thing\n')
+        self.write(join('tests', 'c_test.py'), 'from pkg import c\n')
+        graph = ImportGraph()
+        graph.update([
+            join('pkg', '__init__.py'), join('pkg', 'a.py'),
+            join('pkg', 'b.py'), join('pkg', 'c.py'),
+            join('tests', 'conftest.py'), join('tests', 'test_a.py'),
+            join('tests', 'test_b.py'), join('tests', 'c_test.py'),
+        ])
+        return graph
+
+
+    def test_is_test_file(self):
+        self.assertTrue(is_test_file(join('x', 'test_a.py')))
+        self.assertTrue(is_test_file('a_test.py'))
+        self.assertFalse(is_test_file('test_a.txt'))
+        self.assertFalse(is_test_file('a.py'))
+
+
+    def test_get_module_name(self):
+        self.write(join('pkg', '__init__.py'))
+        self.write(join('pkg', 'sub', '__init__.py'))
+        self.assertEqual(get_module_name(join('top.py')), 'top')
+        self.assertEqual(get_module_name(join('pkg', '__init__.py')), 'pkg')
+        self.assertEqual(
+            get_module_name(join('pkg', 'sub', 'mod.py')), 'pkg.sub.mod')
+        self.assertEqual(get_module_name(join('src', 'mod.py')), 'mod')
+
+
+    def test_get_imported_names(self):
+        self.write(join('pkg', '__init__.py'))
+        source = (
+            'import a.b, c\n'
+            'from d import e\n'
+            'from . import f\n'
+            'from .g import h\n'
+            'from .. import i\n'
+            'from j import *\n'
+        )
+        self.assertEqual(
+            get_imported_names(join('pkg', 'mod.py'), source),
+            set([
+                'a', 'a.b', 'c', 'd', 'd.e', 'pkg', 'pkg.f', 'pkg.g',
+                'pkg.g.h', 'j',
+            ])
+        )
+
+
+    def test_affected_tests_follow_imports_transitively(self):
+        graph = self.make_tree()
+        self.assertEqual(
+            graph.get_affected_tests([join('pkg', 'a.py')]),
+            [join('tests', 'test_a.py'), join('tests', 'test_b.py')]
+        )
+        self.assertEqual(
+            graph.get_affected_tests([join('pkg', 'c.py')]),
+            [join('tests', 'c_test.py')]
+        )
+
+
+    def test_affected_tests_include_changed_tests(self):
+        graph = self.make_tree()
+        self.assertEqual(
+            graph.get_affected_tests([join('tests', 'test_a.py')]),
+            [join('tests', 'test_a.py')]
+        )
+
+
+    def test_affected_tests_for_conftest_and_non_python_files(self):
+        graph = self.make_tree()
+        everything = [
+            join('tests', 'c_test.py'),
+            join('tests', 'test_a.py'),
+            join('tests', 'test_b.py'),
+        ]
+        self.assertEqual(
+            graph.get_affected_tests([join('tests', 'conftest.py')]),
+            everything
+        )
+        self.assertEqual(graph.get_affected_tests(['data.json']), everything)
+
+
+    def test_update_follows_changed_imports(self):
+        graph = self.make_tree()
+        self.write(join('tests', 'test_a.py'), 'import pkg.c\n')
+        graph.update([join('tests', 'test_a.py')])
+
+        self.assertEqual(
+            graph.get_affected_tests([join('pkg', 'a.py')]),
+            [join('tests', 'test_b.py')]
+        )
+
+
+    def test_update_removes_deleted_files(self):
+        graph = self.make_tree()
+        os.remove(join('tests', 'test_a.py'))
+        graph.update([join('tests', 'test_a.py')])
+
+        self.assertEqual(
+            graph.get_affected_tests([join('pkg', 'a.py')]),
+            [join('tests', 'test_b.py')]
+        )
+
+
+    def test_syntax_errors_keep_the_file(self):
+        graph = self.make_tree()
+        self.write(join('tests', 'test_a.py'), 'import (\n')
+        graph.update([join('tests', 'test_a.py')])
+
+        self.assertEqual(
+            graph.get_affected_tests([join('tests', 'test_a.py')]),
+            [join('tests', 'test_a.py')]
+        )
+
+
+    def test_get_affected_tests_builds_graph_once(self):
+        self.make_tree()
+        options = Mock(ignore=[], gitignore=False)
+        with patch('rerun.deps.graph', None):
+            self.assertEqual(
+                get_affected_tests([join('pkg', 'c.py')], options),
+                [join('tests', 'c_test.py')]
+            )
+            self.assertIsNotNone(deps.graph)
+            with patch('rerun.deps.walk_tree') as mock_walk_tree:
+                get_affected_tests([join('pkg', 'c.py')], options)
+            self.assertFalse(mock_walk_tree.called)
+
+
+    def test_get_external_imports(self):
+        graph = self.make_tree()
+        self.assertEqual(graph.get_external_imports(), set(['os']))
+        self.assertTrue(graph.is_local('pkg.a'))
+        self.assertFalse(graph.is_local('os.path'))
+
+        self.write(join('tests', 'test_a.py'), 'import pkg.a, numpy\n')
+        graph.update([join('tests', 'test_a.py')])
+        self.assertEqual(graph.get_external_imports(), set(['os', 'numpy']))
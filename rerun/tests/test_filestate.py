@@ -0,0 +1,82 @@
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from rerun.filestate import FileStateTable
+
+
+class Test_FileStateTable(unittest.TestCase):
+
+    def test_get_missing(self):
+        table = FileStateTable(2)
+        self.assertIsNone(table.get(os.path.join('a', 'b')))
+        self.assertEqual(table.get('b', 'default'), 'default')
+        self.assertFalse(os.path.join('a', 'b') in table)
+
+
+    def test_set_and_get(self):
+        table = FileStateTable(2)
+        table.set(os.path.join('a', 'b'), (1, 2))
+        table.set(os.path.join('a', 'c'), (3, -4))
+        table.set('b', (2 ** 62, 6))
+
+        self.assertEqual(table.get(os.path.join('a', 'b')), (1, 2))
+        self.assertEqual(table.get(os.path.join('a', 'c')), (3, -4))
+        self.assertEqual(table.get('b'), (2 ** 62, 6))
+        self.assertTrue(os.path.join('a', 'c') in table)
+        self.assertEqual(len(table), 3)
+
+
+    def test_set_overwrites(self):
+        table = FileStateTable(1)
+        table.set('a', (1,))
+        table.set('a', (2,))
+        self.assertEqual(table.get('a'), (2,))
+        self.assertEqual(len(table), 1)
+
+
+    def test_discard(self):
+        table = FileStateTable(1)
+        table.set(os.path.join('d', 'a'), (1,))
+        table.set(os.path.join('d', 'b'), (2,))
+
+        table.discard(os.path.join('d', 'a'))
+        table.discard(os.path.join('d', 'missing'))
+        table.discard(os.path.join('missing', 'a'))
+
+        self.assertFalse(os.path.join('d', 'a') in table)
+        self.assertEqual(table.get(os.path.join('d', 'b')), (2,))
+        self.assertEqual(len(table), 1)
+
+
+    def test_discarded_slots_are_reused(self):
+        table = FileStateTable(1)
+        table.set('a', (1,))
+        table.set('b', (2,))
+        table.discard('a')
+        table.set('c', (3,))
+
+        self.assertEqual(len(table.dirs[''].records), 2)
+        self.assertEqual(table.get('b'), (2,))
+        self.assertEqual(table.get('c'), (3,))
+
+
+    def test_empty_dirs_are_dropped(self):
+        table = FileStateTable(1)
+        table.set(os.path.join('d', 'a'), (1,))
+        table.discard(os.path.join('d', 'a'))
+        self.assertEqual(table.dirs, {})
+
+
+    def test_iter_and_clear(self):
+        table = FileStateTable(1)
+        paths = [os.path.join('d', 'a'), os.path.join('e', 'f', 'b'), 'c']
+        for path in paths:
+            table.set(path, (0,))
+
+        self.assertEqual(sorted(table), sorted(paths))
+        table.clear()
+        self.assertEqual(list(table), [])
+        self.assertEqual(len(table), 0)
@@ -0,0 +1,178 @@
+import os
+import re
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from rerun.ignore import (
+    get_matcher, glob_to_regex, IgnoreMatcher, read_ignore_file
+)
+
+
+class Test_GlobToRegex(unittest.TestCase):
+
+    def assert_matches(self, pattern, path, expected=True):
+        regex = '(?:%s)\\Z' % (glob_to_regex(pattern),)
+        matched = bool(re.match(regex, path))
+        self.assertEqual(matched, expected, (pattern, path))
+
+
+    def test_star_doesnt_cross_dirs(self):
+        self.assert_matches('*.log', 'a.log')
+        self.assert_matches('a/*.log', 'a/b.log')
+        self.assert_matches('a/*.log', 'a/b/c.log', False)
+
+
+    def test_double_star_crosses_dirs(self):
+        self.assert_matches('**/x', 'x')
+        self.assert_matches('**/x', 'a/b/x')
+        self.assert_matches('a/**', 'a/b/c')
+        self.assert_matches('a/**/x', 'a/x')
+        self.assert_matches('a/**/x', 'a/b/c/x')
+
+
+    def test_question_mark_and_ranges(self):
+        self.assert_matches('a?c', 'abc')
+        self.assert_matches('a?c', 'a/c', False)
+        self.assert_matches('[ab]c', 'bc')
+        self.assert_matches('[!ab]c', 'bc', False)
+        self.assert_matches('[!ab]c', 'dc')
+
+
+    def test_special_chars_are_escaped(self):
+        self.assert_matches('a.b+c', 'a.b+c')
+        self.assert_matches('a.b+c', 'axbbc', False)
+
+
+class Test_IgnoreMatcher(unittest.TestCase):
+
+    def test_ignores_nothing(self):
+        matcher = IgnoreMatcher([], ['.pyc'])
+        self.assertFalse(matcher.ignores_file('h.txt'))
+        self.assertFalse(matcher.ignores_dir('h'))
+
+
+    def test_names(self):
+        matcher = IgnoreMatcher(['h.txt'], [])
+        self.assertTrue(matcher.ignores_file('h.txt'))
+        self.assertTrue(matcher.ignores_dir('h.txt'))
+
+
+    def test_names_with_same_ending(self):
+        matcher = IgnoreMatcher(['h.txt'], [])
+        self.assertFalse(matcher.ignores_file('gh.txt'))
+
+
+    def test_names_work_on_basename(self):
+        matcher = IgnoreMatcher(['h.txt'], [])
+        self.assertTrue(matcher.ignores_file(os.path.join('somedir', 'h.txt')))
+        self.assertTrue(matcher.ignores_file(os.path.join('.', 'h.txt')))
+
+
+    def test_extensions(self):
+        matcher = IgnoreMatcher([], ['.pyc', '.pyo'])
+        self.assertTrue(matcher.ignores_file('h.pyc'))
+        self.assertTrue(matcher.ignores_file(os.path.join('a.b', 'h.pyo')))
+        self.assertFalse(matcher.ignores_file('h.py'))
+        self.assertFalse(matcher.ignores_file('pyc'))
+        self.assertFalse(matcher.ignores_dir('h.pyc'))
+
+
+    def test_name_globs(self):
+        matcher = IgnoreMatcher(['*.log', 'tmp?'], [])
+        self.assertTrue(matcher.ignores_file(os.path.join('.', 'a', 'b.log')))
+        self.assertTrue(matcher.ignores_dir(os.path.join('.', 'tmp1')))
+        self.assertFalse(matcher.ignores_file('b.logs'))
+
+
+    def test_path_globs_are_anchored(self):
+        matcher = IgnoreMatcher(['docs/_build', '/out/*.o'], [])
+        self.assertTrue(
+            matcher.ignores_dir(os.path.join('.', 'docs', '_build')))
+        self.assertFalse(
+            matcher.ignores_dir(os.path.join('.', 'x', 'docs', '_build')))
+        self.assertTrue(matcher.ignores_file(os.path.join('.', 'out', 'a.o')))
+        self.assertFalse(
+            matcher.ignores_file(os.path.join('.', 'out', 'x', 'a.o')))
+
+
+    def test_dir_only_patterns(self):
+        matcher = IgnoreMatcher(['logs/', '*.d/', 'a/b/'], [])
+        self.assertTrue(matcher.ignores_dir('logs'))
+        self.assertFalse(matcher.ignores_file('logs'))
+        self.assertTrue(matcher.ignores_dir('x.d'))
+        self.assertFalse(matcher.ignores_file('x.d'))
+        self.assertTrue(matcher.ignores_dir(os.path.join('.', 'a', 'b')))
+        self.assertFalse(matcher.ignores_file(os.path.join('.', 'a', 'b')))
+
+
+    def test_prune_dirs_modifies_in_place(self):
+        dirs = ['a', 'b', 'c', 'd', 'e', 'f']
+        IgnoreMatcher(['b', 'd', 'f'], []).prune_dirs('.', dirs)
+        self.assertEqual(dirs, ['a', 'c', 'e'])
+
+
+    def test_add(self):
+        matcher = IgnoreMatcher(['a'], ['.pyc'])
+        matcher.add(['*.log', 'out/'])
+        self.assertEqual(matcher.patterns, ['a', '*.log', 'out/'])
+        self.assertTrue(matcher.ignores_file('a'))
+        self.assertTrue(matcher.ignores_file('b.pyc'))
+        self.assertTrue(matcher.ignores_file('c.log'))
+        self.assertTrue(matcher.ignores_dir('out'))
+
+
+    def test_ignores_path(self):
+        matcher = IgnoreMatcher(['build/', '*.log'], [])
+        self.assertTrue(matcher.ignores_path(
+            os.path.join('.', 'src', 'build', 'x', 'a.c')))
+        self.assertTrue(matcher.ignores_path(os.path.join('.', 'b.log')))
+        self.assertFalse(matcher.ignores_path(os.path.join('.', 'src', 'a.c')))
+
+
+class Test_IgnoreFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.orig = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.orig)
+        shutil.rmtree(self.tempdir)
+
+    def write(self, filename, text):
+        with open(filename, 'w') as fp:
+            fp.write(text)
+
+
+    def test_read_ignore_file(self):
+        self.write(
+            'ignore', '# comment\n\n*.log\n!keep.log\n\\#hash  \nout/\n'
+        )
+        self.assertEqual(
+            read_ignore_file('ignore'), ['*.log', '#hash', 'out/']
+        )
+
+
+    def test_read_ignore_file_missing(self):
+        self.assertEqual(read_ignore_file('missing'), [])
+
+
+    def test_get_matcher_reads_rerunignore(self):
+        self.write('.rerunignore', 'a\n')
+        self.write('.gitignore', 'b\n')
+        matcher = get_matcher(['c'], ['.pyc'])
+        self.assertTrue(matcher.ignores_file('a'))
+        self.assertFalse(matcher.ignores_file('b'))
+        self.assertTrue(matcher.ignores_file('c'))
+        self.assertTrue(matcher.ignores_file('d.pyc'))
+
+
+    def test_get_matcher_reads_gitignore_if_asked(self):
+        self.write('.gitignore', 'b\n')
+        matcher = get_matcher([], [], use_gitignore=True)
+        self.assertTrue(matcher.ignores_file('b'))
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from rerun import inotify
+
+
+@unittest.skipIf(not inotify.is_available(), 'No inotify.')
+class Test_Inotify(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inotify = inotify.Inotify()
+
+    def tearDown(self):
+        self.inotify.close()
+        shutil.rmtree(self.tempdir)
+
+
+    def test_read_events_when_none_queued(self):
+        self.inotify.add_watch(self.tempdir)
+        self.assertFalse(self.inotify.wait(0))
+        self.assertEqual(self.inotify.read_events(), [])
+
+
+    def test_read_events_reports_created_file(self):
+        wd = self.inotify.add_watch(self.tempdir)
+        open(os.path.join(self.tempdir, 'new'), 'w').close()
+
+        self.assertTrue(self.inotify.wait(1))
+        events = self.inotify.read_events()
+
+        self.assertEqual(events[0][0], wd)
+        self.assertTrue(events[0][1] & inotify.IN_CREATE)
+        self.assertEqual(events[0][3], 'new')
+
+
+    def test_add_watch_on_missing_dir_raises(self):
+        with self.assertRaises(OSError):
+            self.inotify.add_watch(os.path.join(self.tempdir, 'missing'))
+
+
+class Test_ParseEvents(unittest.TestCase):
+
+    def test_parse_events(self):
+        data = (
+            inotify.EVENT_HEADER.pack(1, inotify.IN_CREATE, 0, 8) +
+            b'abc\0\0\0\0\0' +
+            inotify.EVENT_HEADER.pack(2, inotify.IN_Q_OVERFLOW, 0, 0)
+        )
+        self.assertEqual(
+            list(inotify.parse_events(data)),
+            [
+                (1, inotify.IN_CREATE, 0, 'abc'),
+                (2, inotify.IN_Q_OVERFLOW, 0, ''),
+            ]
+        )
@@ -0,0 +1,153 @@
+import threading
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import call, Mock, patch
+
+from rerun.jobs import FAILED, Job, PASSED, run_jobs, Scheduler, SKIPPED
+
+
+SHELL = '/bin/sh'
+
+
+@patch('rerun.jobs.write_output', Mock())
+@patch('rerun.jobs.sys.stdout', Mock())
+class Test_Scheduler(unittest.TestCase):
+
+    def run_fake_jobs(self, jobs, max_jobs, fail=()):
+        '''
+        Runs the jobs without starting processes, returning the names of the
+        jobs in the order they started, and pairs of jobs which overlapped.
+        '''
+        started = []
+        overlaps = []
+        running = []
+        lock = threading.Lock()
+
+        def fake_run(scheduler, job):
+            with lock:
+                overlaps.extend((other, job.name) for other in running)
+                running.append(job.name)
+                started.append(job.name)
+            time.sleep(0.05)
+            with lock:
+                running.remove(job.name)
+            job.returncode = 1 if job.name in fail else 0
+            job.status = FAILED if job.name in fail else PASSED
+            with scheduler.condition:
+                scheduler.running.remove(job)
+                scheduler.condition.notify()
+
+        with patch.object(Scheduler, '_run', fake_run):
+            result = Scheduler(jobs, SHELL, max_jobs).run()
+        return result, started, overlaps
+
+
+    def test_independent_jobs_run_at_once(self):
+        jobs = [Job('a', 'a'), Job('b', 'b'), Job('c', 'c')]
+        result, started, overlaps = self.run_fake_jobs(jobs, 3)
+        self.assertTrue(result)
+        self.assertEqual(sorted(started), ['a', 'b', 'c'])
+        self.assertIn(('a', 'b'), overlaps)
+        self.assertIn(('b', 'c'), overlaps)
+
+
+    def test_max_jobs(self):
+        jobs = [Job('a', 'a'), Job('b', 'b'), Job('c', 'c')]
+        result, started, overlaps = self.run_fake_jobs(jobs, 1)
+        self.assertEqual(started, ['a', 'b', 'c'])
+        self.assertEqual(overlaps, [])
+
+
+    def test_jobs_wait_for_what_they_need(self):
+        jobs = [
+            Job('integration', 'i', needs=['lint', 'unit']),
+            Job('lint', 'l'),
+            Job('unit', 'u'),
+        ]
+        result, started, overlaps = self.run_fake_jobs(jobs, 4)
+        self.assertTrue(result)
+        self.assertEqual(started[-1], 'integration')
+        self.assertEqual(
+            [pair for pair in overlaps if 'integration' in pair], [])
+
+
+    def test_needs_not_being_run_are_ignored(self):
+        jobs = [Job('integration', 'i', needs=['lint'])]
+        result, started, _ = self.run_fake_jobs(jobs, 4)
+        self.assertTrue(result)
+        self.assertEqual(started, ['integration'])
+
+
+    def test_failure_skips_everything_downstream(self):
+        jobs = [
+            Job('lint', 'l'),
+            Job('unit', 'u'),
+            Job('integration', 'i', needs=['lint', 'unit']),
+            Job('deploy', 'd', needs=['integration']),
+            Job('docs', 'd', needs=['lint']),
+        ]
+        result, started, _ = self.run_fake_jobs(jobs, 4, fail=['unit'])
+        self.assertFalse(result)
+        self.assertEqual(sorted(started), ['docs', 'lint', 'unit'])
+        self.assertEqual(
+            [(job.name, job.status) for job in jobs],
+            [
+                ('lint', PASSED),
+                ('unit', FAILED),
+                ('integration', SKIPPED),
+                ('deploy', SKIPPED),
+                ('docs', PASSED),
+            ]
+        )
+        self.assertEqual(jobs[2].failed_needs, ['unit'])
+        self.assertEqual(jobs[3].failed_needs, ['integration'])
+
+
+    def test_jobs_sharing_a_lock_dont_overlap(self):
+        jobs = [
+            Job('a', 'a', lock='db'), Job('b', 'b', lock='db'), Job('c', 'c'),
+        ]
+        result, started, overlaps = self.run_fake_jobs(jobs, 3)
+        self.assertNotIn(('a', 'b'), overlaps)
+        self.assertIn(('a', 'c'), overlaps)
+
+
+class Test_RunJobs(unittest.TestCase):
+
+    @patch('rerun.jobs.sys.stdout')
+    @patch('rerun.jobs.write_output')
+    def test_run_jobs_buffers_output(self, mock_write, mock_stdout):
+        jobs = [Job('one', 'echo one'), Job('two', 'echo two; exit 3')]
+
+        self.assertFalse(run_jobs(jobs, SHELL, 2))
+
+        self.assertEqual(jobs[0].output, b'one\n')
+        self.assertEqual(jobs[1].output, b'two\n')
+        self.assertEqual(jobs[1].returncode, 3)
+        self.assertEqual(
+            sorted(mock_write.call_args_list),
+            [call(b'one\n'), call(b'two\n')]
+        )
+        headings = [
+            args[0][0] for args in mock_stdout.write.call_args_list
+            if args[0][0].startswith('==')
+        ]
+        self.assertEqual(len(headings), 2)
+        self.assertIn('two: failed with exit status 3', ''.join(headings))
+
+
+    @patch('rerun.jobs.subprocess.call')
+    def test_run_jobs_doesnt_buffer_a_single_job(self, mock_call):
+        mock_call.return_value = 0
+
+        env = dict(RERUN_CHANGED_FILES='a')
+        self.assertTrue(run_jobs([Job('one', 'echo one', env=env)], SHELL, 2))
+
+        self.assertEqual(
+            mock_call.call_args,
+            call('echo one', shell=True, executable=SHELL, env=env)
+        )
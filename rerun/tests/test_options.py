@@ -12,6 +12,7 @@ except ImportError:
 from mock import Mock, call, patch
 
 from rerun import __version__
+from rerun.config import ConfigError
 from rerun.options import get_current_shell, get_parser, parse_args, validate
 
 
@@ -53,6 +54,18 @@ class Test_Options(unittest.TestCase):
         options = parser.parse_args(['command is this'])
         self.assertEqual(options.ignore, ['ignored-dirs'])
         self.assertEqual(options.interactive, False)
+        self.assertEqual(options.watcher, 'auto')
+        self.assertEqual(options.stat_interval, 2.0)
+        self.assertEqual(options.walk_threads, 1)
+        self.assertEqual(options.gitignore, False)
+        self.assertEqual(options.debounce, 0)
+        self.assertEqual(options.restart, False)
+        self.assertEqual(options.snapshot, False)
+        self.assertEqual(options.content_hash, False)
+        self.assertEqual(options.config, None)
+        self.assertEqual(options.jobs, os.cpu_count() or 1)
+        self.assertEqual(options.min_interval, 0.2)
+        self.assertEqual(options.max_interval, 1.0)
 
 
     def test_get_parser_version(self):
@@ -106,6 +119,38 @@ class Test_Options(unittest.TestCase):
         self.assertEqual(options.command, 'command is this')
 
 
+    def test_get_parser_content_hash(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--content-hash', 'command is this'])
+        self.assertEqual(options.content_hash, True)
+
+
+    def test_get_parser_debounce(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--debounce', '250', 'command is this'])
+        self.assertEqual(options.debounce, 250)
+
+
+    def test_get_parser_jobs(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['-j', '4', 'command is this'])
+        self.assertEqual(options.jobs, 4)
+
+
+    def test_get_parser_intervals(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args([
+            '--min-interval', '0.05', '--max-interval', '30', 'command'])
+        self.assertEqual(options.min_interval, 0.05)
+        self.assertEqual(options.max_interval, 30)
+
+
+    def test_get_parser_gitignore(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--gitignore', 'command is this'])
+        self.assertEqual(options.gitignore, True)
+
+
     def test_get_parser_interactive(self):
         parser = get_parser('prog', ['ignored-dirs'], ['exts'])
         parser.exit = Mock()
@@ -113,6 +158,91 @@ class Test_Options(unittest.TestCase):
         self.assertEqual(options.interactive, True)
 
 
+    def test_get_parser_watcher(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--watcher', 'poll', 'command is this'])
+        self.assertEqual(options.watcher, 'poll')
+
+
+    def test_get_parser_snapshot(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--snapshot', 'command is this'])
+        self.assertEqual(options.snapshot, True)
+
+
+    def test_get_parser_stat_interval(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--stat-interval', '0.5', 'command'])
+        self.assertEqual(options.stat_interval, 0.5)
+
+
+    def test_get_parser_walk_threads(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--walk-threads', '8', 'command'])
+        self.assertEqual(options.walk_threads, 8)
+
+
+    def test_get_parser_max_watches(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(
+            ['--watcher', 'hybrid', '--max-watches', '50', 'command'])
+        self.assertEqual(options.watcher, 'hybrid')
+        self.assertEqual(options.max_watches, 50)
+
+
+    def test_get_parser_control(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        for address in ['/tmp/rerun.sock', '8765']:
+            options = parser.parse_args(['--control', address, 'command'])
+            self.assertEqual(options.control, address)
+
+
+    @patch('sys.stderr')
+    def test_get_parser_control_port_must_be_in_range(self, mock_stderr):
+        self.assert_get_parser_error(
+            ['--control', '70000', 'command'],
+            "prog: error: argument --control: not a port number: '70000'\n",
+            mock_stderr
+        )
+
+
+    @patch('sys.stderr')
+    def test_get_parser_walk_threads_must_be_positive(self, mock_stderr):
+        self.assert_get_parser_error(
+            ['--walk-threads', '0', 'command'],
+            "prog: error: argument --walk-threads: must be at least 1: '0'\n",
+            mock_stderr
+        )
+
+
+    @patch('rerun.options._exit')
+    @patch('rerun.options.inotify.is_available', Mock(return_value=False))
+    def test_validate_requires_inotify_if_requested(self, mock_exit):
+        options = Mock(
+            command=[0], watcher='inotify', config=None, python_worker=False)
+        validate(options)
+        self.assertEqual(
+            mock_exit.call_args,
+            (('inotify is not available on this platform.',), )
+        )
+
+
+    def test_get_parser_restart(self):
+        parser = get_parser('prog', ['ignored-dirs'], ['exts'])
+        options = parser.parse_args(['--restart', 'command is this'])
+        self.assertEqual(options.restart, True)
+
+
+    @patch('sys.stderr')
+    def test_get_parser_restart_excludes_interactive(self, mock_stderr):
+        self.assert_get_parser_error(
+            ['--restart', '--interactive', 'command'],
+            'prog: error: argument --interactive/-I: '
+            'not allowed with argument --restart/-r\n',
+            mock_stderr
+        )
+
+
     def test_parse_args(self):
         parser = Mock()
         args = Mock()
@@ -123,7 +253,7 @@ class Test_Options(unittest.TestCase):
         self.assertEqual(options, parser.parse_args.return_value)
 
 
-    @unittest.skipIf(platform.system() != 'Windows', 'Not on Windows.')
+    @patch('rerun.options.WINDOWS', True)
     def test_get_current_shell_returns_none_on_Windows(self):
         self.assertEqual(get_current_shell(), None)
 
@@ -135,7 +265,7 @@ class Test_Options(unittest.TestCase):
 
 
     @unittest.skipIf(platform.system() == 'Windows', 'On Windows.')
-    @patch('rerun.options.pwd.getpwuid')
+    @patch('pwd.getpwuid')
     def test_get_current_shell_falls_back_to_default_shell(self, mock_getpwuid):
         mock_getpwuid.return_value.pw_shell = 'myshell'
         with env_vars(SHELL=None):
@@ -143,24 +273,90 @@ class Test_Options(unittest.TestCase):
 
 
     def test_validate_returns_given_options(self):
-        options = Mock()
+        options = Mock(config=None, python_worker=False)
         options.command = [0]
         response = validate(options)
         self.assertIs(response, options)
 
 
     @patch('rerun.options._exit')
+    @patch('rerun.options.os.path.isfile', Mock(return_value=False))
     def test_validate_requires_command(self, mock_exit):
-        options = Mock()
+        options = Mock(config=None, python_worker=False)
         options.command = []
         validate(options)
         self.assertEqual(mock_exit.call_args, (('No command specified.',), ))
 
 
+    @patch('rerun.options.load_config')
+    def test_validate_loads_config(self, mock_load_config):
+        options = Mock(
+            command='', config='my.toml', interactive=False, restart=False,
+            python_worker=False)
+        validate(options)
+        self.assertEqual(mock_load_config.call_args, (('my.toml',),))
+        self.assertEqual(options.rules, mock_load_config.return_value)
+
+
+    @patch('rerun.options.load_config')
+    @patch('rerun.options.os.path.isfile', Mock(return_value=True))
+    def test_validate_uses_default_config(self, mock_load_config):
+        options = Mock(
+            command='', config=None, interactive=False, restart=False,
+            python_worker=False)
+        validate(options)
+        self.assertEqual(mock_load_config.call_args, (('rerun.toml',),))
+
+
+    @patch('rerun.options._exit')
+    @patch('rerun.options.load_config', Mock())
+    def test_validate_config_excludes_command(self, mock_exit):
+        options = Mock(
+            command='cmd', config='my.toml', interactive=False, restart=False,
+            python_worker=False)
+        validate(options)
+        self.assertEqual(
+            mock_exit.call_args,
+            (('Give either a command or --config, not both.',),)
+        )
+
+
+    @patch('rerun.options._exit')
+    @patch('rerun.options.load_config')
+    def test_validate_reports_config_errors(self, mock_load, mock_exit):
+        mock_load.side_effect = ConfigError('bad config')
+        options = Mock(
+            command='', config='my.toml', interactive=False, restart=False,
+            python_worker=False)
+        validate(options)
+        self.assertEqual(mock_exit.call_args, (('bad config',),))
+
+
     @patch('rerun.options.get_current_shell', Mock(return_value='myshell'))
     def test_validate_sets_shell(self):
-        options = Mock()
+        options = Mock(config=None, python_worker=False)
         options.command = [0]
         response = validate(options)
         self.assertEqual(response.shell, 'myshell')
 
+
+
+    @patch('rerun.options._exit')
+    def test_validate_python_worker(self, mock_exit):
+        options = Mock(
+            command='make test', config=None, interactive=False,
+            python_worker=True)
+        validate(options)
+        self.assertIn(
+            '--python-worker needs a command which runs Python',
+            mock_exit.call_args[0][0]
+        )
+
+        mock_exit.reset_mock()
+        options.interactive = True
+        options.command = 'python -m pytest'
+        validate(options)
+        self.assertEqual(
+            mock_exit.call_args[0][0],
+            '--python-worker cannot be used with --config or --interactive.'
+        )
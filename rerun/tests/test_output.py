@@ -0,0 +1,131 @@
+import io
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import patch
+
+from rerun.output import MAX_LINE, OutputHistory, RunOutput, Tee
+
+
+def record(history, output):
+    run = history.start()
+    run.write(output)
+    run.finish()
+    return run
+
+
+class Test_RunOutput(unittest.TestCase):
+
+    def test_write_returns_completed_lines(self):
+        run = RunOutput()
+        self.assertEqual(run.write(b'one\ntw'), [b'one'])
+        self.assertEqual(run.write(b'o\nthree'), [b'two'])
+        self.assertEqual(run.finish(), b'three')
+        self.assertIsNone(run.finish())
+        self.assertEqual(list(run.lines()), [b'one', b'two', b'three'])
+        self.assertTrue(run.has_line(b'three'))
+        self.assertFalse(run.has_line(b'four'))
+        run.close()
+
+
+    def test_long_lines_are_split(self):
+        run = RunOutput()
+        piece = b'x' * MAX_LINE
+        self.assertEqual(run.write(piece + b'y'), [piece])
+        self.assertEqual(run.partial, b'y')
+        self.assertEqual(run.write(b'\n' + piece * 2 + b'z\n'),
+            [b'y', piece, piece, b'z'])
+        run.finish()
+        self.assertEqual(
+            list(run.lines()), [piece, b'y', piece, piece, b'z'])
+        run.close()
+
+
+    def test_remembers_a_limited_number_of_lines(self):
+        run = RunOutput()
+        with patch('rerun.output.MAX_HASHES', 2):
+            run.write(b'one\ntwo\nthree\n')
+        self.assertTrue(run.has_line(b'two'))
+        self.assertFalse(run.has_line(b'three'))
+        run.close()
+
+
+    def test_spills_to_disk(self):
+        run = RunOutput(spill_bytes=10)
+        run.write(b'short\n')
+        self.assertFalse(run.file._rolled)
+        run.write(b'a longer line\n')
+        self.assertTrue(run.file._rolled)
+        self.assertEqual(list(run.lines()), [b'short', b'a longer line'])
+        run.close()
+
+
+class Test_OutputHistory(unittest.TestCase):
+
+    def test_keeps_the_last_runs(self):
+        history = OutputHistory(2)
+        first = record(history, b'1\n')
+        self.assertIs(history.previous(), first)
+        second = record(history, b'2\n')
+        third = record(history, b'3\n')
+
+        self.assertEqual(list(history.runs), [second, third])
+        self.assertTrue(first.file.closed)
+        history.close()
+        self.assertTrue(third.file.closed)
+
+
+    def test_forgets_the_lines_of_older_runs(self):
+        history = OutputHistory(3)
+        first = record(history, b'1\n')
+        second = record(history, b'2\n')
+        record(history, b'3\n')
+        self.assertFalse(first.has_line(b'1'))
+        self.assertTrue(second.has_line(b'2'))
+        self.assertEqual(list(first.lines()), [b'1'])
+        history.close()
+
+
+    def test_new_lines(self):
+        history = OutputHistory(2)
+        record(history, b'test_a PASSED\ntest_b PASSED\n')
+        self.assertEqual(list(history.new_lines()), [])
+        record(history, b'test_a PASSED\ntest_b FAILED\n')
+        self.assertEqual(list(history.new_lines()), [b'test_b FAILED'])
+        history.close()
+
+
+class Test_Tee(unittest.TestCase):
+
+    def test_writes_output_straight_through(self):
+        stream = io.BytesIO()
+        run = RunOutput()
+        tee = Tee(run, stream)
+        tee(b'one\ntw')
+        self.assertEqual(stream.getvalue(), b'one\ntw')
+        tee(b'o')
+        tee.close()
+        self.assertEqual(stream.getvalue(), b'one\ntwo')
+        self.assertEqual(list(run.lines()), [b'one', b'two'])
+
+
+    def test_diff_writes_only_new_lines(self):
+        history = OutputHistory(2)
+        previous = record(history, b'same\nold\n')
+        stream = io.BytesIO()
+        tee = Tee(history.start(), stream, previous, diff=True)
+        tee(b'same\nne')
+        self.assertEqual(stream.getvalue(), b'')
+        tee(b'w\nold\nlast')
+        tee.close()
+        self.assertEqual(stream.getvalue(), b'new\nlast\n')
+        history.close()
+
+
+    def test_diff_without_a_previous_run_writes_everything(self):
+        stream = io.BytesIO()
+        tee = Tee(RunOutput(), stream, None, diff=True)
+        tee(b'one\n')
+        self.assertEqual(stream.getvalue(), b'one\n')
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun.record import DAY, KEEP_DAYS, format_change, median, RunRecord
+
+
+NOW = 1000 * DAY
+
+
+class Test_Record(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'cache', 'runs.sqlite')
+        self.output = Mock()
+        self.record = RunRecord(self.filename, self.output)
+
+    def tearDown(self):
+        self.record.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def add_run(self, start, seconds, changed_files=('a',), returncode=0,
+            usage=(None, None), first_time=False):
+        with patch('rerun.record.get_usage', Mock(side_effect=usage)), \
+                patch('rerun.record.time.time', Mock(return_value=start)):
+            run = self.record.start_run()
+        with patch('rerun.record.get_usage', Mock(side_effect=usage[1:])), \
+                patch('rerun.record.time.time',
+                    Mock(return_value=start + seconds)):
+            self.record.end_run(
+                run, 'pytest', list(changed_files), first_time, returncode)
+
+    def get_runs(self):
+        return self.record.db.execute(
+            'SELECT time, command, seconds, returncode, cpu_seconds, '
+            'max_rss, changed FROM runs ORDER BY id'
+        ).fetchall()
+
+
+    def test_end_run_saves_the_run(self):
+        self.add_run(
+            NOW, 2.0, ['./a', 'b'], 1, usage=[(1.0, 1000), (2.5, 2000)])
+        self.assertEqual(
+            self.get_runs(), [(NOW, 'pytest', 2.0, 1, 1.5, 2000, 2)])
+        self.assertEqual(
+            self.record.db.execute(
+                'SELECT filename FROM run_files ORDER BY filename').fetchall(),
+            [('a',), ('b',)]
+        )
+        self.assertEqual(self.record.commands, ['pytest'])
+
+
+    def test_end_run_saves_max_rss_only_if_it_grew(self):
+        self.add_run(NOW, 1.0, usage=[(1.0, 2000), (1.5, 2000)])
+        self.assertEqual(self.get_runs()[0][4:6], (0.5, None))
+
+
+    def test_end_run_skips_runs_that_ran_nothing(self):
+        self.add_run(NOW, 1.0, returncode=None)
+        self.assertEqual(self.get_runs(), [])
+
+
+    def test_end_run_doesnt_save_the_files_of_the_first_run(self):
+        self.add_run(NOW, 1.0, first_time=True)
+        self.assertEqual(len(self.get_runs()), 1)
+        self.assertEqual(
+            self.record.db.execute('SELECT * FROM run_files').fetchall(), [])
+
+
+    def test_old_runs_are_deleted(self):
+        self.add_run(NOW, 1.0)
+        self.record.db.close()
+        with patch('rerun.record.time.time',
+                Mock(return_value=NOW + (KEEP_DAYS + 1) * DAY)):
+            self.record = RunRecord(self.filename, self.output)
+        self.assertEqual(self.get_runs(), [])
+        self.assertEqual(
+            self.record.db.execute('SELECT * FROM run_files').fetchall(), [])
+
+
+    def test_report_trend_and_slow_files(self):
+        for hour in range(3):
+            self.add_run(NOW - DAY - (hour + 1) * 3600, 2.0)
+            self.add_run(NOW - (hour + 1) * 3600, 3.0)
+            self.add_run(NOW - (hour + 1) * 3600 + 60, 9.0, ['a', 'slow'])
+        self.assertEqual(self.record.report('pytest', NOW), [
+            'rerun record: pytest: 9 runs this week, median 3.00s',
+            '  200% slower than the day before (median 6.00s, was 2.00s)',
+            '  changing slow makes it slow: median 9.00s over 3 runs',
+        ])
+
+
+    def test_report_without_enough_runs(self):
+        self.add_run(NOW - DAY - 60, 2.0, usage=[(0.0, 0), (1.0, 2048)])
+        self.add_run(NOW - 60, 6.0, usage=[(1.0, 2048), (1.5, 2048)])
+        self.assertEqual(self.record.report('pytest', NOW), [
+            'rerun record: pytest: 2 runs this week, median 4.00s, '
+            '0.75s CPU, peak 2MB',
+        ])
+        self.assertEqual(self.record.report('other', NOW), [])
+
+
+    def test_close_reports_on_the_commands_run(self):
+        self.add_run(NOW, 1.0)
+        with patch('rerun.record.time.time', Mock(return_value=NOW + 2)):
+            self.record.close()
+        self.output.write.assert_called_once_with(
+            'rerun record: pytest: 1 run this week, median 1.00s\n')
+
+
+class Test_Helpers(unittest.TestCase):
+
+    def test_median(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+
+
+    def test_format_change(self):
+        self.assertEqual(
+            format_change(1.5, 2.0),
+            '25% faster than the day before (median 1.50s, was 2.00s)'
+        )
@@ -1,154 +1,55 @@
 import os
 import signal
-import stat
+import subprocess
+import sys
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
-from mock import call, Mock, patch
+from mock import ANY, call, Mock, patch
 
+from rerun.changes import ChangeTracker
+from rerun.config import Rule
 from rerun.rerun import (
-    act, get_changed_files, clear_screen, file_stat_cache, get_file_mtime,
-    has_file_changed, is_ignorable, main, mainloop, skip_dirs, SKIP_DIRS,
-    SKIP_EXT, step
+    act, clear_screen, get_changes, main, mainloop, show_status, SKIP_DIRS,
+    SKIP_EXT, wait_for_quiet,
 )
+from rerun.tests.test_watchers import temp_cwd, touch
 
 
-class Test_Rerun(unittest.TestCase):
-
-    @patch('rerun.rerun.os')
-    def test_get_file_mtime(self, mock_os):
-        def mock_stat(filename):
-            self.assertEqual(filename, 'hello')
-            return mock_filestat
-        mock_os.lstat = mock_stat
-        mock_filestat = {stat.ST_MTIME: 'mymtime'}
-
-        time = get_file_mtime('hello')
-
-        self.assertEqual(time, 'mymtime')
-
-
-    def test_skip_dirs_modifies_in_place(self):
-        dirs = ['a', 'b', 'c', 'd', 'e', 'f'] 
-        skip_dirs(dirs, ['b', 'd', 'f'])
-        self.assertEqual(dirs, ['a', 'c', 'e'])
-
-
-    def test_is_ignorable(self):
-        self.assertFalse(is_ignorable('h.txt', []))
-
-
-    def test_is_ignorable_for_ignored(self):
-        self.assertTrue(is_ignorable('h.txt', ['h.txt']))
-
-
-    def test_is_ignorable_for_ignored_with_same_ending(self):
-        self.assertFalse(is_ignorable('gh.txt', ['h.txt']))
-
-
-    def test_is_ignorable_works_on_basename(self):
-        self.assertTrue(is_ignorable(r'somedir/h.txt', ['h.txt']))
-
-
-    def test_is_ignorable_for_extension(self):
-        self.assertTrue(is_ignorable('h' + SKIP_EXT[0], []))
-
-
-    @patch('rerun.rerun.get_file_mtime')
-    def test_has_file_changed_return_value(self, mock_get_file_mtime):
-        file_stats = ['mon', 'mon', 'tue', 'tue']
-        mock_get_file_mtime.side_effect = lambda _: file_stats.pop(0)
-
-        self.assertTrue(has_file_changed('filename'))
-        self.assertFalse(has_file_changed('filename'))
-        self.assertTrue(has_file_changed('filename'))
-        self.assertFalse(has_file_changed('filename'))
+def get_options(**kwargs):
+    '''
+    Returns options as parsed from the command line, with the given values.
+    '''
+    defaults = dict(
+        command='mycommand', shell='myshell', interactive=False,
+        restart=False, verbose=True, debounce=0, snapshot=False, rules=None,
+        jobs=1, stats=False, scrollback=False, alt_screen=False,
+        status=False, keep_output=0, diff=False, python_worker=False,
+        control=None, record=False,
+    )
+    defaults.update(kwargs)
+    return Mock(**defaults)
 
-    @patch('rerun.rerun.get_file_mtime')
-    def test_has_file_changed_on_missing_file(self, mock_get_file_mtime):
-        has_file_changed('filename')
-        mock_get_file_mtime.side_effect = FileNotFoundError
-
-        actual = has_file_changed('filename')
-
-        self.assertTrue(actual)
-        self.assertFalse('filename' in file_stat_cache)
-
-
-    @patch('rerun.rerun.is_ignorable')
-    @patch('rerun.rerun.has_file_changed')
-    @patch('rerun.rerun.os')
-    def test_get_changed_files(self, mock_os, mock_changed, mock_ignorable):
-
-        def fake_has_changed(relname):
-            return relname in ['root/f', 'root/l', 'root/s']
-        mock_changed.side_effect = fake_has_changed
-
-        def fake_is_ignorable(relname, _):
-            return relname in ['root/l']
-        mock_ignorable.side_effect = fake_is_ignorable
-
-        mock_os.walk.return_value = [
-            ('root', list('dirs'), list('files')),
-        ]
-        mock_os.path.join = os.path.join
-
-        actual = get_changed_files([])
-
-        self.assertEqual(
-            actual,
-            [os.path.join('root', 'f'), os.path.join('root', 's')]
-        )
-        # has_file_changed must be called for every file, cannot short-circuit
-        # or else it will fail to update some files' modification times,
-        # and generate false positives on later calls to step.
-        self.assertEqual(mock_changed.call_count, 5)
-
-
-    @patch('rerun.rerun.os')
-    @patch('rerun.rerun.skip_dirs')
-    def test_get_changed_files_calls_skip_dirs(self, mock_skip_dirs, mock_os):
-        mock_os.walk.return_value = [
-            ('root1', list('dirs1'), list('files1')),
-            ('root2', list('dirs2'), list('files2')),
-        ]
-        ignoreds = []
-
-        get_changed_files(ignoreds)
-
-        self.assertEqual(
-            mock_skip_dirs.call_args_list,
-            [
-                ((list('dirs1'), ignoreds), ),
-                ((list('dirs2'), ignoreds), ),
-            ]
-        )
 
+class Test_Rerun(unittest.TestCase):
 
-    @patch('rerun.rerun.platform')
+    @patch('rerun.rerun.WINDOWS', True)
     @patch('rerun.rerun.os.system')
-    def test_clear_screen(self, mock_system, mock_platform):
-        mock_platform.system.return_value = 'Windows'
-        clear_screen()
-        self.assertEqual(mock_system.call_args[0], ('cls',))
-
-        mock_platform.system.return_value = 'win32'
-        clear_screen()
-        self.assertEqual(mock_system.call_args[0], ('cls',))
-
-        mock_platform.system.return_value = 'win64'
+    def test_clear_screen_on_windows(self, mock_system):
         clear_screen()
         self.assertEqual(mock_system.call_args[0], ('cls',))
 
-        mock_platform.system.return_value = 'Darwin'
-        clear_screen()
-        self.assertEqual(mock_system.call_args[0], ('clear',))
 
-        mock_platform.system.return_value = 'unknown'
-        clear_screen()
-        self.assertEqual(mock_system.call_args[0], ('clear',))
+    @patch('rerun.rerun.WINDOWS', False)
+    @patch('rerun.rerun.os.system')
+    @patch('rerun.rerun.terminal.clear')
+    @patch('rerun.rerun.sys.stdout')
+    def test_clear_screen(self, mock_stdout, mock_clear, mock_system):
+        clear_screen(True)
+        self.assertEqual(mock_clear.call_args, call(mock_stdout, True))
+        self.assertFalse(mock_system.called)
 
 
     @patch('rerun.rerun.clear_screen')
@@ -158,7 +59,10 @@ class Test_Rerun(unittest.TestCase):
     def test_act_calls_each_thing_in_order(
         self, mock_tcsetpgrp, mock_call, mock_stdout, mock_clear
     ):
-        options = Mock(command='mycommand', shell='myshell', interactive=False)
+        options = get_options(
+            command='mycommand', shell='myshell', interactive=False,
+            restart=False,
+        )
 
         act(['mychanges'], options, False)
 
@@ -169,11 +73,30 @@ class Test_Rerun(unittest.TestCase):
         )
         self.assertEqual(
             mock_call.call_args,
-            call(options.command, shell=True, executable='myshell')
+            call(options.command, shell=True, executable='myshell', env=ANY)
         )
         self.assertIsNone(mock_tcsetpgrp.call_args)
 
 
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout', Mock())
+    @patch('rerun.rerun.subprocess.call')
+    def test_act_returns_exit_status(self, mock_call):
+        mock_call.return_value = 3
+        self.assertEqual(act(['mychanges'], get_options(), False), 3)
+
+
+    @patch('rerun.rerun.terminal.show_status')
+    def test_show_status(self, mock_show_status):
+        show_status(1, 2.5, get_options(status=True))
+        self.assertEqual(mock_show_status.call_args[0][1:], (1, 2.5))
+
+        mock_show_status.reset_mock()
+        show_status(None, 2.5, get_options(status=True))
+        show_status(1, 2.5, get_options(status=False))
+        self.assertFalse(mock_show_status.called)
+
+
     @patch('rerun.rerun.clear_screen')
     @patch('rerun.rerun.sys.stdout')
     @patch('rerun.rerun.subprocess.call')
@@ -181,7 +104,10 @@ class Test_Rerun(unittest.TestCase):
     def test_act_for_interactive_shell_calls_each_thing_in_order(
         self, mock_tcsetpgrp, mock_call, mock_stdout, mock_clear
     ):
-        options = Mock(command='mycommand', shell='myshell', interactive=True)
+        options = get_options(
+            command='mycommand', shell='myshell', interactive=True,
+            restart=False,
+        )
 
         act(['mychanges'], options, False)
 
@@ -192,7 +118,7 @@ class Test_Rerun(unittest.TestCase):
         )
         self.assertEqual(
             mock_call.call_args,
-            call([options.shell, '-i', '-c', options.command])
+            call([options.shell, '-i', '-c', options.command], env=ANY)
         )
         self.assertEqual(
             mock_tcsetpgrp.call_args,
@@ -210,7 +136,11 @@ class Test_Rerun(unittest.TestCase):
         mock_call.side_effect = ZeroDivisionError('injected')
 
         with self.assertRaises(ZeroDivisionError):
-            act(['mychanges'], Mock(interactive=True), False)
+            act(
+                ['mychanges'],
+                get_options(interactive=True),
+                False
+            )
 
         self.assertEqual(
             mock_tcsetpgrp.call_args,
@@ -224,7 +154,8 @@ class Test_Rerun(unittest.TestCase):
     def test_act_on_first_time_doesnt_print_changed_files(
         self, mock_call, mock_stdout, mock_clear
     ):
-        options = Mock(command='mycommand', shell='myshell')
+        options = get_options(
+            command='mycommand', shell='myshell', restart=False)
 
         act(['mychanges'], options, True)
 
@@ -240,7 +171,9 @@ class Test_Rerun(unittest.TestCase):
     def test_act_without_verbose_doesnt_print_changed_files(
         self, mock_call, mock_stdout, mock_clear
     ):
-        options = Mock(command='mycommand', shell='myshell', verbose=False)
+        options = get_options(
+            command='mycommand', shell='myshell', verbose=False, restart=False
+        )
 
         act(['mychanges'], options, False)
 
@@ -250,72 +183,246 @@ class Test_Rerun(unittest.TestCase):
         )
 
 
-    @patch('rerun.rerun.get_changed_files')
-    @patch('rerun.rerun.act')
-    @patch('rerun.rerun.time.sleep', Mock())
-    def test_step_calls_act_if_changed_files(self, mock_act, mock_changed):
-        mock_changed.return_value = ['mychanges']
-        options = Mock(ignore=[])
+    def test_get_changes(self):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['mychanges']
+        options = get_options(ignore=[], debounce=0, snapshot=False)
 
-        step(options)
-        
         self.assertEqual(
-            mock_act.call_args,
-            call(['mychanges'], options, False)
+            get_changes(options, watcher), (['mychanges'], False))
+        self.assertEqual(
+            get_changes(options, watcher, True), (['mychanges'], True))
+
+
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout', Mock())
+    @patch('rerun.deps.get_affected_tests')
+    @patch('rerun.rerun.subprocess.call')
+    def test_act_replaces_changed_tests(self, mock_call, mock_affected):
+        mock_affected.return_value = ['./a/test_b.py', './test c.py']
+        options = get_options(
+            command='pytest {changed_tests}', shell='myshell',
+            interactive=False, restart=False,
         )
 
-    @patch('rerun.rerun.get_changed_files')
-    @patch('rerun.rerun.act')
-    @patch('rerun.rerun.time.sleep', Mock())
-    def test_step_doesnt_call_act_if_no_changed_files(self, mock_act, mock_changed):
-        mock_changed.return_value = []
-        options = Mock(ignore=[])
+        act(['mychanges'], options, False)
 
-        step(options)
-        
-        self.assertIsNone(mock_act.call_args)
+        self.assertEqual(mock_affected.call_args, call(['mychanges'], options))
+        self.assertEqual(
+            mock_call.call_args,
+            call(
+                "pytest a/test_b.py 'test c.py'",
+                shell=True, executable='myshell', env=ANY,
+            )
+        )
 
 
-    @patch('rerun.rerun.get_changed_files')
-    @patch('rerun.rerun.act')
-    @patch('rerun.rerun.time.sleep', Mock())
-    def test_step_passes_first_time_to_act(self, mock_act, mock_changed):
-        mock_changed.return_value = ['mychanges']
-        options = Mock(ignore=[])
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout')
+    @patch('rerun.deps.get_affected_tests')
+    @patch('rerun.rerun.subprocess.call')
+    def test_act_without_changed_tests_doesnt_run(
+        self, mock_call, mock_affected, mock_stdout
+    ):
+        mock_affected.return_value = []
+        options = get_options(
+            command='pytest {changed_tests}', shell='myshell',
+            interactive=False, restart=False, verbose=False,
+        )
 
-        step(options, first_time=True)
-        
+        act(['mychanges'], options, False)
+
+        self.assertFalse(mock_call.called)
         self.assertEqual(
-            mock_act.call_args,
-            call(['mychanges'], options, True)
+            mock_stdout.write.call_args_list[-2],
+            call('No tests are affected by the changed files.')
         )
 
 
-    @patch('rerun.rerun.step')
-    def test_mainloop_calls_step_with_first_time_then_repeatedly_without(
-        self, mock_step
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout', Mock())
+    @patch('rerun.rerun.change_tracker', ChangeTracker())
+    @patch('rerun.rerun.subprocess.call')
+    def test_act_tells_the_command_which_files_changed(self, mock_call):
+        options = get_options(command='lint {files}')
+        with temp_cwd():
+            touch('a')
+            touch('b c')
+            act([os.path.join('.', 'a'), os.path.join('.', 'b c')], options,
+                True)
+            touch('d')
+            os.remove('b c')
+            act([os.path.join('.', 'a'), os.path.join('.', 'b c'),
+                 os.path.join('.', 'd')], options, False)
+
+        command = mock_call.call_args[0][0]
+        self.assertEqual(command, 'lint a d')
+        env = mock_call.call_args[1]['env']
+        self.assertEqual(env['RERUN_CHANGED_FILES'], 'a\nb c\nd')
+        self.assertEqual(env['RERUN_ADDED_FILES'], 'd')
+        self.assertEqual(env['RERUN_MODIFIED_FILES'], 'a')
+        self.assertEqual(env['RERUN_DELETED_FILES'], 'b c')
+
+
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout')
+    @patch('rerun.rerun.subprocess.call')
+    def test_act_doesnt_run_if_the_changed_files_are_gone(
+        self, mock_call, mock_stdout
     ):
-        actions = [None, None, ZeroDivisionError]
+        options = get_options(command='lint {files}', verbose=False)
+        with temp_cwd():
+            act([os.path.join('.', 'gone')], options, False)
 
-        def raise_next_action(options, first_time=False):
-            action = actions.pop(0)
-            if action:
-                raise action()
+        self.assertFalse(mock_call.called)
+        self.assertEqual(
+            mock_stdout.write.call_args_list[-2],
+            call('The changed files were all deleted.')
+        )
 
-        mock_step.side_effect = raise_next_action
 
-        options = Mock()
-        with self.assertRaises(ZeroDivisionError):
-            mainloop(options)
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout')
+    @patch('rerun.rerun.subprocess.call')
+    @patch('rerun.rerun.PLACEHOLDER_LIMIT', 10)
+    def test_act_doesnt_run_if_there_are_too_many_files(
+        self, mock_call, mock_stdout
+    ):
+        options = get_options(command='lint {files}', verbose=False)
+        with temp_cwd():
+            touch('first')
+            touch('second')
+            act(['first', 'second'], options, False)
+
+        self.assertFalse(mock_call.called)
+        self.assertIn(
+            '$RERUN_CHANGED_FILES_LIST',
+            mock_stdout.write.call_args_list[-2][0][0],
+        )
 
+
+    @patch('rerun.rerun.clear_screen', Mock())
+    @patch('rerun.rerun.sys.stdout')
+    @patch('rerun.jobs.run_jobs')
+    def test_act_with_rules_runs_matching_commands(
+        self, mock_run, mock_stdout
+    ):
+        rules = [
+            Rule('one', root='a'),
+            Rule('two', root='b', lock='x', name='b', needs=['one']),
+            Rule('three', root='c'),
+        ]
+        options = get_options(rules=rules, verbose=False, jobs=3)
+
+        changed = [os.path.join('.', 'a', 'f'), os.path.join('.', 'b', 'g')]
+        act(changed, options, False)
+
+        jobs, shell, max_jobs = mock_run.call_args[0]
         self.assertEqual(
-            mock_step.call_args_list,
-            [
-                call(options, first_time=True),
-                call(options),
-                call(options),
-            ]
+            [(job.name, job.command, job.needs, job.lock) for job in jobs],
+            [('one', 'one', [], None), ('b', 'two', ['one'], 'x')]
+        )
+        self.assertEqual((shell, max_jobs), ('myshell', 3))
+        self.assertEqual(
+            [job.env['RERUN_CHANGED_FILES'] for job in jobs],
+            [os.path.join('a', 'f'), os.path.join('b', 'g')]
         )
+        self.assertEqual(
+            mock_stdout.write.call_args_list,
+            [call('one'), call('\n'), call('two'), call('\n')]
+        )
+
+
+    @patch('rerun.rerun.clear_screen')
+    @patch('rerun.jobs.run_jobs')
+    def test_act_with_rules_when_none_match(self, mock_run, mock_clear):
+        options = get_options(rules=[Rule('one', root='a')])
+
+        act([os.path.join('.', 'b', 'f')], options, False)
+
+        self.assertFalse(mock_run.called)
+        self.assertFalse(mock_clear.called)
+
+
+    @patch('rerun.rerun.wait_for_quiet')
+    def test_get_changes_with_debounce_waits_for_quiet(self, mock_wait):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['a']
+        options = get_options(debounce=50)
+
+        self.assertEqual(
+            get_changes(options, watcher), (mock_wait.return_value, False))
+        self.assertEqual(mock_wait.call_args, call(watcher, ['a'], 0.05))
+
+
+    @patch('rerun.rerun.wait_for_quiet')
+    def test_get_changes_doesnt_debounce_first_time(self, mock_wait):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['a']
+        options = get_options(debounce=50)
+
+        self.assertEqual(get_changes(options, watcher, True), (['a'], True))
+        self.assertFalse(mock_wait.called)
+
+
+    @patch('rerun.rerun.time.time')
+    def test_wait_for_quiet_restarts_the_wait_after_each_change(
+        self, mock_time
+    ):
+        mock_time.side_effect = [0, 0, 0.5, 0.5, 1.4, 1.6]
+        watcher = Mock()
+        batches = [['b'], [], []]
+        watcher.get_changed_files.side_effect = lambda: batches.pop(0)
+
+        actual = wait_for_quiet(watcher, ['a'], 1)
+
+        self.assertEqual(actual, ['a', 'b'])
+        waits = [args[0] for args, _ in watcher.wait.call_args_list]
+        self.assertEqual(waits[:2], [1, 1])
+        self.assertAlmostEqual(waits[2], 0.1)
+
+
+    @patch('rerun.snapshot.changes_since_snapshot')
+    def test_get_changes_first_time_with_snapshot(self, mock_since):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['a', 'b']
+        mock_since.return_value = ['b']
+        options = get_options(snapshot=True, debounce=0)
+
+        self.assertEqual(get_changes(options, watcher, True), (['b'], False))
+        self.assertEqual(mock_since.call_args, call(watcher.matcher))
+
+
+    @patch('rerun.snapshot.changes_since_snapshot')
+    def test_get_changes_first_time_with_unchanged_snapshot(self, mock_since):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['a', 'b']
+        mock_since.return_value = []
+        options = get_options(snapshot=True, debounce=0)
+
+        self.assertEqual(get_changes(options, watcher, True), ([], False))
+
+
+    @patch('rerun.snapshot.changes_since_snapshot')
+    def test_get_changes_first_time_without_saved_snapshot(self, mock_since):
+        watcher = Mock()
+        watcher.get_changed_files.return_value = ['a', 'b']
+        mock_since.return_value = None
+        options = get_options(snapshot=True, debounce=0)
+
+        self.assertEqual(
+            get_changes(options, watcher, True), (['a', 'b'], True))
+
+
+    @patch('asyncio.run')
+    def test_mainloop_runs_the_async_loop(self, mock_run):
+        options = get_options()
+        mock_rerun = Mock()
+        with patch('rerun.aio.rerun', mock_rerun):
+            mainloop(options)
+
+        self.assertEqual(mock_rerun.call_args, call(options))
+        self.assertEqual(mock_run.call_args, call(mock_rerun.return_value))
 
 
     @patch('rerun.rerun.sys.argv', [1, 2, 3])
@@ -352,3 +459,51 @@ class Test_Rerun(unittest.TestCase):
             ((mock_validate.return_value, ),)
         )
 
+
+
+class Test_Startup(unittest.TestCase):
+
+    # Generous, so as not to fail on slow machines, but a regression such as
+    # importing asyncio at the top of rerun.rerun again takes it over.
+    IMPORT_BUDGET_MS = 150
+
+    # Only needed for some options, so not imported until they're used.
+    LAZY_MODULES = [
+        'asyncio', 'ast', 'concurrent.futures', 'ctypes', 'hashlib', 'json',
+        'platform', 'pwd', 'rerun.aio', 'rerun.deps', 'rerun.jobs',
+        'rerun.record', 'rerun.snapshot', 'resource', 'sqlite3', 'tomllib',
+    ]
+
+    def run_python(self, *args):
+        return subprocess.check_output(
+            [sys.executable, '-W', 'ignore'] + list(args),
+            stderr=subprocess.STDOUT, universal_newlines=True,
+            # Where 'import rerun' finds this copy of rerun.
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__)))),
+        )
+
+
+    def test_import_doesnt_import_what_only_some_options_need(self):
+        output = self.run_python('-c',
+            'import sys, rerun.rerun; '
+            'print(" ".join(m for m in %r if m in sys.modules))' % (
+                self.LAZY_MODULES,)
+        )
+        self.assertEqual(output.split(), [])
+
+
+    def test_import_time(self):
+        # The first import may also compile the .pyc files.
+        self.run_python('-c', 'import rerun.rerun')
+        best = None
+        for _ in range(3):
+            output = self.run_python(
+                '-X', 'importtime', '-c', 'import rerun.rerun')
+            [line] = [
+                line for line in output.splitlines()
+                if line.endswith('| rerun.rerun')
+            ]
+            micros = int(line.split('|')[1])
+            best = micros if best is None else min(best, micros)
+        self.assertLess(best / 1000.0, self.IMPORT_BUDGET_MS)
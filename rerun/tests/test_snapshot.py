@@ -0,0 +1,117 @@
+import gzip
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from rerun.ignore import IgnoreMatcher
+from rerun.snapshot import (
+    changes_since_snapshot, diff_snapshots, get_states, load_snapshot,
+    save_snapshot, Snapshot, SNAPSHOT_FILE, take_snapshot,
+)
+
+
+class Test_Snapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.orig = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+        self.matcher = IgnoreMatcher(['.cache'], [])
+
+    def tearDown(self):
+        os.chdir(self.orig)
+        shutil.rmtree(self.tempdir)
+
+    def write(self, filename, text):
+        with open(filename, 'w') as fp:
+            fp.write(text)
+
+
+    def test_take_snapshot(self):
+        self.write('a', 'hello')
+        filestat = os.lstat('a')
+
+        self.assertEqual(
+            take_snapshot(self.matcher),
+            {os.path.join('.', 'a'): (filestat.st_mtime_ns, 5)}
+        )
+
+
+    def test_save_and_load(self):
+        snapshot = {'./a': (123456789012345678, 5), './b c': (1, 0)}
+
+        save_snapshot(snapshot)
+
+        self.assertEqual(load_snapshot(), snapshot)
+        self.assertEqual(
+            os.listdir(os.path.dirname(SNAPSHOT_FILE)),
+            [os.path.basename(SNAPSHOT_FILE)]
+        )
+
+
+    def test_load_missing(self):
+        self.assertIsNone(load_snapshot())
+
+
+    def test_load_corrupt(self):
+        os.makedirs(os.path.dirname(SNAPSHOT_FILE))
+        self.write(SNAPSHOT_FILE, 'not gzip')
+        self.assertIsNone(load_snapshot())
+
+        with gzip.open(SNAPSHOT_FILE, 'wb') as fp:
+            fp.write(b'wrong header\n')
+        self.assertIsNone(load_snapshot())
+
+
+    def test_diff_snapshots(self):
+        old = {'same': (1, 1), 'modified': (1, 1), 'deleted': (1, 1)}
+        new = {'same': (1, 1), 'modified': (2, 1), 'added': (1, 1)}
+        self.assertEqual(
+            diff_snapshots(old, new), ['added', 'deleted', 'modified']
+        )
+
+
+    def test_changes_since_snapshot(self):
+        self.write('a', 'hello')
+        self.write('b', 'hello')
+        self.assertIsNone(changes_since_snapshot(self.matcher))
+        save_snapshot(take_snapshot(self.matcher))
+        self.assertEqual(changes_since_snapshot(self.matcher), [])
+
+        self.write('a', 'hello world')
+        os.remove('b')
+
+        self.assertEqual(
+            changes_since_snapshot(self.matcher),
+            [os.path.join('.', 'a'), os.path.join('.', 'b')]
+        )
+
+
+    def test_get_states(self):
+        self.write('a', 'hello')
+        filestat = os.lstat('a')
+        self.assertEqual(
+            get_states(['a', 'missing']),
+            {'a': (filestat.st_mtime_ns, 5), 'missing': None}
+        )
+
+
+    def test_snapshot_keeps_the_state_as_of_finished_runs(self):
+        snapshot = Snapshot({'a': (1, 1), 'b': (1, 1)})
+        snapshot.end_run((False, {'a': (2, 2), 'b': None, 'c': (3, 3)}))
+        snapshot.start_run(['a'], False)
+        self.assertEqual(snapshot.state, {'a': (2, 2), 'c': (3, 3)})
+
+
+    def test_snapshot_without_a_saved_one_waits_for_the_first_run(self):
+        snapshot = Snapshot()
+        snapshot.end_run((False, {'a': (1, 1)}))
+        snapshot.save()
+        self.assertIsNone(load_snapshot())
+        snapshot.end_run((True, {'b': (2, 2)}))
+        snapshot.save()
+        self.assertEqual(load_snapshot(), {'b': (2, 2)})
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import stats
+from rerun.ignore import IgnoreMatcher
+from rerun.stats import (
+    Histogram, Stats, StatsWatcher, Sweep, TimingMatcher,
+)
+from rerun.tests.test_watchers import temp_cwd, touch
+from rerun.watchers import file_stat_cache, get_watcher
+
+
+class Test_Histogram(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for seconds in [0.0005, 0.0015, 0.003, 0.0035, 0.010]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.buckets, {0: 1, 1: 1, 2: 2, 4: 1})
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.mean, 0.0037)
+        self.assertEqual(
+            [line.split() for line in histogram.format(width=4)],
+            [
+                ['0-1ms', '##', '1'],
+                ['1-2ms', '##', '1'],
+                ['2-4ms', '####', '2'],
+                ['4-8ms', '0'],
+                ['8-16ms', '##', '1'],
+            ]
+        )
+
+
+    def test_empty_histogram(self):
+        self.assertEqual(Histogram().format(), ['  (none)'])
+
+
+class Test_TimingMatcher(unittest.TestCase):
+
+    def tearDown(self):
+        stats.current = None
+
+
+    def test_timing_matcher_counts_into_the_current_sweep(self):
+        matcher = TimingMatcher(IgnoreMatcher(['*.log', 'build'], []))
+        stats.current = sweep = Sweep()
+
+        self.assertTrue(matcher.ignores_file('a.log'))
+        self.assertFalse(matcher.ignores_file('a.py'))
+        self.assertTrue(matcher.ignores_dir('build'))
+        dirs = ['build', 'src']
+        matcher.prune_dirs('.', dirs)
+
+        self.assertEqual(dirs, ['src'])
+        self.assertEqual(sweep.ignored, 3)
+        self.assertGreater(sweep.match_seconds, 0)
+
+
+    def test_timing_matcher_passes_other_methods_through(self):
+        matcher = TimingMatcher(IgnoreMatcher([], []))
+        matcher.add(['*.log'])
+        self.assertTrue(matcher.ignores_path('logs/a.log'))
+        self.assertTrue(matcher.ignores_file('b.log'))
+
+
+    def test_timing_matcher_without_a_sweep(self):
+        matcher = TimingMatcher(IgnoreMatcher(['*.log'], []))
+        self.assertTrue(matcher.ignores_file('a.log'))
+
+
+class Test_Stats(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'stats.jsonl')
+        self.output = Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    def read_records(self):
+        with open(self.filename) as fp:
+            return [json.loads(line) for line in fp]
+
+
+    def test_record_sweep(self):
+        recorder = Stats(self.filename, self.output)
+        sweep = Sweep()
+        sweep.add(dirs=2, files=10, stat_calls=10, ignored=1)
+        sweep.add(walk_seconds=0.25)
+
+        recorder.record_sweep(sweep, 0.5, 3, 10)
+        recorder.close()
+
+        [record] = self.read_records()
+        self.assertEqual(record['type'], 'sweep')
+        self.assertEqual(record['dirs'], 2)
+        self.assertEqual(record['files'], 10)
+        self.assertEqual(record['walk_seconds'], 0.25)
+        self.assertEqual(record['seconds'], 0.5)
+        self.assertEqual(record['changed'], 3)
+        self.assertEqual(record['cache_size'], 10)
+        report = self.output.write.call_args[0][0]
+        self.assertIn('1 sweeps', report)
+        self.assertIn('2 dirs, 10 files, 10 stat calls, 1 ignored', report)
+
+
+    @patch('rerun.stats.time.time')
+    def test_runs(self, mock_time):
+        filename = os.path.join(self.tempdir, 'changed')
+        touch(filename)
+        os.utime(filename, (100, 100))
+        recorder = Stats(self.filename, self.output)
+        mock_time.return_value = 99
+        recorder.record_sweep(Sweep(), 0.001, 1, 1)
+
+        mock_time.return_value = 100.25
+        run = recorder.start_run([filename, 'deleted'], False)
+        mock_time.return_value = 102.25
+        recorder.end_run(run, [filename, 'deleted'])
+
+        self.assertEqual(run, (100.25, 0.25))
+        self.assertEqual(
+            self.read_records()[-1],
+            {
+                'type': 'run', 'time': 100.25, 'latency': 0.25,
+                'duration': 2.0, 'changed': 2,
+            }
+        )
+        self.assertEqual(
+            self.output.write.call_args[0][0],
+            'rerun stats: 1 sweeps, mean 1.0ms, 1 files cached, '
+            'started 250ms after change, ran 2.00s\n'
+        )
+        self.assertEqual(recorder.latencies.count, 1)
+        self.assertEqual(recorder.durations.count, 1)
+        recorder.close()
+
+
+    def test_first_run_has_no_latency(self):
+        recorder = Stats(output=self.output)
+        self.assertIsNone(recorder.start_run(['a'], True)[1])
+
+
+class Test_StatsWatcher(unittest.TestCase):
+
+    def test_stats_watcher(self):
+        inner = Mock()
+        inner.get_changed_files.return_value = ['a', 'b']
+        inner.cache_size.return_value = 7
+        recorder = Mock()
+
+        watcher = StatsWatcher(inner, recorder)
+        self.assertEqual(watcher.get_changed_files(), ['a', 'b'])
+
+        sweep, _, changed, cache_size = recorder.record_sweep.call_args[0]
+        self.assertIsInstance(sweep, Sweep)
+        self.assertEqual((changed, cache_size), (2, 7))
+        self.assertIsNone(stats.current)
+
+
+    def test_get_watcher_with_stats_counts_what_polling_does(self):
+        recorder = Mock()
+        options = Mock(
+            watcher='poll', ignore=['skip'], stat_interval=5, walk_threads=1,
+            gitignore=False, content_hash=False, min_interval=0.2,
+            max_interval=1, shared=False,
+        )
+        file_stat_cache.clear()
+        with temp_cwd():
+            os.mkdir('sub')
+            for filename in ['a', os.path.join('sub', 'b'), 'skip']:
+                touch(filename)
+            watcher = get_watcher(options, recorder)
+            watcher.get_changed_files()
+
+        sweep, _, changed, cache_size = recorder.record_sweep.call_args[0]
+        self.assertEqual(sweep.dirs, 2)
+        self.assertEqual(sweep.files, 2)
+        self.assertEqual(sweep.stat_calls, 2)
+        self.assertEqual(sweep.ignored, 1)
+        self.assertGreater(sweep.walk_seconds, 0)
+        self.assertGreater(sweep.compare_seconds, 0)
+        self.assertEqual((changed, cache_size), (2, 2))
+        file_stat_cache.clear()
@@ -0,0 +1,95 @@
+import io
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import patch
+
+from rerun import terminal
+from rerun.terminal import (
+    alternate_screen, clear, format_status, get_lines, is_terminal,
+    show_status,
+)
+
+
+class FakeTerminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+class Test_Terminal(unittest.TestCase):
+
+    def test_is_terminal(self):
+        self.assertTrue(is_terminal(FakeTerminal()))
+        self.assertFalse(is_terminal(io.StringIO()))
+        self.assertFalse(is_terminal(object()))
+
+
+    def test_get_lines_defaults_if_not_a_terminal(self):
+        self.assertEqual(get_lines(io.StringIO()), terminal.DEFAULT_LINES)
+
+
+    def test_clear(self):
+        stream = FakeTerminal()
+        clear(stream)
+        self.assertEqual(stream.getvalue(), '\x1b[H\x1b[2J\x1b[3J')
+
+
+    @patch('rerun.terminal.get_lines', lambda stream: 3)
+    def test_clear_keeping_scrollback(self):
+        stream = FakeTerminal()
+        clear(stream, scrollback=True)
+        self.assertEqual(stream.getvalue(), '\n\n\n\x1b[H\x1b[2J')
+
+
+    def test_clear_does_nothing_if_not_a_terminal(self):
+        stream = io.StringIO()
+        clear(stream)
+        self.assertEqual(stream.getvalue(), '')
+
+
+    def test_alternate_screen(self):
+        stream = FakeTerminal()
+        with self.assertRaises(KeyboardInterrupt):
+            with alternate_screen(stream):
+                stream.write('output')
+                raise KeyboardInterrupt()
+        self.assertEqual(stream.getvalue(), '\x1b[?1049houtput\x1b[?1049l')
+
+
+    def test_alternate_screen_when_not_enabled_or_not_a_terminal(self):
+        for stream, enabled in [
+            (FakeTerminal(), False),
+            (io.StringIO(), True),
+        ]:
+            with alternate_screen(stream, enabled):
+                stream.write('output')
+            self.assertEqual(stream.getvalue(), 'output')
+
+
+    @patch('rerun.terminal.time.strftime', lambda format, now: '14:02:11')
+    def test_format_status(self):
+        self.assertEqual(
+            format_status(0, 1.5),
+            'rerun: exit status 0, ran 1.50s, at 14:02:11'
+        )
+        self.assertEqual(
+            format_status(-9, 0.25),
+            'rerun: killed by signal 9, ran 0.25s, at 14:02:11'
+        )
+        self.assertEqual(
+            format_status(0, 1.5, color=True),
+            '\x1b[1;32mrerun: exit status 0, ran 1.50s, at 14:02:11\x1b[0m'
+        )
+        self.assertTrue(format_status(2, 1.5, color=True).startswith(
+            '\x1b[1;31m'))
+
+
+    def test_show_status_is_plain_if_not_a_terminal(self):
+        stream = io.StringIO()
+        show_status(stream, 1, 2)
+        self.assertTrue(stream.getvalue().startswith(
+            'rerun: exit status 1, ran 2.00s, at '))
+        self.assertNotIn('\x1b', stream.getvalue())
@@ -0,0 +1,724 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import errno
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import inotify
+from rerun.filestate import FileStateTable
+from rerun.ignore import IgnoreMatcher
+from rerun.watchers import (
+    ContentHashWatcher, file_stat_cache, get_changed_files, get_file_state,
+    get_watcher, has_file_changed, hash_file, HybridWatcher,
+    IncrementalWatcher, InotifyWatcher, PollInterval, PollingWatcher,
+    scan_dir, SKIP_EXT, walk_tree
+)
+
+
+@contextmanager
+def temp_cwd():
+    orig = os.getcwd()
+    tempdir = tempfile.mkdtemp()
+    os.chdir(tempdir)
+    try:
+        yield tempdir
+    finally:
+        os.chdir(orig)
+        shutil.rmtree(tempdir)
+
+
+def fake_stat(mtime_ns=0, size=0, ino=0, ctime_ns=0):
+    return Mock(
+        st_mtime_ns=mtime_ns, st_size=size, st_ino=ino, st_ctime_ns=ctime_ns
+    )
+
+
+def get_matcher(*ignores):
+    return IgnoreMatcher(ignores, SKIP_EXT)
+
+
+def touch(filename):
+    with open(filename, 'w') as fp:
+        fp.write(filename)
+
+
+class Test_Watchers(unittest.TestCase):
+
+    def test_get_file_state(self):
+        filestat = fake_stat(mtime_ns=1, size=2, ino=3, ctime_ns=4)
+        self.assertEqual(get_file_state(filestat), (1, 2, 3, 4))
+
+
+    @patch('rerun.watchers.os.lstat')
+    def test_has_file_changed_return_value(self, mock_lstat):
+        file_stats = [fake_stat(1), fake_stat(1), fake_stat(2), fake_stat(2)]
+        mock_lstat.side_effect = lambda _: file_stats.pop(0)
+
+        self.assertTrue(has_file_changed('filename'))
+        self.assertFalse(has_file_changed('filename'))
+        self.assertTrue(has_file_changed('filename'))
+        self.assertFalse(has_file_changed('filename'))
+
+
+    def test_has_file_changed_sees_subsecond_size_and_inode_changes(self):
+        filestat = fake_stat(mtime_ns=10 ** 9)
+        self.assertTrue(has_file_changed('filename2', filestat))
+        for change in [
+            dict(mtime_ns=10 ** 9 + 1), dict(size=1),
+            dict(ino=1), dict(ctime_ns=1),
+        ]:
+            self.assertTrue(has_file_changed('filename2', fake_stat(**change)))
+            self.assertFalse(
+                has_file_changed('filename2', fake_stat(**change)))
+
+
+    @patch('rerun.watchers.os.lstat')
+    def test_has_file_changed_on_missing_file(self, mock_lstat):
+        mock_lstat.return_value = fake_stat()
+        has_file_changed('filename')
+        mock_lstat.side_effect = FileNotFoundError
+
+        actual = has_file_changed('filename')
+
+        self.assertTrue(actual)
+        self.assertFalse('filename' in file_stat_cache)
+
+
+    def test_hash_file(self):
+        with temp_cwd():
+            touch('a')
+            first = hash_file('a')
+            self.assertEqual(hash_file('a'), first)
+            with open('a', 'w') as fp:
+                fp.write('different')
+            self.assertNotEqual(hash_file('a'), first)
+
+
+    @patch('rerun.watchers.file_stat_cache', FileStateTable(4))
+    @patch('rerun.watchers.has_file_changed')
+    @patch('rerun.watchers.walk_tree')
+    def test_get_changed_files(self, mock_walk_tree, mock_changed):
+        mock_walk_tree.return_value = {'root/s': 1, 'root/f': 2, 'root/x': 3}
+
+        def fake_has_changed(relname, filestat):
+            return relname in ['root/f', 'root/s']
+        mock_changed.side_effect = fake_has_changed
+
+        actual = get_changed_files(['ignores'], 'pool')
+
+        self.assertEqual(
+            mock_walk_tree.call_args, (('.', ['ignores'], 'pool'),)
+        )
+        self.assertEqual(actual, ['root/f', 'root/s'])
+        # has_file_changed must be called for every file, cannot short-circuit
+        # or else it will fail to update some files' modification times,
+        # and generate false positives on later sweeps.
+        self.assertEqual(
+            mock_changed.call_args_list,
+            [(('root/s', 1),), (('root/f', 2),), (('root/x', 3),)]
+        )
+
+
+    def test_get_changed_files_reports_deleted_files(self):
+        with temp_cwd():
+            touch('a')
+            touch('b')
+            matcher = get_matcher()
+            with patch('rerun.watchers.file_stat_cache', FileStateTable(4)):
+                get_changed_files(matcher)
+                os.remove('a')
+                self.assertEqual(
+                    get_changed_files(matcher), [os.path.join('.', 'a')])
+                self.assertEqual(get_changed_files(matcher), [])
+
+
+    def test_scan_dir(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            os.mkdir('skipme')
+            touch('a')
+            touch('skipme2')
+            touch('b' + SKIP_EXT[0])
+
+            files, subdirs = scan_dir('.', get_matcher('skipme', 'skipme2'))
+
+            self.assertEqual(list(files), [os.path.join('.', 'a')])
+            self.assertEqual(
+                files[os.path.join('.', 'a')].st_mtime,
+                os.lstat('a').st_mtime
+            )
+            self.assertEqual(subdirs, [os.path.join('.', 'sub')])
+
+
+    def test_scan_dir_on_missing_dir(self):
+        self.assertEqual(scan_dir('does-not-exist', get_matcher()), ({}, []))
+
+
+    def test_walk_tree_with_and_without_pool(self):
+        with temp_cwd():
+            expected = []
+            for dirname in ['a', 'b', os.path.join('b', 'c'), 'skipme']:
+                os.mkdir(dirname)
+                touch(os.path.join(dirname, 'f'))
+                expected.append(os.path.join('.', dirname, 'f'))
+            expected.remove(os.path.join('.', 'skipme', 'f'))
+
+            sequential = walk_tree('.', get_matcher('skipme'))
+            with ThreadPoolExecutor(4) as pool:
+                concurrent = walk_tree('.', get_matcher('skipme'), pool)
+
+            self.assertEqual(sorted(sequential), sorted(expected))
+            self.assertEqual(sorted(concurrent), sorted(expected))
+
+
+@unittest.skipIf(not inotify.is_available(), 'No inotify.')
+class Test_InotifyWatcher(unittest.TestCase):
+
+    def get_changes(self, watcher):
+        watcher.wait(1)
+        return watcher.get_changed_files()
+
+
+    def test_first_call_reports_all_unignored_files(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            os.mkdir('skipme')
+            touch('a')
+            touch(os.path.join('sub', 'b'))
+            touch(os.path.join('skipme', 'c'))
+            touch('d' + SKIP_EXT[0])
+            touch('z')
+            watcher = InotifyWatcher(get_matcher('skipme'))
+            try:
+                self.assertEqual(watcher.get_changed_files(), [
+                    os.path.join('.', 'a'),
+                    os.path.join('.', 'sub', 'b'),
+                    os.path.join('.', 'z'),
+                ])
+                self.assertEqual(watcher.get_changed_files(), [])
+            finally:
+                watcher.close()
+
+
+    def test_reports_modified_and_new_files(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            touch('a')
+            watcher = InotifyWatcher(get_matcher())
+            try:
+                watcher.get_changed_files()
+                touch('a')
+                touch(os.path.join('sub', 'b'))
+                self.assertEqual(
+                    self.get_changes(watcher),
+                    [os.path.join('.', 'a'), os.path.join('.', 'sub', 'b')]
+                )
+            finally:
+                watcher.close()
+
+
+    def test_watches_new_subdirs(self):
+        with temp_cwd():
+            watcher = InotifyWatcher(get_matcher('skipme'))
+            try:
+                watcher.get_changed_files()
+                os.mkdir('new')
+                os.mkdir('skipme')
+                self.get_changes(watcher)
+                touch(os.path.join('new', 'a'))
+                touch(os.path.join('skipme', 'b'))
+                self.assertEqual(
+                    self.get_changes(watcher),
+                    [os.path.join('.', 'new', 'a')]
+                )
+            finally:
+                watcher.close()
+
+
+    def test_reports_the_files_of_renamed_dirs(self):
+        with temp_cwd():
+            os.makedirs(os.path.join('old', 'sub'))
+            touch(os.path.join('old', 'a'))
+            touch(os.path.join('old', 'sub', 'b'))
+            watcher = InotifyWatcher(get_matcher())
+            try:
+                watcher.get_changed_files()
+                os.rename('old', 'new')
+                self.assertEqual(self.get_changes(watcher), [
+                    os.path.join('.', 'new', 'a'),
+                    os.path.join('.', 'new', 'sub', 'b'),
+                    os.path.join('.', 'old', 'a'),
+                    os.path.join('.', 'old', 'sub', 'b'),
+                ])
+                touch(os.path.join('new', 'sub', 'c'))
+                self.assertEqual(
+                    self.get_changes(watcher),
+                    [os.path.join('.', 'new', 'sub', 'c')]
+                )
+                self.assertEqual(watcher.cache_size(), 3)
+            finally:
+                watcher.close()
+
+
+    @patch('rerun.watchers.sys.stderr', Mock())
+    @patch('rerun.watchers.file_stat_cache', FileStateTable(4))
+    def test_falls_back_without_reporting_every_file(self):
+        with temp_cwd():
+            os.mkdir('d1')
+            os.mkdir('d2')
+            touch('top')
+            touch(os.path.join('d1', 'a'))
+            touch(os.path.join('d2', 'b'))
+            watcher = InotifyWatcher(get_matcher())
+            try:
+                watcher.get_changed_files()
+                with patch.object(
+                    watcher.inotify, 'add_watch',
+                    Mock(side_effect=OSError(errno.ENOSPC, 'injected'))
+                ):
+                    os.mkdir('d3')
+                    touch(os.path.join('d3', 'c'))
+                    self.assertEqual(
+                        self.get_changes(watcher),
+                        [os.path.join('.', 'd3', 'c')]
+                    )
+                self.assertIsInstance(watcher.fallback, PollingWatcher)
+                os.remove(os.path.join('d1', 'a'))
+                self.assertEqual(
+                    watcher.get_changed_files(),
+                    [os.path.join('.', 'd1', 'a')]
+                )
+            finally:
+                watcher.close()
+
+
+    def test_ignores_ignorable_files(self):
+        with temp_cwd():
+            watcher = InotifyWatcher(get_matcher('ignored'))
+            try:
+                watcher.get_changed_files()
+                touch('ignored')
+                touch('a' + SKIP_EXT[0])
+                self.assertEqual(self.get_changes(watcher), [])
+            finally:
+                watcher.close()
+
+
+@unittest.skipIf(not inotify.is_available(), 'No inotify.')
+class Test_HybridWatcher(unittest.TestCase):
+
+    def get_watcher(self, max_watches=10):
+        watcher = HybridWatcher(get_matcher('skipme'), 0, max_watches)
+        self.addCleanup(watcher.close)
+        return watcher
+
+
+    def sweep(self, watcher):
+        watcher.next_sweep = 0
+        return watcher.get_changed_files()
+
+
+    def get_events(self, watcher):
+        # Changes seen by watches alone, without a sweep.
+        watcher.next_sweep = float('inf')
+        watcher.wait(1)
+        return watcher.get_changed_files()
+
+
+    def test_first_call_reports_all_unignored_files(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            os.mkdir('skipme')
+            touch('a')
+            touch(os.path.join('sub', 'b'))
+            touch(os.path.join('skipme', 'c'))
+            watcher = self.get_watcher()
+            self.assertEqual(
+                sorted(watcher.get_changed_files()),
+                [os.path.join('.', 'a'), os.path.join('.', 'sub', 'b')]
+            )
+            self.assertEqual(watcher.get_changed_files(), [])
+            self.assertEqual(list(watcher.hot), [])
+
+
+    def test_watches_dirs_where_sweeps_find_changes(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            watcher = self.get_watcher()
+            watcher.get_changed_files()
+            touch(os.path.join('sub', 'a'))
+            self.assertEqual(
+                self.sweep(watcher), [os.path.join('.', 'sub', 'a')])
+            self.assertEqual(list(watcher.hot), [os.path.join('.', 'sub')])
+
+            touch(os.path.join('sub', 'a'))
+            touch(os.path.join('sub', 'b'))
+            self.assertEqual(
+                self.get_events(watcher),
+                [os.path.join('.', 'sub', 'a'), os.path.join('.', 'sub', 'b')]
+            )
+            # Already reported, so the next sweep doesn't repeat them.
+            self.assertEqual(self.sweep(watcher), [])
+
+
+    def test_watches_only_the_most_recently_changed_dirs(self):
+        with temp_cwd():
+            for name in ['one', 'two', 'three']:
+                os.mkdir(name)
+            watcher = self.get_watcher(max_watches=2)
+            watcher.get_changed_files()
+            for name in ['one', 'two', 'three']:
+                touch(os.path.join(name, 'a'))
+                self.sweep(watcher)
+            self.assertEqual(
+                list(watcher.hot),
+                [os.path.join('.', 'two'), os.path.join('.', 'three')]
+            )
+            self.assertEqual(len(watcher.roots), 2)
+
+            touch(os.path.join('one', 'a'))
+            self.assertEqual(self.get_events(watcher), [])
+            self.assertEqual(
+                self.sweep(watcher), [os.path.join('.', 'one', 'a')])
+
+
+    def test_reports_new_and_deleted_subdirs_of_watched_dirs(self):
+        with temp_cwd():
+            os.mkdir('gone')
+            touch(os.path.join('gone', 'a'))
+            watcher = self.get_watcher()
+            watcher.get_changed_files()
+            touch('b')
+            self.sweep(watcher)
+
+            shutil.rmtree('gone')
+            os.mkdir('new')
+            touch(os.path.join('new', 'c'))
+            self.assertEqual(
+                self.get_events(watcher),
+                [os.path.join('.', 'gone', 'a'), os.path.join('.', 'new', 'c')]
+            )
+            self.assertIn(os.path.join('.', 'new'), watcher.hot)
+            self.assertEqual(self.sweep(watcher), [])
+
+
+    @patch('rerun.watchers.sys.stderr')
+    def test_makes_do_when_out_of_watches(self, mock_stderr):
+        with temp_cwd():
+            os.mkdir('sub')
+            watcher = self.get_watcher()
+            watcher.get_changed_files()
+            touch('a')
+            self.sweep(watcher)
+            with patch.object(
+                watcher.inotify, 'add_watch',
+                Mock(side_effect=OSError(errno.ENOSPC, 'injected'))
+            ):
+                touch(os.path.join('sub', 'b'))
+                self.sweep(watcher)
+            self.assertEqual(list(watcher.hot), ['.'])
+            self.assertEqual(watcher.max_watches, 1)
+            self.assertTrue(mock_stderr.write.called)
+
+            touch(os.path.join('sub', 'b'))
+            self.assertEqual(
+                self.sweep(watcher), [os.path.join('.', 'sub', 'b')])
+            self.assertEqual(list(watcher.hot), [os.path.join('.', 'sub')])
+
+
+class Test_PollInterval(unittest.TestCase):
+
+    def test_backs_off_while_idle_and_tightens_after_a_change(self):
+        interval = PollInterval(0.1, 1.0)
+        self.assertEqual(interval.current, 0.1)
+        currents = []
+        for changed in [[], [], [], [], [], ['a'], []]:
+            interval.update(0.001, changed)
+            currents.append(interval.current)
+        self.assertEqual(currents, [0.2, 0.4, 0.8, 1.0, 1.0, 0.1, 0.2])
+
+
+    def test_allows_for_slow_sweeps(self):
+        interval = PollInterval(0.1, 10)
+        interval.update(0.5, ['a'])
+        self.assertEqual(interval.current, 0.5 * PollInterval.COST_FACTOR)
+        interval.update(5, ['a'])
+        self.assertEqual(interval.current, 10)
+
+
+    def test_max_is_at_least_min(self):
+        interval = PollInterval(2, 1)
+        interval.update(0, [])
+        self.assertEqual(interval.current, 2)
+
+
+    @patch('rerun.watchers.time.sleep')
+    def test_sleep(self, mock_sleep):
+        interval = PollInterval(0.5, 1.0)
+        interval.sleep()
+        interval.sleep(0.1)
+        interval.sleep(3)
+        self.assertEqual(
+            [args[0][0] for args in mock_sleep.call_args_list],
+            [0.5, 0.1, 0.5]
+        )
+
+
+    @patch('rerun.watchers.get_changed_files', Mock(return_value=[]))
+    def test_polling_watcher_updates_its_interval(self):
+        interval = Mock()
+        watcher = PollingWatcher(get_matcher(), interval=interval)
+        watcher.get_changed_files()
+        watcher.wait()
+        self.assertEqual(interval.update.call_args[0][1], [])
+        self.assertEqual(interval.sleep.call_args, ((None,),))
+
+
+class Test_GetWatcher(unittest.TestCase):
+
+    def get_options(self, watcher):
+        return Mock(
+            watcher=watcher, ignore=['ignores'], stat_interval=5,
+            walk_threads=1, gitignore=False, content_hash=False,
+            min_interval=0.5, max_interval=4.0, max_watches=10, shared=False,
+        )
+
+
+    def test_get_watcher_incremental(self):
+        watcher = get_watcher(self.get_options('incremental'))
+        self.assertIsInstance(watcher, IncrementalWatcher)
+        self.assertTrue(watcher.matcher.ignores_file('ignores'))
+        self.assertEqual(watcher.stat_interval, 5)
+        self.assertEqual(watcher.interval.min_interval, 0.5)
+        self.assertEqual(watcher.interval.max_interval, 4.0)
+
+
+    @patch('rerun.watchers.InotifyWatcher')
+    def test_get_watcher_poll(self, mock_inotify_watcher):
+        watcher = get_watcher(self.get_options('poll'))
+        self.assertIsInstance(watcher, PollingWatcher)
+        self.assertTrue(watcher.matcher.ignores_file('ignores'))
+        self.assertIsNone(watcher.pool)
+        self.assertFalse(mock_inotify_watcher.called)
+
+
+    def test_get_watcher_poll_with_threads(self):
+        options = self.get_options('poll')
+        options.walk_threads = 3
+        watcher = get_watcher(options)
+        try:
+            self.assertEqual(watcher.pool._max_workers, 3)
+        finally:
+            watcher.close()
+
+
+    def test_get_watcher_content_hash(self):
+        options = self.get_options('poll')
+        options.content_hash = True
+        watcher = get_watcher(options)
+        self.assertIsInstance(watcher, ContentHashWatcher)
+        self.assertIsInstance(watcher.watcher, PollingWatcher)
+
+
+    @patch('rerun.watchers.inotify.is_available', Mock(return_value=True))
+    @patch('rerun.watchers.InotifyWatcher')
+    def test_get_watcher_auto_prefers_inotify(self, mock_inotify_watcher):
+        watcher = get_watcher(self.get_options('auto'))
+        self.assertIs(watcher, mock_inotify_watcher.return_value)
+        matcher = mock_inotify_watcher.call_args[0][0]
+        self.assertTrue(matcher.ignores_file('ignores'))
+
+
+    @patch('rerun.watchers.inotify.is_available', Mock(return_value=False))
+    @patch('rerun.watchers.InotifyWatcher')
+    def test_get_watcher_auto_without_inotify(self, mock_inotify_watcher):
+        watcher = get_watcher(self.get_options('auto'))
+        self.assertIsInstance(watcher, PollingWatcher)
+        self.assertFalse(mock_inotify_watcher.called)
+
+
+    @patch('rerun.watchers.inotify.is_available', Mock(return_value=True))
+    @patch('rerun.watchers.InotifyWatcher')
+    @patch('rerun.watchers.HybridWatcher')
+    def test_get_watcher_auto_when_out_of_watches(
+        self, mock_hybrid_watcher, mock_inotify_watcher
+    ):
+        mock_inotify_watcher.side_effect = OSError(errno.ENOSPC, 'injected')
+        watcher = get_watcher(self.get_options('auto'))
+        self.assertIs(watcher, mock_hybrid_watcher.return_value)
+        self.assertEqual(mock_hybrid_watcher.call_args[0][1:3], (5, 10))
+
+
+    @patch('rerun.watchers.inotify.is_available', Mock(return_value=True))
+    @patch('rerun.watchers.InotifyWatcher')
+    @patch('rerun.watchers.HybridWatcher')
+    def test_get_watcher_auto_when_out_of_all_watches(
+        self, mock_hybrid_watcher, mock_inotify_watcher
+    ):
+        mock_inotify_watcher.side_effect = OSError(errno.ENOSPC, 'injected')
+        mock_hybrid_watcher.side_effect = OSError(errno.EMFILE, 'injected')
+        watcher = get_watcher(self.get_options('auto'))
+        self.assertIsInstance(watcher, PollingWatcher)
+
+
+    @patch('rerun.watchers.InotifyWatcher')
+    @patch('rerun.watchers.HybridWatcher')
+    def test_get_watcher_inotify_when_out_of_watches(
+        self, mock_hybrid_watcher, mock_inotify_watcher
+    ):
+        mock_inotify_watcher.side_effect = OSError(errno.ENOSPC, 'injected')
+        watcher = get_watcher(self.get_options('inotify'))
+        self.assertIs(watcher, mock_hybrid_watcher.return_value)
+        mock_inotify_watcher.side_effect = OSError(errno.EMFILE, 'injected')
+        with self.assertRaises(OSError):
+            get_watcher(self.get_options('inotify'))
+
+
+    @patch('rerun.watchers.HybridWatcher')
+    def test_get_watcher_hybrid(self, mock_hybrid_watcher):
+        watcher = get_watcher(self.get_options('hybrid'))
+        self.assertIs(watcher, mock_hybrid_watcher.return_value)
+        matcher, stat_interval, max_watches, interval = \
+            mock_hybrid_watcher.call_args[0]
+        self.assertTrue(matcher.ignores_file('ignores'))
+        self.assertEqual((stat_interval, max_watches), (5, 10))
+        self.assertEqual(interval.max_interval, 4.0)
+
+
+class Test_ContentHashWatcher(unittest.TestCase):
+
+    def test_drops_files_whose_contents_are_unchanged(self):
+        with temp_cwd():
+            touch('a')
+            touch('b')
+            backend = Mock(matcher='matcher')
+            backend.get_changed_files.return_value = ['a', 'b']
+            watcher = ContentHashWatcher(backend)
+            self.assertEqual(watcher.matcher, 'matcher')
+            self.assertEqual(watcher.get_changed_files(), ['a', 'b'])
+
+            with open('b', 'w') as fp:
+                fp.write('different')
+
+            self.assertEqual(watcher.get_changed_files(), ['b'])
+
+
+    def test_reports_deleted_files(self):
+        with temp_cwd():
+            touch('a')
+            backend = Mock()
+            backend.get_changed_files.return_value = ['a']
+            watcher = ContentHashWatcher(backend)
+            watcher.get_changed_files()
+            os.remove('a')
+
+            self.assertEqual(watcher.get_changed_files(), ['a'])
+            self.assertFalse('a' in watcher.hashes)
+
+
+    def test_delegates_wait_and_close(self):
+        backend = Mock()
+        watcher = ContentHashWatcher(backend)
+        watcher.wait(3)
+        watcher.close()
+        self.assertEqual(backend.wait.call_args, ((3,),))
+        self.assertTrue(backend.close.called)
+
+
+class Test_IncrementalWatcher(unittest.TestCase):
+
+    def age(self, path, seconds=10):
+        '''
+        Backdate path's mtime, so the watcher trusts it not to be racy.
+        '''
+        then = os.lstat(path).st_mtime - seconds
+        os.utime(path, (then, then))
+
+
+    def test_first_call_reports_all_unignored_files(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            os.mkdir('skipme')
+            touch('a')
+            touch(os.path.join('sub', 'b'))
+            touch(os.path.join('skipme', 'c'))
+            touch('d' + SKIP_EXT[0])
+            watcher = IncrementalWatcher(get_matcher('skipme'), 0)
+            self.assertEqual(
+                watcher.get_changed_files(),
+                [os.path.join('.', 'a'), os.path.join('.', 'sub', 'b')]
+            )
+            self.assertEqual(watcher.get_changed_files(), [])
+
+
+    def test_reports_created_and_deleted_files(self):
+        with temp_cwd():
+            touch('a')
+            watcher = IncrementalWatcher(get_matcher(), 0)
+            watcher.get_changed_files()
+            os.remove('a')
+            touch('b')
+            self.assertEqual(
+                watcher.get_changed_files(),
+                [os.path.join('.', 'a'), os.path.join('.', 'b')]
+            )
+
+
+    def test_reports_files_in_deleted_dirs(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            touch(os.path.join('sub', 'a'))
+            watcher = IncrementalWatcher(get_matcher(), 0)
+            watcher.get_changed_files()
+            shutil.rmtree('sub')
+            self.assertEqual(
+                watcher.get_changed_files(), [os.path.join('.', 'sub', 'a')]
+            )
+            self.assertEqual(watcher.dirs.keys(), set(['.']))
+
+
+    def test_only_lists_dirs_whose_mtime_changed(self):
+        with temp_cwd():
+            os.mkdir('sub')
+            touch(os.path.join('sub', 'a'))
+            self.age('sub')
+            self.age('.')
+            watcher = IncrementalWatcher(get_matcher(), 0)
+            watcher.get_changed_files()
+            with patch('rerun.watchers.scan_dir') as mock_scan_dir:
+                self.assertEqual(watcher.get_changed_files(), [])
+            self.assertFalse(mock_scan_dir.called)
+
+
+    def test_in_place_edits_seen_only_on_restat(self):
+        with temp_cwd():
+            touch('a')
+            self.age('a')
+            self.age('.')
+            watcher = IncrementalWatcher(get_matcher(), 60)
+            watcher.get_changed_files()
+            touch('a')
+            self.assertEqual(watcher.get_changed_files(), [])
+            watcher.last_stat -= 60
+            self.assertEqual(
+                watcher.get_changed_files(), [os.path.join('.', 'a')]
+            )
+
+
+    def test_stat_interval_zero_never_restats(self):
+        with temp_cwd():
+            touch('a')
+            self.age('a')
+            self.age('.')
+            watcher = IncrementalWatcher(get_matcher(), 0)
+            watcher.get_changed_files()
+            touch('a')
+            self.assertEqual(watcher.get_changed_files(), [])
+            self.assertIsNone(watcher.last_stat)
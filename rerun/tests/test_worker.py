@@ -0,0 +1,217 @@
+import asyncio
+import os
+import shlex
+import sys
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import Mock, patch
+
+from rerun import worker_process
+from rerun.deps import ImportGraph
+from rerun.rerun import is_group_alive
+from rerun.tests.test_aio import run
+from rerun.tests.test_rerun import get_options
+from rerun.tests.test_watchers import temp_cwd
+from rerun.worker import (
+    get_preload, parse_command, PythonWorker, read_shebang, WorkerError,
+)
+
+
+PYTHON = shlex.quote(sys.executable)
+
+
+def write(filename, text):
+    with open(filename, 'w') as fp:
+        fp.write(text)
+
+
+class Test_ParseCommand(unittest.TestCase):
+
+    @patch('rerun.worker.shutil.which', lambda name: '/bin/' + name)
+    def test_parse_command(self):
+        self.assertEqual(
+            parse_command('python3 -m pytest -x "a b"'),
+            ('/bin/python3', 'module', 'pytest', ['-x', 'a b'])
+        )
+        self.assertEqual(
+            parse_command('python script.py arg'),
+            ('/bin/python', 'path', 'script.py', ['arg'])
+        )
+
+
+    def test_parse_command_for_installed_script(self):
+        with temp_cwd() as tempdir:
+            write('myscript', '#!/usr/bin/env python3\nimport sys\n')
+            script = os.path.join(tempdir, 'myscript')
+            which = {'myscript': script, 'python3': '/bin/python3'}.get
+            with patch('rerun.worker.shutil.which', which):
+                self.assertEqual(
+                    parse_command('myscript -v'),
+                    ('/bin/python3', 'path', script, ['-v'])
+                )
+
+
+    def test_parse_command_rejects_other_commands(self):
+        with temp_cwd():
+            write('shellscript', '#!/bin/sh\n')
+            for command in [
+                '', 'make test', './shellscript', 'python', 'python -c 1',
+            ]:
+                with patch(
+                    'rerun.worker.shutil.which', lambda name: name
+                ):
+                    with self.assertRaises(WorkerError):
+                        parse_command(command)
+
+
+    def test_read_shebang(self):
+        with temp_cwd():
+            write('a', '#!/usr/bin/python3 -E\n')
+            write('b', '#! /usr/bin/env python\n')
+            write('c', 'import sys\n')
+            self.assertEqual(read_shebang('a'), '/usr/bin/python3')
+            self.assertEqual(read_shebang('b'), 'python')
+            self.assertIsNone(read_shebang('c'))
+            self.assertIsNone(read_shebang('missing'))
+
+
+class Test_GetPreload(unittest.TestCase):
+
+    def test_get_preload(self):
+        with temp_cwd():
+            write('mod.py', 'import json, numpy\n')
+            write('test_mod.py', 'import mod\nimport unittest\n')
+            write('script.py', 'import mod, argparse\n')
+            graph = ImportGraph()
+            graph.update(['mod.py', 'test_mod.py'])
+            with patch('rerun.worker.get_graph', Mock(return_value=graph)):
+                self.assertEqual(
+                    get_preload('module', 'pytest', get_options()),
+                    ['json', 'numpy', 'pytest', 'unittest']
+                )
+                self.assertEqual(
+                    get_preload('path', 'script.py', get_options()),
+                    ['argparse', 'json', 'numpy', 'unittest']
+                )
+                self.assertNotIn(
+                    'mod', get_preload('module', 'mod', get_options()))
+
+
+class Test_WorkerProcess(unittest.TestCase):
+
+    def test_get_exit_code(self):
+        self.assertEqual(worker_process.get_exit_code(SystemExit()), 0)
+        self.assertEqual(worker_process.get_exit_code(SystemExit(3)), 3)
+        with patch('sys.stderr') as mock_stderr:
+            self.assertEqual(worker_process.get_exit_code(SystemExit('no')), 1)
+        self.assertEqual(mock_stderr.write.call_args[0][0], 'no\n')
+
+
+    def test_run_asks_for_restart_if_an_imported_file_changed(self):
+        reply = Mock()
+        self.assertFalse(worker_process.run(
+            dict(run=['module', 'x', []], changed=[os.__file__]), reply))
+        self.assertEqual(
+            reply.call_args[1], dict(restart=[os.path.abspath(os.__file__)]))
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), 'No fork.')
+class Test_PythonWorker(unittest.TestCase):
+
+    def test_runs_commands_in_forks_of_one_worker(self):
+        with temp_cwd():
+            write('prog.py', 'import sys, mod\nsys.exit(mod.CODE)\n')
+            write('mod.py', 'CODE = 3\n')
+            worker = PythonWorker(get_options(ignore=[], gitignore=False))
+
+            async def run_twice():
+                try:
+                    first = await worker.run(PYTHON + ' prog.py', [])
+                    pid = worker.process.pid
+                    write('mod.py', 'CODE = 4\n')
+                    second = await worker.run(PYTHON + ' prog.py', ['mod.py'])
+                    return first, second, worker.process.pid == pid
+                finally:
+                    await worker.close()
+
+            with patch('rerun.deps.graph', None):
+                self.assertEqual(run(run_twice(), 30), (3, 4, True))
+            self.assertIsNone(worker.process)
+
+
+    def test_runs_commands_with_the_given_variables(self):
+        with temp_cwd():
+            write('prog.py', (
+                'import os, sys\n'
+                'sys.exit(len(os.environ["RERUN_CHANGED_FILES"]))\n'
+            ))
+            worker = PythonWorker(get_options(ignore=[], gitignore=False))
+
+            async def run_once():
+                try:
+                    return await worker.run(
+                        PYTHON + ' prog.py', [],
+                        dict(RERUN_CHANGED_FILES='a\nbc'))
+                finally:
+                    await worker.close()
+
+            with patch('rerun.deps.graph', None):
+                self.assertEqual(run(run_once(), 30), 4)
+            self.assertNotIn('RERUN_CHANGED_FILES', os.environ)
+
+
+    def test_cancelling_stops_the_command(self):
+        with temp_cwd():
+            # Renamed into place, so that it's never seen half written.
+            write('prog.py', (
+                'import os, time\n'
+                'open("pid.tmp", "w").write(str(os.getpid()))\n'
+                'os.replace("pid.tmp", "pid")\n'
+                'time.sleep(30)\n'
+            ))
+            worker = PythonWorker(get_options(ignore=[], gitignore=False))
+
+            async def cancel_soon():
+                task = asyncio.ensure_future(
+                    worker.run(PYTHON + ' prog.py', []))
+                while not os.path.exists('pid'):
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                await worker.close()
+
+            start = time.time()
+            with patch('rerun.deps.graph', None):
+                run(cancel_soon(), 30)
+            self.assertLess(time.time() - start, 10)
+            with open('pid') as fp:
+                self.assertFalse(is_group_alive(int(fp.read())))
+
+
+    def test_cancelling_while_preloading_starts_a_fresh_worker(self):
+        with temp_cwd():
+            write('slow.py', 'import time\ntime.sleep(1.5)\n')
+            write('prog.py', 'import sys\nsys.exit(3)\n')
+            worker = PythonWorker(get_options(ignore=[], gitignore=False))
+
+            async def cancel_then_run():
+                try:
+                    with self.assertRaises(asyncio.TimeoutError):
+                        await asyncio.wait_for(
+                            worker.run(PYTHON + ' prog.py', []), 0.5)
+                    self.assertIsNone(worker.process)
+                    return await worker.run(PYTHON + ' prog.py', [])
+                finally:
+                    await worker.close()
+
+            with patch('rerun.worker.get_preload', Mock(
+                return_value=['slow'])), \
+                    patch.dict(os.environ, PYTHONPATH=os.getcwd()):
+                self.assertEqual(run(cancel_then_run(), 30), 3)
@@ -0,0 +1,711 @@
+'''
+Backends which find files that have changed since they were last asked.
+'''
+from collections import OrderedDict
+import errno
+import os
+import sys
+import time
+
+from . import inotify, stats
+from .filestate import FileStateTable
+from .ignore import get_matcher
+
+
+SKIP_DIRS = [
+    '.bzr', '.cache', '.git', '.hg', '.pytest_cache', '.svn',
+    '__pycache__', 'build', 'dist', 'node_modules',
+]
+SKIP_EXT = ['.pyc', '.pyo']
+
+HASH_CHUNK = 1024 * 1024
+
+
+def get_file_state(filestat):
+    '''
+    Returns the parts of a file's lstat which tell us it has changed. The
+    nanosecond mtime catches repeated saves within one second, the size
+    catches tools which restore mtimes, and the inode and ctime catch editors
+    which save by renaming a new file over the old one.
+    '''
+    return (
+        filestat.st_mtime_ns, filestat.st_size,
+        filestat.st_ino, filestat.st_ctime_ns,
+    )
+
+
+file_stat_cache = FileStateTable(4)
+
+def has_file_changed(filename, filestat=None):
+    '''
+    Has the given file changed since last invocation? Pass filestat if it is
+    already known, to save stat'ing the file again.
+    '''
+    try:
+        if filestat is None:
+            filestat = os.lstat(filename)
+    except FileNotFoundError:
+        file_stat_cache.discard(filename)
+        return True
+
+    state = get_file_state(filestat)
+    if file_stat_cache.get(filename) != state:
+        file_stat_cache.set(filename, state)
+        return True
+    return False
+
+
+def hash_file(filename):
+    '''
+    Returns a 64-bit hash of the file's contents, as a signed int.
+    '''
+    import hashlib
+    digest = hashlib.blake2b(digest_size=8)
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return int.from_bytes(digest.digest(), 'little', signed=True)
+
+
+def scan_dir(root, matcher):
+    '''
+    Lists the given directory, returning ({filename: lstat}, [subdirs]),
+    excluding anything ignorable. The file types come for free from scandir,
+    so only files get stat'ed.
+    '''
+    files = {}
+    subdirs = []
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        # Directory vanished or is unreadable.
+        return files, subdirs
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not matcher.ignores_dir(entry.path):
+                    subdirs.append(entry.path)
+            elif not matcher.ignores_file(entry.path):
+                files[entry.path] = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+    sweep = stats.current
+    if sweep is not None:
+        sweep.add(dirs=1, files=len(files), stat_calls=len(files))
+    return files, subdirs
+
+
+def walk_tree(top, matcher, pool=None):
+    '''
+    Returns {filename: lstat} for every unignored file under top. If given a
+    thread pool, directories are listed concurrently, so that on network
+    filesystems we aren't waiting on one round-trip at a time.
+    '''
+    found = {}
+    if pool is None:
+        stack = [top]
+        while stack:
+            files, subdirs = scan_dir(stack.pop(), matcher)
+            found.update(files)
+            stack.extend(subdirs)
+        return found
+
+    from concurrent.futures import FIRST_COMPLETED, wait
+    pending = set([pool.submit(scan_dir, top, matcher)])
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, subdirs = future.result()
+            found.update(files)
+            pending.update(
+                pool.submit(scan_dir, subdir, matcher)
+                for subdir in subdirs
+            )
+    return found
+
+
+def get_changed_files(matcher, pool=None):
+    '''
+    Walks subdirs of cwd, looking for files which have changed since last
+    invocation, including those which have been deleted. Returns them sorted,
+    however the tree was walked.
+    '''
+    sweep = stats.current
+    start = time.perf_counter()
+    files = walk_tree('.', matcher, pool)
+    walked = time.perf_counter()
+    changed = [
+        relname
+        for relname, filestat in files.items()
+        if has_file_changed(relname, filestat)
+    ]
+    # Every file found is now in the cache, so anything more was deleted.
+    if len(file_stat_cache) > len(files):
+        deleted = [
+            relname for relname in file_stat_cache if relname not in files]
+        for relname in deleted:
+            file_stat_cache.discard(relname)
+        changed.extend(deleted)
+    changed.sort()
+    if sweep is not None:
+        sweep.add(
+            walk_seconds=walked - start,
+            compare_seconds=time.perf_counter() - walked,
+        )
+    return changed
+
+
+class PollInterval(object):
+    '''
+    How long a polling watcher sleeps between sweeps. After a sweep finds
+    changes, that's min_interval, so that follow-up changes, such as the rest
+    of a 'git checkout', are seen promptly. Each sweep which finds nothing
+    doubles it, up to max_interval, so an idle rerun wakes up rarely. It is
+    also never less than COST_FACTOR times as long as the last sweep took, so
+    that polling a big tree doesn't keep a CPU busy, though max_interval still
+    has the last word.
+    '''
+    COST_FACTOR = 4
+
+    def __init__(self, min_interval=0.2, max_interval=1.0):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = min_interval
+        self.current = min_interval
+
+    def update(self, sweep_seconds, changed):
+        if changed:
+            self.backoff = self.min_interval
+        else:
+            self.backoff = min(self.backoff * 2, self.max_interval)
+        self.current = min(
+            max(self.backoff, sweep_seconds * self.COST_FACTOR),
+            self.max_interval
+        )
+
+    def sleep(self, timeout=None):
+        if timeout is None or timeout > self.current:
+            timeout = self.current
+        time.sleep(timeout)
+
+
+class PollingWatcher(object):
+    '''
+    Walks the whole tree on every call, comparing file modification times to
+    those seen on the previous call. Works everywhere, including network
+    filesystems and VM shared folders, which don't generate inotify events.
+    '''
+    def __init__(self, matcher, walk_threads=1, interval=None):
+        self.matcher = matcher
+        self.interval = interval or PollInterval()
+        self.pool = None
+        if walk_threads > 1:
+            # Imported here, because it takes longer than the rest of rerun's
+            # startup, and most runs don't use it.
+            from concurrent.futures import ThreadPoolExecutor
+            self.pool = ThreadPoolExecutor(walk_threads)
+
+    def get_changed_files(self):
+        start = time.time()
+        changed = get_changed_files(self.matcher, self.pool)
+        self.interval.update(time.time() - start, changed)
+        return changed
+
+    def cache_size(self):
+        return len(file_stat_cache)
+
+    def wait(self, timeout=None):
+        self.interval.sleep(timeout)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+
+
+class IncrementalWatcher(object):
+    '''
+    Polls without stat'ing every file on every call. Each directory's listing
+    is cached, and only re-read when the directory's own mtime changes, which
+    happens whenever entries are created, deleted or renamed within it.
+
+    Files modified in place don't change their directory's mtime, so files in
+    unchanged directories are re-stat'ed every 'stat_interval' seconds, or
+    never if that is 0. Between those, a poll costs one stat per directory.
+
+    Directory mtimes have coarse granularity, so an entry created just after
+    we list a directory might not change its mtime. Hence directories modified
+    within the last RACY_SECONDS are always re-listed.
+    '''
+    RACY_SECONDS = 1
+    def __init__(self, matcher, stat_interval, interval=None):
+        self.matcher = matcher
+        self.stat_interval = stat_interval
+        self.interval = interval or PollInterval()
+        self.last_stat = None
+        # relative dir path -> (dir mtime, {file path: state}, [subdir paths])
+        self.dirs = {}
+
+    def _restat_files(self, files, changed):
+        sweep = stats.current
+        if sweep is not None:
+            sweep.add(files=len(files), stat_calls=len(files))
+        for relname, state in list(files.items()):
+            try:
+                new_state = get_file_state(os.lstat(relname))
+            except OSError:
+                del files[relname]
+                changed.append(relname)
+                continue
+            if new_state != state:
+                files[relname] = new_state
+                changed.append(relname)
+
+    def list_dir(self, root, dir_mtime, now, changed):
+        '''
+        Lists the directory, adding files which differ from its cached
+        listing to changed, and caches the new listing. Returns its subdirs.
+        '''
+        cached = self.dirs.get(root)
+        files, subdirs = scan_dir(root, self.matcher)
+        files = dict(
+            (relname, get_file_state(filestat))
+            for relname, filestat in files.items()
+        )
+        old_files = cached[1] if cached else {}
+        changed.extend(
+            relname for relname, state in files.items()
+            if old_files.get(relname) != state
+        )
+        changed.extend(set(old_files) - set(files))
+        racy = (
+            dir_mtime is not None and
+            now - dir_mtime / 1e9 < self.RACY_SECONDS
+        )
+        if racy:
+            dir_mtime = None
+        self.dirs[root] = (dir_mtime, files, subdirs)
+        return subdirs
+
+    def forget_dir(self, root, changed):
+        '''
+        Drops the cached listings of a deleted directory and its subdirs,
+        adding the files they had to changed.
+        '''
+        cached = self.dirs.pop(root, None)
+        if cached is not None:
+            changed.extend(cached[1])
+            for subdir in cached[2]:
+                self.forget_dir(subdir, changed)
+
+    def get_changed_files(self):
+        now = time.time()
+        restat = bool(self.stat_interval) and (
+            self.last_stat is None or
+            now - self.last_stat >= self.stat_interval
+        )
+        if restat:
+            self.last_stat = now
+
+        sweep = stats.current
+        changed = []
+        seen = set()
+        stack = ['.']
+        while stack:
+            root = stack.pop()
+            try:
+                dir_mtime = os.lstat(root).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(root)
+            if sweep is not None:
+                sweep.add(stat_calls=1)
+            cached = self.dirs.get(root)
+            if cached is None or cached[0] != dir_mtime:
+                subdirs = self.list_dir(root, dir_mtime, now, changed)
+            else:
+                _, files, subdirs = cached
+                if sweep is not None:
+                    sweep.add(dirs=1)
+                if restat:
+                    self._restat_files(files, changed)
+            stack.extend(subdirs)
+
+        for root in set(self.dirs) - seen:
+            changed.extend(self.dirs.pop(root)[1])
+        self.interval.update(time.time() - now, changed)
+        if sweep is not None:
+            sweep.add(walk_seconds=time.time() - now)
+        return sorted(changed)
+
+    def cache_size(self):
+        return sum(len(files) for _, files, _ in self.dirs.values())
+
+    def wait(self, timeout=None):
+        self.interval.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    '''
+    Puts an inotify watch on every directory in the tree, so that changes are
+    reported by the kernel rather than found by walking the tree. The first
+    call reports every file, like the first call to PollingWatcher does. The
+    names of the files in each watched directory are kept, so that when a
+    directory is moved away, the files which were in it can be reported.
+
+    If the kernel runs out of watches, we fall back to the watcher returned
+    by calling 'fallback', or to polling every 'interval'. The fallback's first
+    call, which reports every file, is thrown away, so that only files which
+    really changed are reported.
+    '''
+    # With no timeout, how long to wait for events before returning anyway,
+    # so that callers are never stuck waiting.
+    WAIT = 0.2
+
+    def __init__(self, matcher, interval=None, fallback=None):
+        self.matcher = matcher
+        self.interval = interval
+        self.get_fallback = fallback or (
+            lambda: PollingWatcher(self.matcher, interval=self.interval))
+        self.inotify = inotify.Inotify()
+        self.dirs = {}
+        # watch descriptor -> names of the files in its directory
+        self.files = {}
+        self.fallback = None
+        self.out_of_watches = False
+        try:
+            self.pending = sorted(self._watch_tree('.', strict=True))
+        except OSError:
+            self.inotify.close()
+            raise
+
+    def _watch_tree(self, top, strict=False):
+        '''
+        Adds watches to top and all its subdirs, returning the files found. If
+        the kernel runs out of watches, raises if 'strict', otherwise notes it
+        in out_of_watches, and carries on finding files.
+        '''
+        found = []
+        for root, dirs, files in os.walk(top):
+            self.matcher.prune_dirs(root, dirs)
+            names = [
+                filename for filename in files
+                if not self.matcher.ignores_file(os.path.join(root, filename))
+            ]
+            if not self.out_of_watches:
+                try:
+                    wd = self.inotify.add_watch(root)
+                except OSError as exc:
+                    if exc.errno != errno.ENOSPC:
+                        # Directory vanished or is unreadable.
+                        continue
+                    if strict:
+                        raise
+                    self.out_of_watches = True
+                else:
+                    self.dirs[wd] = root
+                    self.files[wd] = set(names)
+            found.extend(os.path.join(root, filename) for filename in names)
+        return found
+
+    def _unwatch_tree(self, top):
+        '''
+        Removes the watches on top and all its subdirs, when it has been moved
+        away, returning the files which were in them.
+        '''
+        gone = []
+        for wd, root in list(self.dirs.items()):
+            if root == top or root.startswith(top + os.sep):
+                del self.dirs[wd]
+                self.inotify.rm_watch(wd)
+                gone.extend(
+                    os.path.join(root, filename)
+                    for filename in self.files.pop(wd, ())
+                )
+        return gone
+
+    def _read_changes(self):
+        changed = set()
+        for wd, mask, _, name in self.inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                # Events were lost, so we can't tell what changed.
+                changed.update(self._watch_tree('.'))
+                continue
+            if mask & inotify.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                self.files.pop(wd, None)
+                continue
+            root = self.dirs.get(wd)
+            if root is None or not name:
+                continue
+            relname = os.path.join(root, name)
+            if mask & inotify.IN_ISDIR:
+                if mask & inotify.IN_MOVED_FROM:
+                    changed.update(self._unwatch_tree(relname))
+                elif (
+                    mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO) and
+                    not self.matcher.ignores_dir(relname)
+                ):
+                    changed.update(self._watch_tree(relname))
+            elif not self.matcher.ignores_file(relname):
+                if mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                    self.files[wd].discard(name)
+                else:
+                    self.files[wd].add(name)
+                changed.add(relname)
+        return sorted(changed)
+
+    def get_changed_files(self):
+        if self.fallback:
+            return self.fallback.get_changed_files()
+        if self.pending is not None:
+            changed, self.pending = self.pending, None
+            return changed
+        changed = self._read_changes()
+        if self.out_of_watches:
+            sys.stderr.write(
+                'Out of inotify watches, falling back to polling.\n')
+            self.inotify.close()
+            self.fallback = self.get_fallback()
+            # This reports every file there is, which only tells the fallback
+            # what there is to look for changes to from now on.
+            self.fallback.get_changed_files()
+        return changed
+
+    def cache_size(self):
+        if self.fallback:
+            return self.fallback.cache_size()
+        return sum(len(names) for names in self.files.values())
+
+    def wait(self, timeout=None):
+        if self.fallback:
+            self.fallback.wait(timeout)
+        else:
+            self.inotify.wait(self.WAIT if timeout is None else timeout)
+
+    def close(self):
+        if self.fallback:
+            self.fallback.close()
+        self.inotify.close()
+
+
+class HybridWatcher(object):
+    '''
+    Puts inotify watches on only the most recently changed directories, up to
+    'max_watches' of them, and polls the rest like IncrementalWatcher does,
+    but less often. Edits to files being worked on are seen within
+    milliseconds, while the number of watches stays bounded, however big the
+    tree.
+
+    A directory gets a watch when a sweep finds a change in it, and loses it
+    when 'max_watches' more recently changed directories need one. If the
+    kernel runs out of watches, we make do with those we have.
+    '''
+    # With no timeout, how long to wait for events before returning anyway.
+    WAIT = 0.2
+    # How much longer than a polling watcher's the intervals between sweeps
+    # are, since most changes are in watched directories.
+    COLD_FACTOR = 5
+
+    def __init__(self, matcher, stat_interval, max_watches, interval=None):
+        self.matcher = matcher
+        interval = interval or PollInterval()
+        self.interval = PollInterval(
+            interval.max_interval, interval.max_interval * self.COLD_FACTOR)
+        self.cold = IncrementalWatcher(matcher, stat_interval, self.interval)
+        self.max_watches = max_watches
+        self.inotify = inotify.Inotify()
+        # dir path -> watch descriptor, least recently changed first
+        self.hot = OrderedDict()
+        # watch descriptor -> dir path
+        self.roots = {}
+        self.next_sweep = None
+
+    def _cool(self, root):
+        wd = self.hot.pop(root)
+        del self.roots[wd]
+        self.inotify.rm_watch(wd)
+
+    def _heat(self, root):
+        if root in self.hot:
+            self.hot.move_to_end(root)
+            return
+        while self.hot and len(self.hot) >= self.max_watches:
+            self._cool(next(iter(self.hot)))
+        if self.max_watches < 1:
+            return
+        try:
+            wd = self.inotify.add_watch(root)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                sys.stderr.write(
+                    'Out of inotify watches, watching the %d most recently '
+                    'changed directories.\n' % (len(self.hot),))
+                self.max_watches = len(self.hot)
+            # Otherwise, the directory vanished or is unreadable.
+            return
+        self.hot[root] = wd
+        self.roots[wd] = root
+
+    def _read_events(self):
+        '''
+        Returns the watched directories which have had events.
+        '''
+        dirty = set()
+        for wd, mask, _, _ in self.inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                dirty.update(self.hot)
+                continue
+            root = self.roots.get(wd)
+            if root is None:
+                continue
+            dirty.add(root)
+            if mask & inotify.IN_IGNORED:
+                # The directory was deleted, and its watch with it.
+                del self.roots[wd]
+                del self.hot[root]
+        return dirty
+
+    def _rescan(self, root, changed):
+        '''
+        Lists a watched directory, and any subdirs created or deleted in it.
+        '''
+        cached = self.cold.dirs.get(root)
+        if cached is None:
+            # Deleted since, or not seen by a sweep yet.
+            return
+        try:
+            dir_mtime = os.lstat(root).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        subdirs = self.cold.list_dir(root, dir_mtime, time.time(), changed)
+        for subdir in set(cached[2]) - set(subdirs):
+            self.cold.forget_dir(subdir, changed)
+        for subdir in set(subdirs) - set(cached[2]):
+            self.cold.dirs[subdir] = (None, {}, [])
+            self._rescan(subdir, changed)
+            self._heat(subdir)
+
+    def get_changed_files(self):
+        changed = []
+        for root in self._read_events():
+            self._rescan(root, changed)
+        now = time.time()
+        first_time = self.next_sweep is None
+        if first_time or now >= self.next_sweep:
+            swept = self.cold.get_changed_files()
+            self.next_sweep = time.time() + self.interval.current
+            if first_time:
+                return swept
+            changed.extend(swept)
+        for root in set(os.path.dirname(relname) for relname in changed):
+            if root in self.cold.dirs:
+                self._heat(root)
+        return sorted(set(changed))
+
+    def cache_size(self):
+        return self.cold.cache_size()
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            timeout = self.WAIT
+        if self.next_sweep is not None:
+            timeout = max(0, min(timeout, self.next_sweep - time.time()))
+        self.inotify.wait(timeout)
+
+    def close(self):
+        self.inotify.close()
+
+
+class ContentHashWatcher(object):
+    '''
+    Wraps another watcher, dropping any changed files whose contents hash the
+    same as last time, such as files which were merely touched. Every file
+    gets read once when first seen.
+    '''
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.matcher = watcher.matcher
+        self.hashes = FileStateTable(1)
+
+    def has_content_changed(self, filename):
+        try:
+            digest = (hash_file(filename),)
+        except (IOError, OSError):
+            # Deleted or unreadable.
+            self.hashes.discard(filename)
+            return True
+        if self.hashes.get(filename) != digest:
+            self.hashes.set(filename, digest)
+            return True
+        return False
+
+    def get_changed_files(self):
+        return [
+            filename for filename in self.watcher.get_changed_files()
+            if self.has_content_changed(filename)
+        ]
+
+    def cache_size(self):
+        return self.watcher.cache_size() + len(self.hashes)
+
+    def wait(self, timeout=None):
+        self.watcher.wait(timeout)
+
+    def close(self):
+        self.watcher.close()
+
+
+def get_backend(name, matcher, options):
+    interval = PollInterval(options.min_interval, options.max_interval)
+
+    def get_hybrid():
+        return HybridWatcher(
+            matcher, options.stat_interval, options.max_watches, interval)
+
+    if name == 'incremental':
+        return IncrementalWatcher(matcher, options.stat_interval, interval)
+    if name == 'inotify':
+        try:
+            return InotifyWatcher(matcher, interval, get_hybrid)
+        except OSError as exc:
+            if exc.errno != errno.ENOSPC:
+                raise
+            return get_hybrid()
+    if name == 'hybrid':
+        return get_hybrid()
+    if name == 'auto' and inotify.is_available():
+        try:
+            return InotifyWatcher(matcher, interval, get_hybrid)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                try:
+                    return get_hybrid()
+                except OSError:
+                    pass
+    return PollingWatcher(matcher, options.walk_threads, interval)
+
+
+def get_watcher(options, recorder=None):
+    '''
+    Returns the watcher backend named by options.watcher. 'auto' uses inotify
+    where available, and otherwise polls. If the kernel runs out of inotify
+    watches, it watches only recently changed directories, and polls the
+    rest. With --shared, changes come from the daemon for the current
+    directory instead. If given a stats.Stats, every sweep is recorded in it.
+    '''
+    matcher = get_matcher(options.ignore, SKIP_EXT, options.gitignore)
+    if recorder is not None:
+        matcher = stats.TimingMatcher(matcher)
+    if options.shared:
+        from .daemon import SharedWatcher
+        watcher = SharedWatcher(matcher, options)
+    else:
+        watcher = get_backend(options.watcher, matcher, options)
+    if options.content_hash:
+        watcher = ContentHashWatcher(watcher)
+    if recorder is not None:
+        watcher = stats.StatsWatcher(watcher, recorder)
+    return watcher
@@ -0,0 +1,218 @@
+'''
+With --python-worker, a Python command is run in a fork of a resident worker
+process (see worker_process.py), which has already imported the libraries
+that the command and the watched tree use, such as pytest, numpy or django,
+so that each run skips starting Python and importing them. The tree's own
+modules aren't imported in advance, so each run imports them afresh, as they
+are now. If a changed file is one the worker has imported, e.g. a settings
+module imported by a library, the worker is restarted.
+
+The command has to run Python directly: 'python -m module args',
+'python script.py args', or an installed Python script such as 'pytest args'.
+'''
+import asyncio
+import json
+import os
+import re
+import shlex
+import shutil
+import signal
+
+from .deps import get_graph, get_imported_names
+from .rerun import is_group_alive, STOP_GRACE
+
+
+WORKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'worker_process.py')
+
+
+class WorkerError(Exception):
+    pass
+
+
+def is_python(name):
+    return re.match(r'python[\d.]*$', os.path.basename(name)) is not None
+
+
+def read_shebang(filename):
+    '''
+    Returns the interpreter from the script's '#!' line, or None.
+    '''
+    try:
+        with open(filename, 'rb') as fp:
+            line = fp.readline(1024)
+    except (IOError, OSError):
+        return None
+    if not line.startswith(b'#!'):
+        return None
+    args = line[2:].decode('utf-8', 'replace').split()
+    if args and os.path.basename(args[0]) == 'env':
+        args = args[1:]
+    return args[0] if args else None
+
+
+def parse_command(command):
+    '''
+    Returns (python, kind, target, args), where python is the interpreter
+    the command runs, and kind is 'module' or 'path', saying whether target
+    is a module name, or the filename of a script. Raises WorkerError if the
+    command doesn't run Python.
+    '''
+    argv = shlex.split(command)
+    if argv and is_python(argv[0]):
+        python = shutil.which(argv[0])
+        rest = argv[1:]
+        if python and len(rest) >= 2 and rest[0] == '-m':
+            return python, 'module', rest[1], rest[2:]
+        if python and rest and not rest[0].startswith('-'):
+            return python, 'path', rest[0], rest[1:]
+    elif argv:
+        script = shutil.which(argv[0])
+        interpreter = read_shebang(script) if script else None
+        if interpreter and is_python(interpreter):
+            python = shutil.which(interpreter)
+            if python:
+                return python, 'path', script, argv[1:]
+    raise WorkerError(
+        '--python-worker needs a command which runs Python, such as '
+        '"python -m pytest" or "pytest", not: %s' % (command,))
+
+
+def get_preload(kind, target, options):
+    '''
+    Returns the names of the modules for the worker to import in advance:
+    the command's module, or those its script imports, and those the
+    watched tree imports, except for the tree's own.
+    '''
+    graph = get_graph(options)
+    names = graph.get_external_imports()
+    if kind == 'module':
+        names.add(target)
+    else:
+        try:
+            with open(target, 'rb') as fp:
+                names.update(get_imported_names(target, fp.read()))
+        except (IOError, OSError, SyntaxError, ValueError):
+            pass
+    return sorted(name for name in names if not graph.is_local(name))
+
+
+class PythonWorker(object):
+    '''
+    Runs Python commands in forks of a worker process, which it starts when
+    first needed, and restarts when the worker has imported changed files,
+    or a command needs a different interpreter.
+    '''
+    def __init__(self, options):
+        self.options = options
+        self.python = None
+        self.process = None
+        self.replies = None
+
+    async def _start(self, python, kind, target):
+        loop = asyncio.get_running_loop()
+        preload = await loop.run_in_executor(
+            None, get_preload, kind, target, self.options)
+        read_fd, write_fd = os.pipe()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                python, WORKER_SCRIPT, str(write_fd),
+                stdin=asyncio.subprocess.PIPE, pass_fds=(write_fd,),
+            )
+        finally:
+            os.close(write_fd)
+        self.python = python
+        self.replies = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(self.replies),
+            os.fdopen(read_fd, 'rb'),
+        )
+        self._send(preload=preload)
+        await self._reply()
+
+    def _send(self, **message):
+        self.process.stdin.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    async def _reply(self):
+        line = await self.replies.readline()
+        if not line:
+            await self.close()
+            raise WorkerError('The Python worker exited unexpectedly.')
+        return json.loads(line.decode('utf-8'))
+
+    async def _stop_child(self, pid, grace=STOP_GRACE):
+        if is_group_alive(pid):
+            os.killpg(pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self._reply(), grace)
+        except asyncio.TimeoutError:
+            if is_group_alive(pid):
+                os.killpg(pid, signal.SIGKILL)
+            await self._reply()
+
+    async def _abandon(self, requested):
+        '''
+        Kills the worker when a run is cancelled before its child's pid is
+        known, since its replies to that run would otherwise be read by the
+        next one, which starts a fresh worker instead. If the run was
+        requested, the child is stopped first, once its pid arrives.
+        '''
+        if requested:
+            try:
+                reply = await asyncio.wait_for(self._reply(), STOP_GRACE)
+                if 'pid' in reply:
+                    await self._stop_child(reply['pid'])
+            except (asyncio.TimeoutError, WorkerError, ValueError):
+                pass
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        await self.close()
+
+    async def run(self, command, changed_files, variables=None):
+        '''
+        Runs the command in a fork of the worker, with the given environment
+        variables added to the worker's, and returns its exit status. If
+        cancelled, stops the command and everything it started.
+        '''
+        python, kind, target, args = parse_command(command)
+        if python != self.python:
+            await self.close()
+        variables = variables or {}
+        requested = False
+        try:
+            if self.process is None:
+                await self._start(python, kind, target)
+                # It has only just imported everything.
+                changed_files = []
+            self._send(
+                run=[kind, target, args], changed=changed_files,
+                env=variables)
+            requested = True
+            reply = await self._reply()
+            if 'restart' in reply:
+                requested = False
+                await self.close()
+                await self._start(python, kind, target)
+                self._send(
+                    run=[kind, target, args], changed=[], env=variables)
+                requested = True
+                reply = await self._reply()
+        except asyncio.CancelledError:
+            await self._abandon(requested)
+            raise
+        pid = reply['pid']
+        try:
+            return (await self._reply())['returncode']
+        except asyncio.CancelledError:
+            await self._stop_child(pid)
+            raise
+
+    async def close(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            # The worker exits when its stdin is closed.
+            self.process.stdin.close()
+        await self.process.wait()
+        self.process = None
+        self.python = None
@@ -0,0 +1,145 @@
+'''
+The resident worker process for --python-worker. It is run as a script, by
+the Python interpreter the command uses, which might not have rerun
+installed, so it uses nothing but the standard library:
+
+    python worker_process.py FD
+
+It reads requests from stdin, and writes replies to file descriptor FD, each
+a line of JSON:
+
+    {"preload": [names]}    Imports the named modules, ignoring failures.
+                            Replies {"ready": true}.
+    {"run": [kind, target, args], "changed": [filenames], "env": {vars}}
+                            Forks, and in the child runs the target, a module
+                            ("module") or a script ("path"), with the given
+                            args, and the given variables added to its
+                            environment. Replies {"pid": pid} once it has
+                            started, then {"returncode": n} when it exits. If
+                            any of the changed files have been imported by
+                            this process, they can't be reloaded in place, so
+                            instead replies {"restart": [filenames]} and
+                            exits, to be started afresh.
+
+The worker exits when stdin is closed.
+'''
+import json
+import os
+import runpy
+import signal
+import sys
+
+
+def preload(names):
+    for name in names:
+        try:
+            __import__(name)
+        except (Exception, SystemExit):
+            # Not a module, or not importable until the command has set
+            # things up. Either way, the command will import it if it can.
+            pass
+
+
+def get_loaded_files():
+    loaded = set()
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            loaded.add(os.path.abspath(filename))
+    return loaded
+
+
+def get_exit_code(exc):
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    sys.stderr.write('%s\n' % (exc.code,))
+    return 1
+
+
+def get_returncode(status):
+    # As subprocess reports it: negative if killed by a signal.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_child(kind, target, args, env):
+    '''
+    Runs the target as if from the command line, then exits with its status.
+    Never returns.
+    '''
+    code = 1
+    try:
+        os.environ.update(env)
+        # A group of its own, so that rerun can stop it along with anything
+        # it starts, as it does for commands run by the shell.
+        os.setsid()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        sys.argv = [target] + list(args)
+        if kind == 'module':
+            runpy.run_module(target, run_name='__main__', alter_sys=True)
+        else:
+            sys.path[0] = os.path.dirname(os.path.abspath(target))
+            runpy.run_path(target, run_name='__main__')
+        code = 0
+    except SystemExit as exc:
+        code = get_exit_code(exc)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def run(request, reply):
+    '''
+    Handles a "run" request. Returns False if the worker should exit.
+    '''
+    changed = set(
+        os.path.abspath(filename) for filename in request['changed'])
+    stale = sorted(changed & get_loaded_files())
+    if stale:
+        reply(restart=stale)
+        return False
+    kind, target, args = request['run']
+    pid = os.fork()
+    if pid == 0:
+        run_child(kind, target, args, request.get('env', {}))
+    reply(pid=pid)
+    _, status = os.waitpid(pid, 0)
+    reply(returncode=get_returncode(status))
+    return True
+
+
+def main(args):
+    replies = os.fdopen(int(args[0]), 'w')
+
+    def reply(**message):
+        replies.write(json.dumps(message) + '\n')
+        replies.flush()
+
+    # Run from rerun's directory, i.e. the directory being watched, rather
+    # than from the directory this script is in, as 'python -m' would.
+    sys.path[0] = os.getcwd()
+    # Ctrl-C is for the command, and for rerun, which stops us.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for line in sys.stdin:
+        request = json.loads(line)
+        if 'preload' in request:
+            preload(request['preload'])
+            reply(ready=True)
+        elif not run(request, reply):
+            break
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])